@@ -244,9 +244,13 @@ def main():
 
         modules.log('Starting data collection')
         time.sleep(20)
-        os.system('sudo systemctl start diagnostics')
+        # data collection, diagnostics and the sender all run in the
+        # supervisor's process, the standalone services must not run
+        # alongside it (sender.service would upload the same files)
+        for service in ('sender', 'diagnostics'):
+            os.system(f'sudo systemctl disable --now {service}')
         os.system('python3 ' +
-                  f'{os.path.join(modules.HOME, "data_collection.py")}')
+                  f'{os.path.join(modules.HOME, "supervisor.py")}')
 
     return 0
 
@@ -20,33 +20,58 @@ You should have received a copy of the GNU General Public License along with
 '''
 
 
-import serial
-import pigpio
+from __future__ import annotations  # hardware types are only annotations
 import time
-import pynmea2
-from pynmea2.nmea import ChecksumError, ParseError
 import datetime as dt
-from adafruit_bme280 import advanced as adafruit_bme280
-# pip3 install adafruit-circuitpython-bme280
-import adafruit_ms8607
-# pip3 install adafruit-circuitpython-ms8607
-import adafruit_scd30
-# pip3 install adafruit-circuitpython-scd30 
-import board
-import busio
 import sys
-
-# ----- Imports for the sps30 dust sensor. -----
-# download from: https://github.com/dvsu/sps30 (MIT license) and unpack
-# in 'sps30_for_ACCESS', must be a subfolder of the folder containing
-# 'ACCESS_station_lib.py'.
-try:
-    sys.path.append('/home/pi/sps30_for_ACCESS')
-    from sps30_for_ACCESS.sps30 import SPS30
-except ModuleNotFoundError:
-    print("SPS30 library not found: you won't be able to use the sps30 " +
-          "dust sensor.")
-# ----- end imports for the sps30 dust sensor. -----
+import importlib
+import threading
+from typing import TYPE_CHECKING
+from collections import deque
+from contextlib import nullcontext
+import packages.nmea as nmea
+from packages.stats import StatsWindow
+
+# Hardware drivers are only imported by the beseechers using them, through
+# driver(), so importing this library stays cheap for tools that don't talk
+# to the sensors. Drivers and where to get them:
+#   serial              pip3 install pyserial
+#   pigpio              pip3 install pigpio
+#   adafruit_bme280     pip3 install adafruit-circuitpython-bme280
+#   adafruit_ms8607     pip3 install adafruit-circuitpython-ms8607
+#   adafruit_scd30      pip3 install adafruit-circuitpython-scd30
+#   board, busio        pip3 install adafruit-blinka
+#   sps30_for_ACCESS    download from: https://github.com/dvsu/sps30 (MIT
+#                       license) and unpack in 'sps30_for_ACCESS', must be a
+#                       subfolder of SPS30_PATH
+# packages/simulation.py provides stand-ins for all of them (except the
+# SPS30's) to run the station without a Pi, see SIMULATED
+
+if TYPE_CHECKING:  # only for annotations, the station loads it lazily
+    import busio
+
+SPS30_PATH = '/home/pi/sps30_for_ACCESS'
+
+# pyserial constants, kept here so the defaults don't need the driver
+PARITY_NONE = 'N'
+PARITY_EVEN = 'E'
+STOPBITS_ONE = 1
+EIGHTBITS = 8
+
+# drivers replacing the hardware ones, {module name: module}, filled by
+# packages/simulation.py
+SIMULATED = {}
+
+
+def driver(name: str):
+    """
+    Imports a hardware driver, only the first call actually loads it
+    @param name module name (i.e 'adafruit_scd30')
+    @return the module, its simulated stand-in if there is one
+    """
+    if name in SIMULATED:
+        return SIMULATED[name]
+    return importlib.import_module(name)
 
 ##########
 
@@ -55,9 +80,9 @@ class GPSbeseecher:
     def __init__(self,
                  port='/dev/ttySOFT0',
                  baudrate=9600,
-                 parity=serial.PARITY_NONE,
-                 stopbits=serial.STOPBITS_ONE,
-                 bytesize=serial.EIGHTBITS,
+                 parity=PARITY_NONE,
+                 stopbits=STOPBITS_ONE,
+                 bytesize=EIGHTBITS,
                  timeout=0.5
                  ):
         self.serialprms = {
@@ -88,7 +113,7 @@ class GPSbeseecher:
             'HDOP': None,
             'VDOP': None,
         }
-        with serial.Serial(**self.serialprms) as ser:
+        with driver('serial').Serial(**self.serialprms) as ser:
             GGA_done = False
             RMC_done = False
             GSA_done = False
@@ -96,34 +121,24 @@ class GPSbeseecher:
             while time.time() - start < timeout:
                 # At startup readline may get a chopped, undecodable nmea
                 # string
-                # Decoded strings may still contain gibberish: must catch
-                # checksum and parse errors, too.
+                # Decoded strings may still contain gibberish, the parser
+                # returns None for those and for sentences we don't use
                 try:
                     newdata = ser.readline().decode('ascii')
-                    q = pynmea2.parse(newdata)
-                except (UnicodeDecodeError, ChecksumError, ParseError):
+                except UnicodeDecodeError:
                     continue  # Just ignore invalid data and keep trying
-                if q.sentence_type == 'GGA':
-                    if q.gps_qual is None:
-                        continue
-                    if q.gps_qual > 0:
-                        gpsfix['time'] = q.timestamp.isoformat()
-                        gpsfix['latitude'] = q.latitude
-                        gpsfix['longitude'] = q.longitude
-                        gpsfix['lat_dir'] = q.lat_dir
-                        gpsfix['lon_dir'] = q.lon_dir
-                        gpsfix['altitude'] = q.altitude
-                        gpsfix['alt_unit'] = q.altitude_units
-                        gpsfix['num_sats'] = int(q.num_sats)
-                        GGA_done = True
-                if q.sentence_type == 'RMC':
-                    if hasattr(q.datestamp, 'isoformat'):
-                        gpsfix['date'] = q.datestamp.isoformat()
-                        RMC_done = True
-                if q.sentence_type == 'GSA':
-                    gpsfix['PDOP'] = float(q.pdop)
-                    gpsfix['HDOP'] = float(q.hdop)
-                    gpsfix['VDOP'] = float(q.vdop)
+                sentence = nmea.parse(newdata.strip())
+                if sentence is None:
+                    continue
+                sentence_type, values = sentence
+                if sentence_type == 'GGA':
+                    gpsfix.update(values)
+                    GGA_done = True
+                if sentence_type == 'RMC':
+                    gpsfix['date'] = values['date']
+                    RMC_done = True
+                if sentence_type == 'GSA':
+                    gpsfix.update(values)
                     GSA_done = True
                 if GGA_done and RMC_done and GSA_done:
                     break
@@ -138,10 +153,69 @@ class GPSbeseecher:
 ##########
 
 
+class PollingThread(threading.Thread):
+    """
+    Daemon thread calling 'target' every 'interval' seconds until stopped,
+    used to keep reading a device in the background. Exceptions raised by
+    'target' are kept and polling goes on: the owner reports them from its
+    measurements, through take_errors()
+    """
+
+    def __init__(self, target, interval, name=None):
+        super().__init__(name=name, daemon=True)
+        self.target = target
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._errors = 0  # failed calls since the last take_errors()
+        self._last_error = None
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.target()
+            except Exception as e:
+                self._errors, self._last_error = self._errors + 1, e
+            self._stop_event.wait(self.interval)
+
+    def take_errors(self):
+        """
+        Returns (number of failed calls, last exception or None) since the
+        previous call, and starts counting again
+        """
+        errors, last_error = self._errors, self._last_error
+        self._errors, self._last_error = 0, None
+        return errors, last_error
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def polling_error(message, poller):
+    """
+    Builds the error raised when a background reader has nothing to report,
+    with the reason its reads failed if they did
+    """
+    errors, last_error = poller.take_errors()
+    if last_error is not None:
+        message += f' ({errors} failed reads, last: {last_error})'
+    return ValueError(message)
+
+
 class GPSbeseecherGPIO:
     # recall to install the daemon with 'sudo systemctl start pigpiod'
     # pigpio's software serial does not have explicit parity and stop bits
 
+    # The bit-banged serial is kept open and read by a background thread
+    # which keeps the latest GGA, RMC and GSA sentences. fix() only copies
+    # them, so it returns immediately instead of listening for ~20 s. The
+    # 'fix_age' key tells how many seconds ago the position was read. A
+    # position older than MAX_FIX_AGE (the receiver lost its fix or stopped
+    # sending) is not returned, only its age
+
+    POLL_INTERVAL = 1  # seconds between reads of pigpio's buffer
+    MAX_LINE = 128  # longest partial nmea sentence kept between reads
+    MAX_FIX_AGE = 10  # seconds, receivers send a position every second
+
     def __init__(self,
                  RX_pin=27,
                  baudrate=9600,
@@ -150,10 +224,71 @@ class GPSbeseecherGPIO:
         self.RX_pin = int(RX_pin)
         self.baudrate = int(baudrate)
         self.bytesize = int(bytesize)
+        pigpio = driver('pigpio')
         self.gpio = pigpio.pi()
         self.gpio.set_mode(RX_pin, pigpio.INPUT)
 
+        # latest sentences, {sentence_type: (values, time.monotonic())}
+        self._sentences = {}
+        self._lock = threading.Lock()
+        self._fixed = threading.Event()  # set once the first fix is read
+        self._partial = b''  # start of a sentence still being received
+
+        self._started = time.monotonic()
+        self.gpio.bb_serial_read_open(self.RX_pin,
+                                      self.baudrate,
+                                      self.bytesize)
+        self.reader = PollingThread(self._read, self.POLL_INTERVAL,
+                                    name='gps_reader')
+        self.reader.start()
+
+    def _read(self):
+        """
+        Parses all the sentences received since the last call
+        """
+        count, data = self.gpio.bb_serial_read(self.RX_pin)
+        if count <= 0:
+            return
+
+        lines = (self._partial + bytes(data)).split(b'\n')
+        # the last line may still be arriving
+        self._partial = lines.pop()[-self.MAX_LINE:]
+
+        received = time.monotonic()
+        for line in lines:
+            try:
+                newdata = line.decode('ascii').strip()
+            except UnicodeDecodeError:
+                continue  # Just ignore invalid data and keep trying
+            sentence = nmea.parse(newdata)
+            if sentence is not None:
+                self._update(*sentence, received)
+
+    def _update(self, sentence_type, values, received):
+        """
+        Keeps the values of a parsed sentence
+        """
+        if sentence_type == 'GGA':
+            # the time comes from the RMC sentence, along with the date
+            values.pop('time')
+        elif sentence_type == 'RMC':
+            # only trust the receiver's clock once it has a valid fix
+            if not values['valid']:
+                return
+            values = dt.datetime.fromisoformat(
+                f'{values["date"]}T{values["time"]}')
+
+        with self._lock:
+            self._sentences[sentence_type] = (values, received)
+        if sentence_type == 'GGA':
+            self._fixed.set()
+
     def fix(self, timeout=15):
+        """
+        Returns the latest position read by the background thread
+        Only blocks while the receiver is acquiring its first fix, for at
+        most 'timeout' seconds after the object was created
+        """
         if type(timeout) not in (int, float):
             timeout = 15
         if timeout < 1:
@@ -171,68 +306,48 @@ class GPSbeseecherGPIO:
             'PDOP': None,
             'HDOP': None,
             'VDOP': None,
+            'fix_age': None,
         }
-        self.gpio.bb_serial_read_open(self.RX_pin,
-                                      self.baudrate,
-                                      self.bytesize)
-        GGA_done = False
-        RMC_done = False
-        GSA_done = False
-        time.sleep(3)  # fill the buffer
-        start = time.time()
-        while time.time() - start < timeout:
-            count, data = self.gpio.bb_serial_read(self.RX_pin)
-            datalines = data.split()
-
-            for line in datalines:
-                try:
-                    newdata = line.decode('ascii')
-                    q = pynmea2.parse(newdata)
-                except (UnicodeDecodeError, ChecksumError, ParseError):
-                    continue  # Just ignore invalid data and keep trying
-                try:
-                    if q.sentence_type == 'GGA':
-                        if q.gps_qual is not None and q.gps_qual > 0:
-                            gpsfix['time'] = q.timestamp.isoformat()
-                            gpsfix['latitude'] = q.latitude
-                            gpsfix['longitude'] = q.longitude
-                            gpsfix['lat_dir'] = q.lat_dir
-                            gpsfix['lon_dir'] = q.lon_dir
-                            gpsfix['altitude'] = q.altitude
-                            gpsfix['alt_unit'] = q.altitude_units
-                            gpsfix['num_sats'] = int(q.num_sats)
-                            GGA_done = True
-                    if q.sentence_type == 'RMC':
-                        if hasattr(q.datestamp, 'isoformat'):
-                            gpsfix['date'] = q.datestamp.isoformat()
-                            RMC_done = True
-                    if q.sentence_type == 'GSA':
-                        gpsfix['PDOP'] = float(q.pdop)
-                        gpsfix['HDOP'] = float(q.hdop)
-                        gpsfix['VDOP'] = float(q.vdop)
-                        GSA_done = True
-                except Exception as e:
-                    print(q)
-                    print(e)
-                    continue
-                if GGA_done and RMC_done and GSA_done:
-                    break
-            if GGA_done and RMC_done and GSA_done:
-                break
-            else:
-                time.sleep(3)  # re-fill the buffer
-        self.gpio.bb_serial_read_close(self.RX_pin)
+
+        if (remaining := self._started + timeout - time.monotonic()) > 0:
+            self._fixed.wait(remaining)
+
+        with self._lock:
+            sentences = dict(self._sentences)
+        now = time.monotonic()
+
+        # a stale position would be stamped on new records
+        if 'GGA' in sentences:
+            values, received = sentences['GGA']
+            if now - received <= self.MAX_FIX_AGE:
+                gpsfix.update(values)
+            gpsfix['fix_age'] = round(now - received, 1)
+        if 'GSA' in sentences and \
+                now - sentences['GSA'][1] <= self.MAX_FIX_AGE:
+            gpsfix.update(sentences['GSA'][0])
+
+        # the receiver's clock, advanced by the time since it was read
+        if 'RMC' in sentences:
+            stamp, received = sentences['RMC']
+            clock = stamp + dt.timedelta(seconds=now - received)
+            gpsfix['date'] = clock.date().isoformat()
+            gpsfix['time'] = clock.time().isoformat(timespec='seconds')
 
         # If GPS doesn't work, just set the time using the computer's clock.
         if gpsfix['time'] is None:
             CPUdate, CPUtime = dt.datetime.utcnow().isoformat().split('T')
             gpsfix['time'] = CPUtime.split('.')[0]
             gpsfix['date'] = CPUdate
-        if gpsfix['date'] is None:
-            CPUdate, CPUtime = dt.datetime.utcnow().isoformat().split('T')
-            gpsfix['date'] = CPUdate
         return gpsfix
 
+    def close(self):
+        """
+        Stops the background reader and releases the pin
+        """
+        self.reader.stop()
+        self.reader.join()
+        self.gpio.bb_serial_read_close(self.RX_pin)
+
 
 ##########
 
@@ -258,7 +373,32 @@ class Beseecher:
     dictionary returned contain ".". Mongo uses "." for queries and thus keys
     containing "." such as "PM2.5count" in the NEXTPMBeseecher must be written
     as "PM2,5count" instead
+
+    Beseechers may override the following to set their own cadence:
+        .PERIOD seconds between two measurements. data_collection writes a
+            record every SAMPLING_INTERVAL with the latest measurement of
+            each sensor
+        .WARMUP seconds a measurement takes (i.e the sensor's fan spinning
+            up), data_collection starts the sensor that much earlier so that
+            its measurement is ready for the record
+        .TIMEOUT seconds after which a measurement is abandoned and reported
+            as timed out
+        .prepare() readies the sensor for its next measurement (i.e spins up
+            its fan), data_collection calls it WARMUP seconds before
+            .measure()
+        .release(idle) is called after each measurement with the seconds
+            until the next .prepare(), the sensor may power down meanwhile
+
+    Beseechers on a shared I2C bus keep it in .i2c and read their sensor
+    within .bus_session(), so that a reading's registers are read back to
+    back (see packages/i2cbus.py)
     '''
+    PERIOD = 600
+    WARMUP = 0
+    TIMEOUT = 30
+
+    i2c = None
+
     def __init__(self, sensor: str, sens_type: str, index: int = 0) -> None:
         self.SENSOR = sensor
         self.TYPE = sens_type
@@ -267,6 +407,77 @@ class Beseecher:
     def measure(self) -> dict:
         return {}
 
+    def prepare(self) -> None:
+        return None
+
+    def release(self, idle: float) -> None:
+        return None
+
+    def bus_session(self):
+        '''
+        @return context holding the sensor's I2C bus if it is shared, doing
+            nothing otherwise
+        '''
+        session = getattr(self.i2c, 'session', None)
+        return session() if session is not None else nullcontext()
+
+
+class SampledBeseecher(Beseecher):
+    '''
+    Parent of the beseechers that sample their sensor in the background every
+    SAMPLE_INTERVAL seconds, much faster than data is reported
+    Samples are not kept: streaming statistics are updated instead (see
+    packages/stats.py) and .measure() returns those of the samples taken since
+    its previous call. The mean is reported under the metric's name (i.e
+    'temperature'), along with 'temperature_std', 'temperature_min',
+    'temperature_max', 'temperature_p10', 'temperature_p50',
+    'temperature_p90' and 'samples'
+    Children must implement .sample(), returning a dictionary of
+    metric-value pairs, and call .start_sampling() once the sensor is set up
+    '''
+    SAMPLE_INTERVAL = 2
+
+    def start_sampling(self, metrics: tuple) -> None:
+        '''
+        Starts the thread sampling the sensor
+        @param metrics names of the metrics .sample() returns
+        '''
+        self.window = StatsWindow(metrics)
+        self.window_lock = threading.Lock()
+        self.sampler = PollingThread(self._sample, self.SAMPLE_INTERVAL,
+                                     name=f'{self.TYPE}_sampler')
+        self.sampler.start()
+
+    def sample(self) -> dict:
+        return {}
+
+    def _sample(self) -> None:
+        with self.bus_session():
+            values = self.sample()
+        with self.window_lock:
+            self.window.update(values)
+
+    def measure(self) -> dict:
+        '''
+        Summarizes the samples taken since the last call and starts a new
+        window
+        @return dictionary of statistics
+        '''
+        with self.window_lock:
+            summary = self.window.summary()
+            self.window.reset()
+
+        if summary is None:
+            raise polling_error(f'No samples taken by {self.TYPE}',
+                                self.sampler)
+        self.sampler.take_errors()  # some samples were taken, errors cleared
+
+        return {
+            'type': self.TYPE,
+            'sensor': f'{self.SENSOR}{self.index}',
+            **summary
+        }
+
 
 ##########
 
@@ -288,8 +499,13 @@ class NEXTPMbeseecher(Beseecher):
     pm.measurePM_10_seconds() - measures PM1, PM2.5, PM10 averaging over 10 s
     pm.measurePM_1_minute()   - measures PM1, PM2.5, PM10 averaging over 1 m
     pm.measurePM_15_minutes() - measures PM1, PM2.5, PM10 averaging over 15 m
-    pm.measure() - starts up measurements (using measure_PM_1_minute) but
-        additionally controls ON / OFF depending on humidity
+    pm.prepare() - powers the sensor on ahead of measure()
+    pm.measure() - measures using measure_PM_1_minute, without waiting if
+        prepare() was called WARMUP seconds earlier
+    pm.release(idle) - powers the sensor off after measure() unless the
+        humidity is high or it would be off for less than MIN_OFF_TIME
+    pm.duty_report() - seconds the fan was on and seconds measurements
+        waited for it
     pm.get_firmware_version() - returns a hex number in a 4-character string
 
     Note that the measurement methods are blocking, for a time
@@ -331,6 +547,33 @@ class NEXTPMbeseecher(Beseecher):
         'Get_firmware_version': b'\x81\x17\x68',
     }
 
+    # length of the sensor's reply to each command, by command byte. A
+    # sleeping sensor answers the measurement commands with a status reply
+    # (command byte 0x16), hence replies are framed by their own command byte
+    REPLY_LEN = {
+        0x11: 16,
+        0x12: 16,
+        0x13: 16,
+        0x14: 8,
+        0x15: 4,
+        0x16: 4,
+        0x17: 6,
+    }
+    HEADER_LEN = 3  # address, command, state
+    REPLY_TIMEOUT = 0.5  # seconds allowed for a whole reply to arrive
+    N_ATTEMPTS = 3
+
+    # measure() averages over a minute once the fan has run for 2 minutes,
+    # prepare() powers it on a few seconds earlier than that
+    PERIOD = 600
+    ACQUISITION_TIME = 120
+    WARMUP = ACQUISITION_TIME + 5
+    TIMEOUT = 180  # warm up plus the retries of a few commands
+    # the fan is kept on rather than switched off for less than this many
+    # seconds, spinning it up again costs a whole warm up
+    MIN_OFF_TIME = 300
+    RH_KEEP_ON = 55.0  # humidity above which the fan is kept on
+
     SLEEP_BIT = 1
     DEGRADED_BIT = 2
     NOTREADY_BIT = 4
@@ -343,18 +586,25 @@ class NEXTPMbeseecher(Beseecher):
     # the first 4 commands when the sensor is switched on.
     INVALID_ANSW = 22
 
+    # open ports shared by all the instances in this process, the lock
+    # makes sure a command and its reply are never interleaved with another
+    # {port: (serial.Serial, threading.Lock)}
+    _ports = {}
+    _ports_lock = threading.Lock()
+
     def __init__(self,
                  port='/dev/ttyAMA0',
                  baudrate=115200,
-                 parity=serial.PARITY_EVEN,
-                 stopbits=serial.STOPBITS_ONE,
-                 bytesize=serial.EIGHTBITS,
+                 parity=PARITY_EVEN,
+                 stopbits=STOPBITS_ONE,
+                 bytesize=EIGHTBITS,
                  timeout=1.0,
                  index=0
                  ):
         # initialize parent class
         super().__init__('particulate_matter', 'nextpm', index)
 
+        self.serial = driver('serial')
         self.port = port
         self.serialprms = {
             'port':     port,
@@ -365,12 +615,26 @@ class NEXTPMbeseecher(Beseecher):
             'timeout':  timeout,
         }
 
+        # state byte of the last reply, reused instead of asking the sensor
+        # while a measurement is running
+        self._last_state = None
+        self._cache_state = False
+
+        # fan duty cycle: monotonic time it was last seen switched on, and
+        # seconds it was on and measurements waited for it since the last
+        # duty_report()
+        self._on_since = None
+        self._on_time = 0.0
+        self._warmup_wait = 0.0
+        self._last_RH = None
+
+        self.time_of_powerON = None
         self._test_uart()
 
         # Make sure that the on/off status of the object reflects that
         # of the hardware. The following doesn't change the
         # sensor's actual on/off status
-        if self._get_status()[2] & self.SLEEP_BIT == 1:
+        if self._state() & self.SLEEP_BIT:
             self.powerOFF()
         else:
             self.powerON()
@@ -380,36 +644,84 @@ class NEXTPMbeseecher(Beseecher):
             raise TypeError("'bstring' must be of type 'bytes'")
         return (256 - sum([x for x in bstring]) % 256) % 256
 
+    def _open_port(self):
+        """
+        Returns the open serial port and its lock, opening the port the
+        first time it is used
+        """
+        with self._ports_lock:
+            if self.port not in self._ports or \
+                    not self._ports[self.port][0].is_open:
+                lock = self._ports.get(self.port, (None, threading.Lock()))[1]
+                self._ports[self.port] = \
+                    (self.serial.Serial(**self.serialprms), lock)
+            return self._ports[self.port]
+
+    def _close_port(self):
+        """
+        Closes the shared port so that the next command reopens it, used
+        after a serial error
+        """
+        with self._ports_lock:
+            if self.port in self._ports:
+                self._ports[self.port][0].close()
+
+    def _read_reply(self, ser):
+        """
+        Reads a single reply, using its command byte to know its length
+        Returns whatever arrived if the deadline passes first
+        """
+        deadline = time.monotonic() + self.REPLY_TIMEOUT
+        rply = b''
+        length = self.HEADER_LEN
+        while len(rply) < length:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            ser.timeout = remaining
+            rply += ser.read(length - len(rply))
+            if len(rply) >= 2:
+                length = self.REPLY_LEN.get(rply[1], self.HEADER_LEN + 1)
+        return rply
+
     def _send_cmd_get_rply(self, cmd):
-        sleep_time = 0.5
-        N_attempts = 3
-        for i in range(N_attempts):
-            if not isinstance(cmd, bytes):
-                raise TypeError("'cmd' must be of type 'bytes'")
-            with serial.Serial(**self.serialprms) as ser:
-                ser.write(cmd)
-                time.sleep(sleep_time)
-                rply = ser.read_all()
-                if rply == b'':
-                    time.sleep(sleep_time*(i+1))
-                    continue
-            if self._checksum(rply[:-1]) == rply[-1]:
+        if not isinstance(cmd, bytes):
+            raise TypeError("'cmd' must be of type 'bytes'")
+        rply = b''
+        for i in range(self.N_ATTEMPTS):
+            try:
+                ser, lock = self._open_port()
+                with lock:
+                    # drop anything left over from a previous failed read
+                    ser.reset_input_buffer()
+                    ser.write(cmd)
+                    rply = self._read_reply(ser)
+            except self.serial.SerialException:
+                self._close_port()
+                time.sleep(0.1*(i+1))
+                continue
+            if len(rply) > self.HEADER_LEN and \
+                    len(rply) == self.REPLY_LEN.get(rply[1], 0) and \
+                    self._checksum(rply[:-1]) == rply[-1]:
                 break
-            time.sleep(sleep_time*(i+1))
+            time.sleep(0.1*(i+1))
         else:
             raise ValueError(
                 f'NextPM on port {self.port} replied an empty string or ' +
                 'failed the checksum.\n' +
-                'Last reply after {N_attempts} was:\n' +
+                f'Last reply after {self.N_ATTEMPTS} attempts was:\n' +
                 f'{rply}')
+        # every reply carries the sensor's state
+        self._last_state = rply[2]
         return rply
 
     # attempt to read connection of serial ports
     def _test_uart(self):
         try:
-            with serial.Serial(**self.serialprms) as ser:
-                _ = ser.read_all()
-                return True
+            ser, lock = self._open_port()
+            with lock:
+                ser.reset_input_buffer()
+            return True
         except Exception as err:
             print('Please check your serial connections. The port given ' +
                   'could not be accessed.')
@@ -420,23 +732,43 @@ class NEXTPMbeseecher(Beseecher):
     def _get_status(self):
         return self._send_cmd_get_rply(self.NextPMcmd['Get_status'])
 
+    def _state(self):
+        """
+        Returns the sensor's state byte. During a measurement the state
+        carried by the last reply is used, otherwise the sensor is asked
+        """
+        if self._cache_state and self._last_state is not None:
+            return self._last_state
+        return self._get_status()[2]
+
     def powerON(self):
         """
         Switches on the sensor's fan and laser. If the sensor is already on
-        only resets 'self.time_of_powerON'
+        'self.time_of_powerON' is kept, so that a warm sensor is not waited
+        for again, and only set if unknown
         """
-        if self._get_status()[2] & self.SLEEP_BIT == 1:
+        if self._state() & self.SLEEP_BIT:
             self._send_cmd_get_rply(self.NextPMcmd['Toggle_PWR'])
-        self.time_of_powerON = time.time()
+            # the sensor needs a moment to report its new state
+            self._last_state = None
+            self.time_of_powerON = None
+        if self.time_of_powerON is None:
+            self.time_of_powerON = time.time()
+        if self._on_since is None:
+            self._on_since = time.monotonic()
 
     def powerOFF(self):
         """
         Switches off the sensor's fan and laser. If the sensor is already
-        on only resets 'self.time_of_powerON'
+        off only resets 'self.time_of_powerON'
         """
-        if self._get_status()[2] & self.SLEEP_BIT == 0:
+        if not self._state() & self.SLEEP_BIT:
             self._send_cmd_get_rply(self.NextPMcmd['Toggle_PWR'])
+            self._last_state = None
         self.time_of_powerON = None
+        if self._on_since is not None:
+            self._on_time += time.monotonic() - self._on_since
+            self._on_since = None
 
     def is_ON(self):
         """
@@ -444,7 +776,7 @@ class NEXTPMbeseecher(Beseecher):
         interrogates the sensor's hardware, and resets the state of the
         NEXTPMbeseecher instance's internal timer if necessary
         """
-        if self._get_status()[2] & self.SLEEP_BIT == 1:
+        if self._state() & self.SLEEP_BIT:
             # The following 'if' is unnecessary if there's only 1 object
             # of this class. With multiple object (maybe in different
             # processes) the status recorded in self.time_of_powerON
@@ -468,10 +800,11 @@ class NEXTPMbeseecher(Beseecher):
             self.powerON()
         time_elapsed_ON = time.time() - self.time_of_powerON
         if time_elapsed_ON < acquisition_time:
+            self._warmup_wait += acquisition_time - time_elapsed_ON
             time.sleep(acquisition_time - time_elapsed_ON)
         # Acquires sensor's Temperature and RH
         res = self._send_cmd_get_rply(self.NextPMcmd['Get_T_RH'])
-        if (res[1] == self.INVALID_ANSW) or (res[2] & self.SLEEP_BIT == 1):
+        if (res[1] == self.INVALID_ANSW) or (res[2] & self.SLEEP_BIT):
             raise ValueError(f"""
                     Invalid answer while requesting T and RH:
                     {res}
@@ -480,7 +813,7 @@ class NEXTPMbeseecher(Beseecher):
         RH = 1.1768*int.from_bytes(res[5:7], 'big')/100 - 4.7270
         # Acquires dust concentrations
         res = self._send_cmd_get_rply(cmd)
-        if (res[1] == self.INVALID_ANSW) or (res[2] & self.SLEEP_BIT == 1):
+        if (res[1] == self.INVALID_ANSW) or (res[2] & self.SLEEP_BIT):
             raise ValueError(f"""
                     Invalid answer while requesting PM:
                     {res}
@@ -497,13 +830,13 @@ class NEXTPMbeseecher(Beseecher):
             'sensor_T':   round(T, 2),
             'sensor_RH':  round(RH, 2),
             'diagnostics': {
-                'Degraded':   res[2] & self.DEGRADED_BIT != 0,
-                'Notready':   res[2] & self.NOTREADY_BIT != 0,
-                'Eccess_RH':  res[2] & self.RH_ERROR_BIT != 0,
-                'T_RH_off':   res[2] & self.TRH_ERROR_BIT != 0,
-                'Fan_error':  res[2] & self.FAN_ERROR_BIT != 0,
-                'Mem_error':  res[2] & self.MEM_ERROR_BIT != 0,
-                'Las_error':  res[2] & self.LAS_ERROR_BIT != 0,
+                'Degraded':   (res[2] & self.DEGRADED_BIT) != 0,
+                'Notready':   (res[2] & self.NOTREADY_BIT) != 0,
+                'Eccess_RH':  (res[2] & self.RH_ERROR_BIT) != 0,
+                'T_RH_off':   (res[2] & self.TRH_ERROR_BIT) != 0,
+                'Fan_error':  (res[2] & self.FAN_ERROR_BIT) != 0,
+                'Mem_error':  (res[2] & self.MEM_ERROR_BIT) != 0,
+                'Las_error':  (res[2] & self.LAS_ERROR_BIT) != 0,
             }
         }
 
@@ -511,22 +844,65 @@ class NEXTPMbeseecher(Beseecher):
         return self._measurePM(self.NextPMcmd['Get_PM_10sec'],
                                acquisition_time)
 
-    def measurePM_1_minute(self, acquisition_time=120):
+    def measurePM_1_minute(self, acquisition_time=None):
+        if acquisition_time is None:
+            acquisition_time = self.ACQUISITION_TIME
         return self._measurePM(self.NextPMcmd['Get_PM_60sec'],
                                acquisition_time)
 
+    def prepare(self):
+        """
+        Powers the sensor on, WARMUP seconds before measure() so that it
+        doesn't wait for the fan
+        """
+        self.powerON()
+
     # default measurement method is 1 minute.
     def measure(self):
-        # turn on in case was off
-        self.powerON()
+        # the state carried by each reply is trusted until the measurement
+        # is over, saving a status request per power check
+        self._last_state = None
+        self._cache_state = True
+        try:
+            # powers on and waits for the fan if prepare() wasn't called
+            data = self.measurePM_1_minute()
+        finally:
+            self._cache_state = False
 
-        data = self.measurePM_1_minute()
+        self._last_RH = data['sensor_RH']
+        return data
 
-        # check humidity
-        if data['sensor_RH'] < 55.0:
-            self.powerOFF()
+    def release(self, idle):
+        """
+        Powers the sensor off after a measurement, unless the humidity is high
+        or it would be powered on again in less than MIN_OFF_TIME
+        @param idle seconds until the next prepare()
+        """
+        if self._last_RH is not None and self._last_RH >= self.RH_KEEP_ON:
+            return
+        if idle < self.MIN_OFF_TIME:
+            return
+        self.powerOFF()
 
-        return data
+    def duty_report(self, reset=True):
+        """
+        Returns a dictionary with 'on_time', the seconds the fan was on, and
+        'warmup_wait', the seconds measurements waited for the fan to warm
+        up, since the last call
+        """
+        now = time.monotonic()
+        on_time = self._on_time
+        if self._on_since is not None:
+            on_time += now - self._on_since
+        report = {'on_time': on_time, 'warmup_wait': self._warmup_wait}
+
+        if reset:
+            self._on_time = 0.0
+            self._warmup_wait = 0.0
+            if self._on_since is not None:
+                self._on_since = now
+
+        return report
 
     def measurePM_15_minutes(self, acquisition_time=1000):
         return self._measurePM(self.NextPMcmd['Get_PM_900sec'],
@@ -543,13 +919,16 @@ class NEXTPMbeseecher(Beseecher):
 ##########
 
 
-class BME280beseecher(Beseecher):
+class BME280beseecher(SampledBeseecher):
     '''
     wrapper class to manage the bme 280 temperature, pressure and humidity
     sensor
     handles setting mode, setting overscanning
+    samples the sensor every SAMPLE_INTERVAL seconds, see SampledBeseecher
     '''
 
+    TIMEOUT = 5
+
     # set codes that can be seen in the adafruit documentation
     MODES = (0x00, 0x01, 0x03)
     OVERSCANS = (0x00, 0x01, 0x02, 0x03, 0x04, 0x05)
@@ -576,9 +955,10 @@ class BME280beseecher(Beseecher):
         super().__init__('air_sensor', 'bme280', index)
 
         if i2c is None:
-            i2c = busio.I2C()
+            i2c = driver('busio').I2C()
 
         self.i2c = i2c
+        adafruit_bme280 = driver('adafruit_bme280.advanced')
         self.sensor = adafruit_bme280.Adafruit_BME280_I2C(i2c)
 
         # set mode to force if invalid code passed
@@ -595,23 +975,19 @@ class BME280beseecher(Beseecher):
         self.sensor.overscan_temperature = overscan
         self.sensor.overscan_pressure = overscan
 
-    def measure(self) -> dict:
+        self.start_sampling(('humidity', 'temperature', 'pressure'))
+
+    def sample(self) -> dict:
         '''
         measure pressure, humidity, and temperature
-        @return json dict with the values collected by the sensor
+        @return dict with the values collected by the sensor
         '''
 
         # collect values from sensor
-        hum = self.sensor.humidity
-        temp = self.sensor.temperature
-        prssr = self.sensor.pressure
-
         return {
-            'type': self.TYPE,
-            'sensor': f'{self.SENSOR}{self.index}',
-            'humidity': hum,
-            'temperature': temp,
-            'pressure': prssr
+            'humidity': self.sensor.humidity,
+            'temperature': self.sensor.temperature,
+            'pressure': self.sensor.pressure
         }
 
     def get_mode(self) -> int:
@@ -725,12 +1101,15 @@ class BME280beseecher(Beseecher):
 ##########
 
 
-class MS8607beseecher(Beseecher):
+class MS8607beseecher(SampledBeseecher):
     '''
     wrapper class for the humidity-temperature-pressure sensor ms8607
     requires the package adafruit-circuitpython-ms8607
+    samples the sensor every SAMPLE_INTERVAL seconds, see SampledBeseecher
     '''
 
+    TIMEOUT = 5
+
     def __init__(self,
                  i2c: busio.I2C = None,
                  index: int = 0
@@ -751,41 +1130,49 @@ class MS8607beseecher(Beseecher):
 
         # init new i2c if needed
         if i2c is None:
-            i2c = board.I2C()
+            i2c = driver('board').I2C()
 
         self.i2c = i2c
-        self.sensor = adafruit_ms8607.MS8607(i2c)
+        self.sensor = driver('adafruit_ms8607').MS8607(i2c)
 
-    def measure(self) -> dict:
+        self.start_sampling(('humidity', 'temperature', 'pressure'))
+
+    def sample(self) -> dict:
         '''
         Collect all the measurements from the sensor
         @return dictionary of all measurements collected
         '''
 
-        hum = self.sensor.relative_humidity
-        temp = self.sensor.temperature
-        prssr = self.sensor.pressure
-
         return {
-            'type': self.TYPE,
-            'sensor': f'{self.SENSOR}{self.index}',
-            'humidity': hum,
-            'temperature': temp,
-            'pressure': prssr
+            'humidity': self.sensor.relative_humidity,
+            'temperature': self.sensor.temperature,
+            'pressure': self.sensor.pressure
         }
 
 class SCD30beseecher(Beseecher):
     '''
     wrapper class for the CO2 sensor scd30 
     requires the package adafruit-circuitpython-scd30
+
+    The sensor runs in continuous measurement mode and a background thread
+    keeps its readings in a ring buffer, measure() returns statistics over
+    the last WINDOW seconds of readings without waiting for the sensor
     '''
 
+    PERIOD = 600
+    TIMEOUT = 5
+
+    MEASUREMENT_INTERVAL = 2  # seconds between the sensor's measurements
+    WINDOW = 600  # seconds of readings measure() summarizes
+    BUFFER_LEN = WINDOW // MEASUREMENT_INTERVAL
+
     def __init__(self,
                  i2c: busio.I2C = None,
                  index: int = 0
                  ) -> None:
         '''
         Initializes sensor using the i2c bus of the raspberry pi
+        Starts continuous measurements and the thread reading them
         @param i2c -> busio.I2C() for the raspberry pi
         @param index index in array of air_sensors this sensor should take
         '''
@@ -794,35 +1181,60 @@ class SCD30beseecher(Beseecher):
 
         # init new i2c if needed
         if i2c is None:
-            i2c = busio.I2C(board.SCL, board.SDA)
+            board = driver('board')
+            i2c = driver('busio').I2C(board.SCL, board.SDA)
 
         self.i2c = i2c
         self.address = 0x61
-        self.sensor = adafruit_scd30.SCD30(i2c, address=self.address)
+        self.sensor = driver('adafruit_scd30').SCD30(i2c,
+                                                     address=self.address)
+        # the sensor measures continuously once an interval is set
+        self.sensor.measurement_interval = self.MEASUREMENT_INTERVAL
+
+        # (time.monotonic(), co2) of the latest readings, oldest are dropped
+        self.readings = deque(maxlen=self.BUFFER_LEN)
+        self.reader = PollingThread(self._read, self.MEASUREMENT_INTERVAL,
+                                    name='scd30_reader')
+        self.reader.start()
+
+    def _read(self):
+        """
+        Adds the sensor's latest measurement to the ring buffer
+        """
+        with self.bus_session():
+            if not self.sensor.data_available:
+                return
+            co2 = self.sensor.CO2
+        self.readings.append((time.monotonic(), co2))
 
     def measure(self) -> dict:
         '''
-        Collect all the measurements from the sensor
-        @return dictionary of all measurements collected
+        Summarizes the readings of the last WINDOW seconds
+        @return dictionary with the mean co2 and its min, max, standard
+            deviation and number of readings
         '''
-        MEASUREMENT_INTERVAL = 5
-        MEASUREMENT_DURATION = 30
-
-        co2_readings = [] 
-        start_time = time.monotonic()
-        
-        while time.monotonic() - start_time < MEASUREMENT_DURATION:
-            if self.sensor.data_available:
-                co2 = self.sensor.CO2
-                co2_readings.append(co2)
-            time.sleep(MEASUREMENT_INTERVAL)
-		
-        average_co2 = sum(co2_readings)/len(co2_readings) 
-        
+        start = time.monotonic() - self.WINDOW
+        co2_readings = [co2 for read_at, co2 in list(self.readings)
+                        if read_at >= start]
+
+        if not co2_readings:
+            raise polling_error('No CO2 readings in the last ' +
+                                f'{self.WINDOW} seconds', self.reader)
+        self.reader.take_errors()
+
+        count = len(co2_readings)
+        average_co2 = sum(co2_readings) / count
+        variance = sum((co2 - average_co2) ** 2
+                       for co2 in co2_readings) / count
+
         return {
             'type': self.TYPE,
             'sensor': f'{self.SENSOR}{self.index}',
-            'co2': average_co2 
+            'co2': average_co2,
+            'co2_min': min(co2_readings),
+            'co2_max': max(co2_readings),
+            'co2_std': variance ** 0.5,
+            'co2_count': count,
         }
 
 
@@ -879,6 +1291,10 @@ class SPS30beseecher(Beseecher):
     an auto-cleaning interval may also be specified (defaults to 1 day).
     '''
 
+    # the sensor is always on, reading it is immediate
+    PERIOD = 60
+    TIMEOUT = 10
+
     # Translations from the sps30 class data dictionary keynames to our
     # keynames.
     tr_mass = {'pm1.0':  'PM1mass',
@@ -906,6 +1322,9 @@ class SPS30beseecher(Beseecher):
 
         # The following raises a 'FileNotFoundError' exception if
         # the specified i2c bus does not exists.
+        if SPS30_PATH not in sys.path:
+            sys.path.append(SPS30_PATH)
+        SPS30 = driver('sps30_for_ACCESS.sps30').SPS30
         self.sps = SPS30(bus=i2c_bus_number)
         self.i2c_bus_number = i2c_bus_number
         self.sps.write_auto_cleaning_interval_days(cleaning_interval_in_days)
@@ -927,3 +1346,18 @@ class SPS30beseecher(Beseecher):
                 else True
         results['diagnostics'] = diag
         return results
+
+
+##########
+
+# Beseechers a station's sensors.json may declare, by their type
+# {type: (class, sensor category)}
+BESEECHERS = {
+    'gps': (GPSbeseecherGPIO, 'gps'),
+    'gps_serial': (GPSbeseecher, 'gps'),
+    'nextpm': (NEXTPMbeseecher, 'particulate_matter'),
+    'sps30': (SPS30beseecher, 'particulate_matter'),
+    'bme280': (BME280beseecher, 'air_sensor'),
+    'ms8607': (MS8607beseecher, 'air_sensor'),
+    'scd30': (SCD30beseecher, 'co2_sensor'),
+}
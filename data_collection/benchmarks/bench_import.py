@@ -0,0 +1,89 @@
+'''
+
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+##########
+
+import os
+import sys
+import statistics
+import subprocess
+
+##########
+
+'''
+Measures the cost of importing ACCESS_station_lib, which tools such as the
+sender and diagnostics pay without touching the sensors, and of each
+hardware driver a beseecher imports when it is created
+Every import runs in a fresh interpreter, the median of several runs is
+reported
+
+usage: python3 benchmarks/bench_import.py [repeat]
+'''
+
+##########
+
+# constants declarations
+
+STATION_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPEAT = 5
+MODULES = (
+    'ACCESS_station_lib',
+    'serial',
+    'pigpio',
+    'board',
+    'busio',
+    'adafruit_bme280.advanced',
+    'adafruit_ms8607',
+    'adafruit_scd30',
+)
+
+##########
+
+
+def import_time(module: str) -> float:
+    '''
+    Imports a module in a fresh interpreter
+    @param module name of the module
+    @return seconds the import took, None if the module is not installed
+    '''
+    code = ('import time; start = time.perf_counter(); ' +
+            f'import {module}; print(time.perf_counter() - start)')
+    result = subprocess.run([sys.executable, '-c', code], cwd=STATION_DIR,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+
+    return float(result.stdout)
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else REPEAT
+
+    for module in MODULES:
+        times = [import_time(module) for _ in range(repeat)]
+        if None in times:
+            print(f'{module:28} not installed')
+            continue
+        print(f'{module:28} {statistics.median(times) * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+'''
+
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+##########
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import statistics
+
+# run from anywhere, the station's scripts live next to this folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+##########
+
+'''
+Runs the data collection loop on simulated hardware (see
+packages/simulation.py), on any Linux machine, and reports how long each
+step of a record took, how long each sensor's measurements took, how the
+I2C bus was shared and which faults were injected
+The sensors declared in sensors.json are simulated. The loop runs speedup
+times faster than on a station: with the default 60 a record is written
+every 10 s instead of every 10 minutes. The first record is not reported,
+it comes before the sensors' first measurements
+The station's files (logs, samples.db) go to a temporary folder, or to
+ACCESS_HOME if it is set, in which case they are kept
+Needs werkzeug, the only dependency that is not hardware
+
+usage: python3 benchmarks/bench_loop.py [cycles] [speedup] [fault_rate]
+'''
+
+##########
+
+# constants declarations
+
+CYCLES = 10
+SPEEDUP = 60
+FAULT_RATE = 0.0
+SEED = 1  # same faults and weather on every run
+
+##########
+
+
+def summary(values: list) -> str:
+    '''
+    @param values durations in seconds
+    @return median, 90th percentile and maximum in milliseconds
+    '''
+    if not values:
+        return '-'
+    values = sorted(values)
+    p90 = values[min(len(values) - 1, int(0.9 * len(values)))]
+    return f'median {statistics.median(values) * 1000:8.1f} ms  ' + \
+        f'p90 {p90 * 1000:8.1f} ms  max {values[-1] * 1000:8.1f} ms'
+
+
+def run(cycles: int, speedup: float, fault_rate: float) -> None:
+    '''
+    Initializes the simulated station and writes records
+    @param cycles number of records reported
+    @param speedup how many times faster than a station the loop runs
+    @param fault_rate probability of a fault per command or transfer
+    '''
+    # the station's modules are imported here, once the simulation is set
+    # up: importing data_collection initializes the sensors
+    import packages.simulation as simulation
+    sim = simulation.install(speedup, fault_rate, seed=SEED)
+
+    import packages.modules as modules
+    sent = []  # files handed to the sender
+    modules.add_sender_listener(sent.append)
+
+    start = time.monotonic()
+    import data_collection as collection
+    print(f'Sensors initialized in {time.monotonic() - start:.2f} s:',
+          ', '.join(f'{sensor.SENSOR}{sensor.index} {sensor.TYPE}'
+                    for sensor in collection.sens.sensors))
+
+    collection.SAMPLING_INTERVAL /= speedup
+    collection.LEAD_TIME /= speedup
+    collection.REINIT_TIMEOUT = max(simulation.MIN_TIMEOUT,
+                                    collection.REINIT_TIMEOUT / speedup)
+    collection.init_scheduler()
+
+    stages = {}  # {stage: [seconds]}
+    measurements = {}  # {sensor_id: [seconds]}
+    skipped = {}  # {sensor_id: {'timeout' or 'open': count}}
+    bus = {}  # {device: {'bus_time', 'wait_time', 'grants', 'bytes'}}
+    duty = {}  # {sensor_id: {'on_time', 'warmup_wait'}}
+
+    for cycle in range(cycles + 1):
+        boundary = collection.scheduler.next_slot(collection.SAMPLING_INTERVAL)
+        collection.scheduler.wait_until(boundary)
+        woke = time.monotonic() - boundary
+
+        record = collection.write_record(boundary)
+        timings = dict(collection.timings)
+        usage = collection.sens.i2c.usage_report(reset=True)
+        duty_cycles = {f'{sensor.SENSOR}{sensor.index}': sensor.duty_report()
+                       for sensor in collection.sens.sensors
+                       if hasattr(sensor, 'duty_report')}
+        collection.timings.clear()
+
+        if cycle == 0:  # before the sensors' first measurements
+            continue
+
+        record['wake'] = woke
+        record['total'] = sum(record.values())
+        for stage, duration in record.items():
+            stages.setdefault(stage, []).append(duration)
+        for sensor_id, duration in timings.items():
+            if isinstance(duration, str):
+                counts = skipped.setdefault(sensor_id, {})
+                counts[duration] = counts.get(duration, 0) + 1
+            else:
+                measurements.setdefault(sensor_id, []).append(duration)
+        for device, counters in usage.items():
+            totals = bus.setdefault(device, {'bus_time': 0, 'wait_time': 0,
+                                             'grants': 0, 'bytes': 0})
+            for counter in totals:
+                totals[counter] += counters[counter]
+        for sensor_id, report in duty_cycles.items():
+            totals = duty.setdefault(sensor_id, {'on_time': 0,
+                                                 'warmup_wait': 0})
+            for counter in totals:
+                totals[counter] += report[counter]
+
+        print(f'record {cycle}: ' +
+              ', '.join(f'{stage} {duration * 1000:.1f} ms'
+                        for stage, duration in record.items()))
+
+    collection.scheduler.stop()
+    elapsed = cycles * collection.SAMPLING_INTERVAL
+
+    print(f'\n{cycles} records, {len(sent)} handed to the sender, ' +
+          f'speedup {speedup:g}, fault rate {fault_rate:g}')
+    print('\nRecord steps:')
+    for stage, durations in stages.items():
+        print(f'  {stage:24} {summary(durations)}')
+
+    print('\nSensor measurements:')
+    for sensor_id in sorted(set(measurements) | set(skipped)):
+        missed = ', '.join(f'{count} {reason}' for reason, count in
+                           skipped.get(sensor_id, {}).items())
+        print(f'  {sensor_id:24} {summary(measurements.get(sensor_id, []))}' +
+              (f'  ({missed})' if missed else ''))
+
+    if bus:
+        print('\nI2C bus, per record:')
+        for device, totals in sorted(bus.items()):
+            print(f'  {device:24} busy ' +
+                  f'{totals["bus_time"] / cycles * 1000:8.1f} ms  waiting ' +
+                  f'{totals["wait_time"] / cycles * 1000:8.1f} ms  ' +
+                  f'{totals["grants"] / cycles:6.1f} grants  ' +
+                  f'{totals["bytes"] / cycles:7.0f} bytes')
+
+    if duty:
+        print('\nDuty cycles (simulated time):')
+        for sensor_id, totals in sorted(duty.items()):
+            print(f'  {sensor_id:24} on ' +
+                  f'{totals["on_time"] / elapsed:6.1%} of the time, ' +
+                  f'waited {totals["warmup_wait"] * speedup:.0f} s for ' +
+                  'warm up')
+
+    if sim.faults:
+        print('\nFaults injected:')
+        for device, counts in sorted(sim.faults.items()):
+            print(f'  {device:24} ' + ', '.join(
+                f'{count} {fault}' for fault, count in sorted(counts.items())))
+
+    _, errors, _ = collection.events.read()
+    if errors:
+        print('\nErrors reported to diagnostics:')
+        for name, message, count, first, last in errors:
+            print(f'  {name:24} x{count} {message[:60]}')
+
+
+def main():
+    cycles = int(sys.argv[1]) if len(sys.argv) > 1 else CYCLES
+    speedup = float(sys.argv[2]) if len(sys.argv) > 2 else SPEEDUP
+    fault_rate = float(sys.argv[3]) if len(sys.argv) > 3 else FAULT_RATE
+
+    # the station's files go to a scratch folder unless ACCESS_HOME is set
+    home = os.environ.get('ACCESS_HOME', None)
+    scratch = home is None
+    if scratch:
+        home = tempfile.mkdtemp(prefix='access_bench_')
+        os.environ['ACCESS_HOME'] = home
+    os.makedirs(os.path.join(home, 'logs'), exist_ok=True)
+
+    try:
+        run(cycles, speedup, fault_rate)
+    finally:
+        if scratch:
+            shutil.rmtree(home, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+'''
+
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+##########
+
+import os
+import sys
+import time
+
+# run from anywhere, packages/ lives next to this folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import packages.nmea as nmea  # noqa: E402
+
+# pip3 install pynmea2
+try:
+    import pynmea2
+    from pynmea2.nmea import ChecksumError, ParseError
+except ModuleNotFoundError:
+    pynmea2 = None
+
+##########
+
+'''
+Compares packages/nmea.py with pynmea2 on a recorded NMEA stream
+Both parsers fill the gpsfix values the GPS beseechers report, sentence by
+sentence, and the values are checked to agree before timing them
+
+usage: python3 benchmarks/bench_nmea.py [stream.nmea] [repeat]
+Record a stream on a station with
+    $ cat /dev/ttySOFT0 > stream.nmea
+'''
+
+##########
+
+# constants declarations
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      'sample.nmea')
+REPEAT = 20
+TOLERANCE = 1e-9  # degrees, both parsers convert coordinates the same way
+
+##########
+
+
+def fast_parse(lines: list) -> list:
+    '''
+    Parses a stream with packages/nmea.py
+    @param lines sentences of the stream
+    @return list of (sentence_type, values) for the sentences kept
+    '''
+    parsed = []
+    for line in lines:
+        sentence = nmea.parse(line.strip())
+        if sentence is not None:
+            parsed.append(sentence)
+
+    return parsed
+
+
+def reference_parse(lines: list) -> list:
+    '''
+    Parses a stream with pynmea2, keeping the same values as fast_parse
+    This is what the GPS beseechers used to do
+    @param lines sentences of the stream
+    @return list of (sentence_type, values) for the sentences kept
+    '''
+    parsed = []
+    for line in lines:
+        try:
+            q = pynmea2.parse(line.strip())
+        except (ChecksumError, ParseError):
+            continue
+
+        try:
+            if q.sentence_type == 'GGA' and q.gps_qual:
+                parsed.append(('GGA', {
+                    'time': q.timestamp.strftime('%H:%M:%S'),
+                    'latitude': q.latitude,
+                    'lat_dir': q.lat_dir,
+                    'longitude': q.longitude,
+                    'lon_dir': q.lon_dir,
+                    'altitude': q.altitude,
+                    'alt_unit': q.altitude_units,
+                    'num_sats': int(q.num_sats),
+                }))
+            elif q.sentence_type == 'RMC' and \
+                    hasattr(q.datestamp, 'isoformat'):
+                parsed.append(('RMC', {
+                    'date': q.datestamp.isoformat(),
+                    'time': q.timestamp.strftime('%H:%M:%S'),
+                    'valid': q.status == 'A',
+                }))
+            elif q.sentence_type == 'GSA':
+                parsed.append(('GSA', {
+                    'PDOP': float(q.pdop),
+                    'HDOP': float(q.hdop),
+                    'VDOP': float(q.vdop),
+                }))
+        except (AttributeError, TypeError, ValueError):
+            continue
+
+    return parsed
+
+
+def same_values(fast: dict, reference: dict) -> bool:
+    '''
+    @param fast values from fast_parse
+    @param reference values from reference_parse
+    @return True if both hold the same values
+    '''
+    if fast.keys() != reference.keys():
+        return False
+
+    for key, value in fast.items():
+        if isinstance(value, float):
+            if abs(value - reference[key]) > TOLERANCE:
+                return False
+        elif value != reference[key]:
+            return False
+
+    return True
+
+
+def bench(parse, lines: list, repeat: int) -> float:
+    '''
+    Times a parser
+    @param parse function parsing the stream
+    @param lines sentences of the stream
+    @param repeat number of passes over the stream
+    @return best time per sentence, in microseconds
+    '''
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse(lines)
+        best = min(best, time.perf_counter() - start)
+
+    return best / len(lines) * 1e6
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else SAMPLE
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else REPEAT
+
+    with open(path, 'r', encoding='ascii', errors='replace') as in_f:
+        lines = in_f.readlines()
+
+    fast = fast_parse(lines)
+    print(f'{len(lines)} sentences, {len(fast)} kept')
+    print(f'packages/nmea.py: {bench(fast_parse, lines, repeat):.2f} us/line')
+
+    if pynmea2 is None:
+        print('pynmea2 not installed, skipping comparison')
+        return
+
+    reference = reference_parse(lines)
+    if len(fast) != len(reference) or \
+            not all(f_type == r_type and same_values(f_values, r_values)
+                    for (f_type, f_values), (r_type, r_values)
+                    in zip(fast, reference)):
+        print('Parsers disagree')
+        sys.exit(1)
+
+    print(f'pynmea2:          {bench(reference_parse, lines, repeat):.2f} ' +
+          'us/line')
+
+
+if __name__ == '__main__':
+    main()
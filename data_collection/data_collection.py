@@ -22,30 +22,59 @@ You should have received a copy of the GNU General Public License along with
 import time
 import datetime
 import json
-import os
 import sensors as sens
 from shutil import disk_usage
-from gpiozero import CPUTemperature
 import station_id as station
 import packages.modules as modules
+from packages.store import SampleStore
+from packages.events import EventStore
+from packages.records import RecordEncoder
 from werkzeug.utils import secure_filename
 import threading
-from ACCESS_station_lib import Beseecher
+import functools
+from ACCESS_station_lib import ErrorBeseecher, driver
+from packages.scheduler import Scheduler, DeadlineWorker
+from packages.health import CircuitBreaker
 
 ##########
 
 # Constants
 
-SAMPLING_INTERVAL = 600  # in seconds
+SAMPLING_INTERVAL = 600  # seconds between records
+# sensors start this many seconds earlier than their warm up asks, so that
+# they are done by the time the record is written
+LEAD_TIME = 5
+# seconds the gps and station clocks may disagree before it is reported
+CLOCK_TOLERANCE = 2
 MAX_SAMPLES = 1
+# seconds allowed to initialize again a sensor that failed
+REINIT_TIMEOUT = 60
+# 'binary' sends compact records plus a schema whenever the layout changes,
+# 'json' sends every sample as a json file
+RECORD_FORMAT = 'binary'
 
 ##########
 
 # Global variables
 
 data_to_save = {}  # dictionary to place data collected
+# latest reading of each sensor since the last record,
+# {(sensor_category, index): data}
+readings = {}
 lock = threading.Lock()
-threads = [None] * len(sens.sensors)
+scheduler = Scheduler()  # runs every sensor at its own period
+# workers bounding each sensor's measurement by its TIMEOUT,
+# {(sensor_category, index): DeadlineWorker}
+workers = {}
+# duration of each sensor's last measurement in seconds, 'timeout' or
+# 'open' if the sensor was skipped, {sensor_id: duration}
+timings = {}
+# health of each sensor, {(sensor_category, index): CircuitBreaker}
+breakers = {}
+duty_since = time.monotonic()  # start of the sensors' current duty report
+store = SampleStore()  # files waiting for the sender
+events = EventStore()  # errors and status waiting for diagnostics
+encoder = RecordEncoder()  # remembers the last schema sent
 
 ##########
 
@@ -54,26 +83,12 @@ threads = [None] * len(sens.sensors)
 
 def write_diag(error_name: str, error: str) -> None:
     '''
-    Writes an occured error into the diagnostics file located at /home/pi/
+    Records an occured error for diagnostics to send
+    Errors of the same name are coalesced into one event counting them
     @param error_name: error type (air sensor, cpu temperature, exception...)
     @param error: string info describing error
-    appends errors to file until diagnostics sends them
     '''
-
-    # open diagnostics file to add error info
-    with open(
-              os.path.join(modules.HOME,
-                           f'station{station.station_num}_diagnostics.txt'),
-              'a') as f:
-
-        # timestamp data
-        now = datetime.datetime.now()
-        f.write(f'{now.strftime("%Y-%m-%d %H:%M:%S")}\n')
-
-        # clean up error
-        error = clean_str(error)
-
-        f.write(f'{error_name}\n{error}\n\n')
+    events.error(error_name, clean_str(error))
 
 
 def clean_str(string: str) -> str:
@@ -95,68 +110,175 @@ def clean_str(string: str) -> str:
     return string
 
 
-def write_temp_disk(temp: str, disk: str) -> None:
+def write_temp_disk(date: str, time: str, temp: str, disk: str) -> None:
     '''
-    Writes the cpu temperature and disk space in use into the diagnostic file
-        the file is located in /home/pi/
-    Takes arguments as string and writes them to a file
+    Records the cpu temperature and disk space in use for diagnostics to send
+    Takes arguments as string
+    @param date Date of the record
+    @param time Time of the record
     @param temp Temperature of cpu
     @param disk Proportion of free space in RPi's storage
     '''
+    events.status(date, time, temp, disk)
 
-    # open diagnostics file to add info to
-    with open(os.path.join(modules.HOME,
-              f'station{station.station_num}_diagnostics.txt'), 'a') as f:
-
-        # timestamp data
-        now = datetime.datetime.now()
-        f.write(f'{now.strftime("%Y-%m-%d %H:%M:%S")}\n')
-
-        # write error info
-        f.write(f'cpu\n{temp}\nmemory\n{disk}\n\n')
 
-
-def measure(sensor: Beseecher, sensor_category: str, index: int) -> None:
+def measure(slot: int) -> None:
     '''
-    Multi-threaded collection of data
+    Multi-threaded collection of data, run by the scheduler every
+        sensor.PERIOD seconds
     Requests data from sensor and checks if sensor provides diagnostics
-    Manages synchronization for updating global data
+    Keeps the reading until the next record is written, replacing the
+        previous one if the sensor measures more often than records are
+        written
+    A measurement taking longer than sensor.TIMEOUT is abandoned and
+        reported, the record marks the sensor as timed out (see
+        timeout_reading) unless it already has a reading to report
+    Sensors failing repeatedly are skipped by their circuit breaker (see
+        packages/health.py) and only probed now and then, a sensor that
+        failed to initialize is initialized again when probed
     Handles exceptions raised by data collection
-    @param sensor Beesecher object to request data from
-    @param sensor_category Measurements this sensor collects
-        (i.e particulate_matter)
-    @index that sensor's specific index
+    @param slot position of the sensor in sens.sensors
         data_to_save holds lists of every sensor_category
         to ensure all data collection is consistent, this method will
         always have the same sensor place its measurements in the same
         index
     '''
 
+    sensor = sens.sensors[slot]
+    sensor_category = sensor.SENSOR
+    index = sensor.index
+    sensor_id = f'{sensor_category}{index}'
+    worker = workers.setdefault((sensor_category, index),
+                                DeadlineWorker(sensor_id))
+    breaker = get_breaker(sensor)
+
+    # skip the sensor while its breaker is open
+    if not breaker.allow():
+        timings[sensor_id] = 'open'
+        return None
+
     # collect data from sensor
+    start = time.monotonic()
     try:  # in case any sensor fails or is disconnected, the whole system
         # won't crash
-        data = sensor.measure()
+        if isinstance(sensor, ErrorBeseecher):  # maybe plugged back in
+            sensor = worker.run(functools.partial(sens.reinit, slot),
+                                REINIT_TIMEOUT)
+        data = worker.run(sensor.measure, sensor.TIMEOUT)
     except Exception as e:  # must catch all exceptions as each sensor may
         # raise its own from package library
-        modules.log(f'Error collecting info for {sensor_category}{index}, ' +
-                    f'{sensor.TYPE}')
-        write_diag(f'{sensor_category}{index}', str(e))
-        # raise(e) # for testing right now, exception handling later
-        return None  # end method, nothing to add to global data_to_save
+        timed_out = isinstance(e, TimeoutError)  # hung sensor, its thread
+        # is abandoned
+        timings[sensor_id] = 'timeout' if timed_out \
+            else round(time.monotonic() - start, 3)
+        report_failure(breaker, sensor, sensor_id,
+                       f'{sensor_id}_timeout' if timed_out else sensor_id,
+                       str(e))
+        if timed_out:  # tell a hung sensor from one that had no value
+            lock.acquire()
+            readings.setdefault((sensor_category, index),
+                                timeout_reading(sensor, sensor_id))
+            lock.release()
+        return None  # end method, nothing to add to the readings
+
+    timings[sensor_id] = round(time.monotonic() - start, 3)
+
+    # let the sensor power down until it is prepared again
+    idle = scheduler.next_slot(sensor.PERIOD, sensor.WARMUP + LEAD_TIME) - \
+        time.monotonic()
+    try:
+        worker.run(functools.partial(sensor.release, idle), sensor.TIMEOUT)
+    except Exception as e:
+        modules.log('Error releasing sensor', sensor=sensor_id,
+                    type=sensor.TYPE, error=str(e))
+
+    if breaker.success():
+        modules.log('Sensor recovered', sensor=sensor_id, type=sensor.TYPE)
+        write_diag(f'{sensor_id}_recovered', sensor.TYPE)
 
     # check if there are any diagnostics to report
     if 'diagnostics' in data.keys():
         check_data_diagnostics(data['sensor'], data['diagnostics'])
 
     # synchronization for thread writing
-    global lock, data_to_save
     lock.acquire()
-    data_to_save[sensor_category][index] = data
+    readings[(sensor_category, index)] = data
     lock.release()
 
     return None
 
 
+def timeout_reading(sensor, sensor_id: str) -> dict:
+    '''
+    Reading recorded for a sensor whose measurement timed out, the timeout is
+    reported as one of the sensor's diagnostics flags so it is kept in the
+    record but not uploaded as a measurement
+    @param sensor beseecher that timed out
+    @param sensor_id sensor category + index
+    @return dictionary standing for the sensor's reading
+    '''
+    return {'type': sensor.TYPE, 'sensor': sensor_id,
+            'diagnostics': {'timeout': True}}
+
+
+def get_breaker(sensor) -> CircuitBreaker:
+    '''
+    @param sensor beseecher
+    @return the sensor's circuit breaker, created on the first call
+    '''
+    return breakers.setdefault((sensor.SENSOR, sensor.index),
+                               CircuitBreaker(sensor.PERIOD))
+
+
+def prepare(slot: int) -> None:
+    '''
+    Readies a sensor for its next measurement (i.e powers on its fan), run
+        by the scheduler sensor.WARMUP seconds before measure() so that the
+        measurement doesn't wait for the sensor
+    Sensors skipped by their circuit breaker are not prepared
+    @param slot position of the sensor in sens.sensors
+    '''
+    sensor = sens.sensors[slot]
+    if not get_breaker(sensor).allow():
+        return None
+
+    try:
+        sensor.prepare()
+    except Exception as e:  # measure() reports the sensor if it is broken
+        modules.log('Error preparing sensor',
+                    sensor=f'{sensor.SENSOR}{sensor.index}',
+                    type=sensor.TYPE, error=str(e))
+
+    return None
+
+
+def report_failure(breaker: CircuitBreaker, sensor, sensor_id: str,
+                   error_name: str, error: str) -> None:
+    '''
+    Records a failed measurement in the sensor's breaker
+    The error is written for diagnostics on the first failure of a streak and
+    when the breaker opens, not on every failure
+    @param breaker sensor's circuit breaker
+    @param sensor beseecher that failed
+    @param sensor_id sensor category + index
+    @param error_name name of the error for diagnostics
+    @param error description of the error
+    '''
+    first = breaker.failures == 0
+    opened = breaker.failure()
+    modules.log('Error collecting info', sensor=sensor_id, type=sensor.TYPE,
+                error=error)
+
+    if opened:
+        modules.log('Sensor disabled', sensor=sensor_id,
+                    failures=breaker.failures, retry_s=breaker.backoff)
+        write_diag(f'{sensor_id}_disabled',
+                   f'{error} (failed {breaker.failures} times, ' +
+                   f'retrying in {breaker.backoff} s)')
+    elif first:
+        write_diag(error_name, error)
+
+
 def check_data_diagnostics(sensor_id: str, diag_info: dict) -> None:
     '''
     Loops through all diagnostic information in a dictionary
@@ -195,20 +317,99 @@ def data_init() -> None:
             data_to_save[sensor] = [None]
 
 
-def init_threads() -> None:
+def init_scheduler() -> None:
+    '''
+    Schedules every sensor at its own period, just before the records it
+    should be part of. Sensors needing to warm up are prepared that much
+    earlier, so that their measurement doesn't wait
+    '''
+
+    for slot, sensor in enumerate(sens.sensors):
+        scheduler.add(functools.partial(measure, slot),
+                      sensor.PERIOD,
+                      LEAD_TIME,
+                      name=f'{sensor.SENSOR}{sensor.index}')
+        if sensor.WARMUP > 0:
+            scheduler.add(functools.partial(prepare, slot),
+                          sensor.PERIOD,
+                          sensor.WARMUP + LEAD_TIME,
+                          name=f'{sensor.SENSOR}{sensor.index}_prepare')
+
+    scheduler.start()
+
+
+def merge_readings() -> None:
     '''
-    Sends out all threads to interrogate each sensor
+    Moves the readings collected since the last record into data_to_save
+    Sensors that did not report since then are left as None
     '''
 
-    global threads
+    global readings
 
-    # start all threads
-    for i, sensor in enumerate(sens.sensors):
-        threads[i] = threading.Thread(target=measure, args=(sensor,
-                                                            sensor.SENSOR,
-                                                            sensor.index))
+    # take the readings, sensors keep measuring into a fresh dictionary
+    lock.acquire()
+    collected, readings = readings, {}
+    lock.release()
 
-        threads[i].start()
+    for (sensor_category, index), data in collected.items():
+        data_to_save[sensor_category][index] = data
+
+
+def log_timings(stages: dict) -> None:
+    '''
+    Logs how long the steps of a record and the sensors' last measurements
+    took, sensors that timed out or were skipped are marked as such
+    @param stages seconds spent in each step of the record
+    '''
+    breakdown = ', '.join(f'{stage} {duration:.3f}s'
+                          for stage, duration in stages.items())
+    sensors = ', '.join(f'{sensor_id} {duration}'
+                        if isinstance(duration, str)
+                        else f'{sensor_id} {duration:.3f}s'
+                        for sensor_id, duration in sorted(timings.items()))
+
+    modules.log(f'Record timing: {breakdown}; sensors: {sensors}')
+
+
+def log_bus_usage() -> None:
+    '''
+    Logs how much each device used the I2C bus since the previous record, and
+    how long it waited for it
+    '''
+    usage = sens.i2c.usage_report(reset=True)
+    if not usage:
+        return
+
+    devices = ', '.join(
+        f'{device} {counters["bus_time"]:.3f}s busy ' +
+        f'{counters["wait_time"]:.3f}s waiting ' +
+        f'({counters["grants"]} grants, {counters["bytes"]} bytes)'
+        for device, counters in sorted(usage.items()))
+    modules.log(f'I2C bus usage: {devices}')
+
+
+def log_duty_cycles() -> None:
+    '''
+    Logs, for the sensors that power down between measurements, how long
+    they were on since the previous record against how long their
+    measurements waited for them to warm up
+    '''
+    global duty_since
+
+    now = time.monotonic()
+    elapsed, duty_since = now - duty_since, now
+
+    for sensor in sens.sensors:
+        if not hasattr(sensor, 'duty_report'):
+            continue
+        duty = sensor.duty_report()
+        sensor_id = f'{sensor.SENSOR}{sensor.index}'
+        measured = timings.get(sensor_id, None)
+        measured = f'{measured:.3f}s' if isinstance(measured, float) \
+            else measured
+        modules.log(f'{sensor_id} duty cycle: on {duty["on_time"]:.0f}s of ' +
+                    f'{elapsed:.0f}s, waited {duty["warmup_wait"]:.1f}s ' +
+                    f'for warm up, last measurement {measured}')
 
 
 def collect_gps_data() -> dict:
@@ -219,6 +420,9 @@ def collect_gps_data() -> dict:
 
     global lock
 
+    # left as is if the gps fails, the record is still dated by its boundary
+    gps_data = {'date': None, 'time': None, 'latitude': None}
+
     try:
         gps_data = sens.gps.fix()
 
@@ -229,7 +433,9 @@ def collect_gps_data() -> dict:
 
         # check for gps unable to get a fix
         if gps_data['latitude'] is None:  # GPS has no fix
-            raise Exception('Could not fix GPS')
+            age = gps_data.get('fix_age', None)
+            raise Exception('Could not fix GPS' if age is None else
+                            f'Could not fix GPS, last fix {age} s ago')
 
     except Exception as e:
         modules.log('Error collecting gps data')
@@ -238,26 +444,36 @@ def collect_gps_data() -> dict:
     return gps_data
 
 
-def save_time_date(gps_info: dict) -> None:
+def stamp_record(gps_info: dict, stamp: datetime.datetime) -> None:
     '''
-    Save date and time info for the diagnostics file to use
-    Since this script is using the gps, other scripts are unable to use it for
-    date and time.
-    Saves the info in a tmep file for diagnostics to access later
+    Dates the record with its boundary instead of the time the gps was read,
+    so records of all stations share the same timestamps
+    Reports the gps clock disagreeing with the station's clock, which the
+    schedule follows
+    @param gps_info dictionary returned by collect_gps_data, modified
+    @param stamp boundary of the record, in UTC
     '''
-    # collect date and time for naming files
-    curr_time = gps_info['time']
-    curr_date = gps_info['date']
-
-    with open(os.path.join(modules.HOME, 'time.txt'), 'w') as out_f:
-        out_f.write(f'{curr_time}\n{curr_date}')
-
-
-def collect_diag() -> None:
+    if gps_info['latitude'] is not None:
+        try:
+            gps_time = datetime.datetime.fromisoformat(
+                f'{gps_info["date"]}T{gps_info["time"]}')
+            skew = abs((gps_time - datetime.datetime.utcnow())
+                       .total_seconds())
+            if skew > CLOCK_TOLERANCE:
+                write_diag('clock_skew', f'{skew:.1f}')
+        except (TypeError, ValueError):  # gps sent a partial date
+            pass
+
+    gps_info['date'] = stamp.date().isoformat()
+    gps_info['time'] = stamp.time().isoformat(timespec='seconds')
+
+
+def collect_diag(date: str, time: str) -> None:
     '''
     Collects general info about the current cpu and temp and saves it for
     diagnostics to later collect and send
-    @return (date, time)
+    @param date Date of the record
+    @param time Time of the record
     '''
 
     # collect percentage of disk storage available
@@ -265,7 +481,7 @@ def collect_diag() -> None:
     disk = u / t
 
     # measure cpu temp
-    temp = CPUTemperature().temperature
+    temp = driver('gpiozero').CPUTemperature().temperature
 
     # check for critical levels of either
     if temp > 70:
@@ -274,83 +490,112 @@ def collect_diag() -> None:
         write_diag('disk_space', str(disk))
 
     # write info for general diagnostics
-    write_temp_disk(str(temp), str(disk))
+    write_temp_disk(date, time, str(temp), str(disk))
 
 
-def join_threads() -> None:
+def save_data(date: str, time: str, data: dict) -> None:
     '''
-    Wait for all threads to finish data collection and then collect them
+    Save date collected by the sensors into the store and notify the sender
+    @param date Date data was collected, to be used in file name
+    @param time Time data was collected, to be used in file name
+    @param data Dict to save
     '''
 
-    global threads
+    if RECORD_FORMAT == 'binary':
+        f_name = secure_filename(f'station{station.station_num}_{date}T' +
+                                 f'{time}Z.rec')
+        schema, record = encoder.encode(data)
 
-    for thread in threads:
-        thread.join()
+        # the schema goes first so the server can decode the record
+        if schema is not None:
+            schema_id = record[:4].hex()
+            store.add(secure_filename(f'station{station.station_num}_schema_' +
+                                      f'{schema_id}.json'),
+                      json.dumps(schema).encode())
+        store.add(f_name, record)
 
+    else:
+        # construct secure file name
+        f_name = secure_filename(f'station{station.station_num}_{date}T' +
+                                 f'{time}Z.json')
 
-def save_data(date: str, time: str, data: dict) -> None:
+        # add data to the files waiting to be sent
+        store.add(f_name, json.dumps(data).encode())
+
+    # let the sender daemon know there is a new file to upload
+    modules.notify_sender(f_name)
+
+
+def write_record(boundary: float) -> dict:
     '''
-    Save date collected by the sensors into a file and call sender to send it
-    @param date Date data was collected, to be used in file name
-    @param time Time data was collected, to be used in file name
-    @param data Dict to save
+    Writes the record of a boundary: reads the gps, collects diagnostics,
+    adds the sensors' latest readings and hands the file to the sender
+    @param boundary monotonic time of the record, a slot of the scheduler
+    @return seconds spent in each step of the record
     '''
+    stamp = datetime.datetime.utcfromtimestamp(
+        round(scheduler.wall_time(boundary)))
 
-    # construct secure file name
-    f_name = secure_filename(f'station{station.station_num}_{date}T{time}Z' +
-                             '.json')
-
-    # dump data into file
-    with open(os.path.join(modules.HOME, 'data_logs', f_name), 'w') as f:
-        json.dump(data, f, indent=4)
+    global data_to_save
+    data_to_save = {}  # reset data to save in case it holds data from prev
+    modules.log('Starting data collection')
+    stages = {}  # time spent in each step of the record
+    start = time.monotonic()
 
-    # send the file to server
-    os.system(f'python3 {os.path.join(modules.HOME, "sender.py")}')
+    # count how many of each sensor
+    # initialize all lists within data_to_save
+    data_init()
 
+    # collect GPS data, the gps is read in the background
+    modules.log('collecting GPS data')
+    gps_data = collect_gps_data()
+    stamp_record(gps_data, stamp)
+    stages['gps'] = time.monotonic() - start
 
-##########
+    # collect diagnostics, dated like the record since only this script
+    # reads the gps
+    modules.log('Collecting diagnostics')
+    collect_diag(gps_data['date'], gps_data['time'])
+    stages['diagnostics'] = time.monotonic() - start - sum(stages.values())
 
+    # add the sensors' latest readings
+    merge_readings()
 
-def main():
-    while True:
-        # collect start time
-        start_measurement_cycle = time.time()
+    # save file and notify sender to dispatch
+    save_data(gps_data['date'], gps_data['time'], data_to_save)
+    stages['save'] = time.monotonic() - start - sum(stages.values())
 
-        global data_to_save
-        data_to_save = {}  # reset data to save in case it holds data from prev
-        modules.log('Starting data collection')
+    return stages
 
-        # count how many of each sensor
-        # initialize all lists within data_to_save
-        data_init()
 
-        # set up data_to_save for data collection
-        init_threads()
+##########
 
-        # collect GPS data while other threads collect sensor data
-        modules.log('collecting GPS data')
-        gps_data = collect_gps_data()
 
-        # save data and time for diagnostics purposes
-        # Since only one python script can make use of the gps at any time, the
-        # diagnostics file has no access to it
-        save_time_date(gps_data)
+def main():
+    # every sensor measures in its own thread from now on, they keep running
+    # if supervisor.py restarts this loop
+    if not scheduler.jobs:
+        init_scheduler()
 
-        # collect diagnostics
-        modules.log('Collecting diagnostics')
-        collect_diag()
+    while True:
+        # wait for the next record, aligned with the sensors' schedule and
+        # the wall clock
+        boundary = scheduler.next_slot(SAMPLING_INTERVAL)
+        scheduler.wait_until(boundary)
 
-        join_threads()
+        stages = write_record(boundary)
 
-        # save file and call sender to dispatch
-        save_data(gps_data['date'], gps_data['time'], data_to_save)
+        log_timings(stages)
+        log_bus_usage()
+        log_duty_cycles()
 
-        elapsed_time = time.time() - start_measurement_cycle
-        time.sleep(max(0, SAMPLING_INTERVAL - elapsed_time))  # protect from
-        # possible case where sensor stalls past 10 minutes
+        # follow the wall clock if it was corrected (i.e by ntp after boot)
+        if scheduler.align():
+            modules.log('Wall clock changed, schedule realigned')
 
     return 0  # should never run
 
 
 if __name__ == '__main__':
+    modules.buffer_logs()
     main()
@@ -19,10 +19,12 @@ You should have received a copy of the GNU General Public License along with
 
 import time
 import json
-import os
+import datetime
 import station_id as station
 from werkzeug.utils import secure_filename
 import packages.modules as modules
+from packages.store import SampleStore
+from packages.events import EventStore
 
 ##########
 
@@ -37,79 +39,36 @@ Collects disk space and cpu temperature
 
 SAMPLING_INTERVAL = 86400  # in seconds
 DATA_SAMPLING_INTERVAL = 600
-DIAG_FILE = os.path.join(modules.HOME, f'station{station.station_num}' +
-                         '_diagnostics.txt')
-TIME_FILE = os.path.join(modules.HOME, 'time.txt')
-
 
 ##########
 
+# global variables
 
-def wait_for_files() -> None:
-    '''
-    Diagnostics needs data collection to create these files before running.
-    This loop waits in case they haven't been created yet
-    '''
-
-    # loop until files exist
-    while not (os.path.isfile(DIAG_FILE) and os.path.isfile(TIME_FILE)):
-        modules.log('No diagnostics to send')
-        time.sleep(600)
+store = SampleStore()  # files waiting for the sender
+events = EventStore()  # errors and status recorded by data collection
 
 
-def get_date_time() -> tuple:
-    '''
-    Since 2 scripts can't use the gps and data collection needs it, accurate
-    date/time info is stored by data collection in a temp file
-    @return 2-tuple with date and time string variables
-    '''
-
-    # stores these in time_f for us to use
-    with open(TIME_FILE, 'r') as time_f:
-        curr_time = time_f.readline().strip()
-        curr_date = time_f.readline().strip()
-
-    return curr_date, curr_time
+##########
 
 
-def read_groups() -> list:
+def stamp(epoch: float) -> tuple:
     '''
-    Collects all the groups of data from the daig file written by
-    data_collection
-    A single entry in diag is a group of lines, different entries are separated
-    by an empty line
-    This methods creates a 2-d list where each index is a group and each inner
-    array are the lines of the group
-    @return 2-d array of groups
+    @param epoch seconds since the Unix epoch
+    @return (date, time) strings in UTC
     '''
+    moment = datetime.datetime.utcfromtimestamp(round(epoch))
+    return moment.date().isoformat(), moment.time().isoformat()
 
-    # read the contents of diag_file to send and format
-    with open(DIAG_FILE, 'r') as in_f:
-        # read groups of lines
-        groups = []
-        temp = []
-
-        for line in in_f:
-            line = line.strip()
-
-            # current group of data is finished, add it to groups
-            if line == '' and len(temp) != 0:
-                groups.append(temp)
-                temp = []
-            # current line is part of bigger group, append to temp
-            elif line != 0:
-                temp.append(line.strip())
 
-    return groups
-
-
-def process_groups(groups: list) -> dict:
+def process_events(errors: list, statuses: list) -> dict:
     '''
-    Process the diagnostics groups into the diagnostics dictionary
-    Figures out what kind of diagnostic it is. A group can either be
-    describing an error or a cpu temp / disk space collection
-    @param groups 2-d list of diagnostics
-    @return diag dictionary to format data into. Must fill in with the info
+    Formats the events recorded by data collection into the diagnostics
+    dictionary
+    Each error reports its last occurence (date, time, error) along with how
+    many times it happened and when it first did
+    @param errors errors as returned by EventStore.read()
+    @param statuses statuses as returned by EventStore.read()
+    @return diag dictionary to send
     '''
 
     # data structure to fill in and send to server
@@ -123,44 +82,39 @@ def process_groups(groups: list) -> dict:
         }
     }
 
-    # process each line group
-    for group in groups:
-
-        # check if group describes an error
-        if len(group) == 3:  # group is an error
-            time_date = group[0].strip().split(' ')
-            error_name = group[1].strip()
-            error = group[2].strip()
-
-            # fill in data
-            diag['errors'][error_name] = {
-                'time': time_date[1],
-                'date': time_date[0],
-                'error': error
-            }
-
-        elif len(group) == 5:  # group is a disk/cpu data
-            time_date = group[0].strip().split(' ')
-            cpu = group[2].strip()
-            disk = group[4].strip()
-
-            # fill in data
-            diag['cpu_temp'].append(cpu)
-            diag['disk_space'].append(disk)
-            diag['time'].append(time_date[1])
-            diag['date'].append(time_date[0])
+    for name, message, count, first, last in errors:
+        last_date, last_time = stamp(last)
+        first_date, first_time = stamp(first)
+        diag['errors'][name] = {
+            'time': last_time,
+            'date': last_date,
+            'error': message,
+            'count': count,
+            'first_time': first_time,
+            'first_date': first_date,
+        }
+
+    for date, rec_time, cpu, disk in statuses:
+        diag['cpu_temp'].append(cpu)
+        diag['disk_space'].append(disk)
+        diag['time'].append(rec_time)
+        diag['date'].append(date)
 
     return diag
 
 
-def save_data(date: str, time: str, data: dict, is_diag: bool = False) -> None:
+def save_data(date: str, time: str, data: dict, is_diag: bool = False,
+              cursor: int = None) -> None:
     '''
-    Save date collected by the sensors into a file and call sender to send it
+    Save date collected by the sensors into the store and notify the sender
     @param date Date data was collected, to be used in file name
     @param time Time data was collected, to be used in file name
     @param data Dict to save
     @param is_diag states if current data is from a diagnostics or not
         (affects file naming)
+    @param cursor cursor of the events data reports, acknowledged in the
+        same transaction the file is stored in. None if data reports no
+        events
     '''
 
     # construct secure file name (if is diag or not)
@@ -168,50 +122,55 @@ def save_data(date: str, time: str, data: dict, is_diag: bool = False) -> None:
     f_name = secure_filename(f'station{station.station_num}_{date}T{time}Z' +
                              end_of_f_name)
 
-    # dump data into file
-    with open(os.path.join(modules.HOME, 'data_logs', f_name), 'w') as f:
-        json.dump(data, f, indent=4)
+    # add data to the files waiting to be sent, forgetting the events it
+    # reports at once so they are sent exactly once
+    if cursor is None:
+        store.add(f_name, json.dumps(data).encode())
+    else:
+        events.acknowledge(cursor, f_name, json.dumps(data).encode())
 
-    # send the file to server
-    os.system(f'python3 {os.path.join(modules.HOME, "sender.py")}')
+    # let the sender daemon know there is a new file to upload
+    modules.notify_sender(f_name)
 
 
 ##########
 
 
-# sleep some time to let data_collection begin
-time.sleep(20)
-
-
 def main():
+    # sleep some time to let data_collection begin
+    time.sleep(20)
 
     while True:
         start_measurement_cycle = time.time()
 
-        # check if necessary files for data collection are available
-        wait_for_files()
+        # everything recorded by data_collection since the last report
+        cursor, errors, statuses = events.read()
 
-        curr_date, curr_time = get_date_time()
-
-        # read the diagnostics file and collect groups of data reported by
-        # data_collection
-        diag_groups = read_groups()
-
-        # Check again if file is empty, sleep for data_collection to fill
-        # diagnostics
-        if len(diag_groups) == 0:
+        # nothing recorded yet, sleep for data_collection to fill diagnostics
+        if len(errors) == 0 and len(statuses) == 0:
             modules.log('No diagnotics to send')
-            time.sleep(600)
+            time.sleep(DATA_SAMPLING_INTERVAL)
             continue
 
-        # process each group into the diagnostics dictionary
-        diagnostics = process_groups(diag_groups)
-
-        # dump file into data_logs
-        save_data(curr_date, curr_time, diagnostics, is_diag=True)
-
-        # reset contents of diag_file
-        open(DIAG_FILE, 'w').close()
+        # process the events into the diagnostics dictionary
+        diagnostics = process_events(errors, statuses)
+
+        # name the file after the last record, data_collection dates records
+        # with the gps
+        if statuses:
+            curr_date, curr_time = statuses[-1][0], statuses[-1][1]
+        else:
+            curr_date, curr_time = stamp(time.time())
+
+        # add file to the sample store and forget what it reports, events
+        # recorded meanwhile are kept. Nothing is forgotten if it fails
+        try:
+            save_data(curr_date, curr_time, diagnostics, is_diag=True,
+                      cursor=cursor)
+        except Exception as e:
+            modules.log('Failed to save diagnostics', error=str(e))
+            time.sleep(DATA_SAMPLING_INTERVAL)
+            continue
 
         # sleep until next day
         elapsed = time.time() - start_measurement_cycle
@@ -219,4 +178,5 @@ def main():
 
 
 if __name__ == '__main__':
+    modules.buffer_logs()
     main()
@@ -0,0 +1,214 @@
+'''
+
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+##########
+
+import time
+import sqlite3
+import threading
+from packages.store import STORE_PATH, TIMEOUT, create_samples, add_sample
+
+##########
+
+'''
+Diagnostics events, handed from data collection to diagnostics
+Replaces the station<n>_diagnostics.txt and time.txt files. Two tables of
+the station's SQLite database (next to the sample store) hold them:
+errors: one row per error name, repeated errors are coalesced into a count
+    with the first and last time they happened and the last message, so a
+    sensor failing every cycle updates a row instead of growing a file
+status: cpu temperature and disk usage of every record, with the record's
+    date and time, at most MAX_STATUS rows
+Every change is numbered (seq): diagnostics reads what changed after the
+last number it reported and acknowledges it, deleting what it has sent. The
+diagnostics file is added to the sample store in the same transaction, so a
+crash can neither lose the events nor report them twice.
+Errors keep counting until they are acknowledged, so a report that never
+reached the server is sent again with every occurrence. Errors that happened
+again after the read that was acknowledged are kept, counting only those
+'''
+
+##########
+
+# constants declarations
+
+MAX_STATUS = 1000  # status rows kept, about a week of records
+
+##########
+
+
+class EventStore:
+    '''
+    Bounded store of diagnostics events with an incremental read cursor
+    Several processes (data collection, diagnostics) may open the same
+    store at once
+    '''
+
+    def __init__(self, path: str = STORE_PATH) -> None:
+        '''
+        Opens the store, creating it if needed
+        @param path location of the database file
+        '''
+        self.lock = threading.Lock()
+
+        self.db = sqlite3.connect(path, timeout=TIMEOUT,
+                                  check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        with self.db:
+            self.db.execute('''CREATE TABLE IF NOT EXISTS errors (
+                                   name TEXT PRIMARY KEY,
+                                   message TEXT NOT NULL,
+                                   count INTEGER NOT NULL,
+                                   first REAL NOT NULL,
+                                   last REAL NOT NULL,
+                                   seq INTEGER NOT NULL,
+                                   new_count INTEGER NOT NULL DEFAULT 0,
+                                   new_first REAL)''')
+            # count and time of the first error since the last read, what
+            # is left of the row once the read is acknowledged. Added after
+            # the table, databases created before lack them
+            columns = [row[1] for row in
+                       self.db.execute('PRAGMA table_info(errors)')]
+            if 'new_count' not in columns:
+                self.db.execute('''ALTER TABLE errors ADD COLUMN
+                                   new_count INTEGER NOT NULL DEFAULT 0''')
+                self.db.execute('ALTER TABLE errors ADD COLUMN new_first REAL')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS status (
+                                   seq INTEGER PRIMARY KEY,
+                                   date TEXT NOT NULL,
+                                   time TEXT NOT NULL,
+                                   cpu_temp TEXT NOT NULL,
+                                   disk_space TEXT NOT NULL)''')
+            # numbers every change, shared by both tables
+            self.db.execute('''CREATE TABLE IF NOT EXISTS sequence (
+                                   seq INTEGER NOT NULL)''')
+            if self.db.execute('SELECT seq FROM sequence').fetchone() is None:
+                self.db.execute('INSERT INTO sequence (seq) VALUES (0)')
+            self.db.execute('''CREATE INDEX IF NOT EXISTS errors_seq
+                               ON errors (seq)''')
+            # acknowledge() adds the diagnostics file to the sample store
+            create_samples(self.db)
+
+    def _next_seq(self) -> int:
+        '''
+        Numbers a change, called within a transaction
+        '''
+        self.db.execute('UPDATE sequence SET seq = seq + 1')
+        return self.db.execute('SELECT seq FROM sequence').fetchone()[0]
+
+    def error(self, name: str, message: str) -> None:
+        '''
+        Records an error, coalescing it with earlier errors of the same name
+        not acknowledged yet
+        @param name error type (i.e particulate_matter0, gps)
+        @param message description of the error, the last one is kept
+        '''
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute('''INSERT INTO errors
+                               VALUES (?, ?, 1, ?, ?, ?, 1, ?)
+                               ON CONFLICT (name) DO UPDATE
+                               SET message = excluded.message,
+                                   count = count + 1,
+                                   last = excluded.last,
+                                   seq = excluded.seq,
+                                   new_count = new_count + 1,
+                                   new_first = coalesce(new_first,
+                                                        excluded.first)''',
+                            (name, message, now, now, self._next_seq(), now))
+
+    def status(self, date: str, time: str, cpu_temp: str,
+               disk_space: str) -> None:
+        '''
+        Records the station's status at a record, dropping the oldest status
+        beyond MAX_STATUS
+        @param date date of the record
+        @param time time of the record
+        @param cpu_temp temperature of the cpu
+        @param disk_space proportion of the disk in use
+        '''
+        with self.lock, self.db:
+            seq = self._next_seq()
+            self.db.execute('INSERT INTO status VALUES (?, ?, ?, ?, ?)',
+                            (seq, date, time, cpu_temp, disk_space))
+            self.db.execute('''DELETE FROM status WHERE seq <= (
+                                   SELECT seq FROM status
+                                   ORDER BY seq DESC LIMIT 1 OFFSET ?)''',
+                            (MAX_STATUS,))
+
+    def read(self, after: int = 0) -> tuple:
+        '''
+        Reads the events that changed after a cursor
+        Errors are reported with every occurrence not acknowledged yet
+        @param after cursor returned by a previous read, 0 for everything
+        @return (cursor, errors, statuses) with cursor the number of the
+            last change read, errors a list of (name, message, count, first,
+            last) tuples and statuses a list of (date, time, cpu_temp,
+            disk_space) tuples, both oldest first
+        '''
+        with self.lock, self.db:
+            cursor = self.db.execute('SELECT seq FROM sequence').fetchone()[0]
+            errors = self.db.execute('''SELECT name, message, count, first,
+                                               last
+                                        FROM errors
+                                        WHERE seq > ? AND seq <= ?
+                                        ORDER BY seq''',
+                                     (after, cursor)).fetchall()
+            statuses = self.db.execute('''SELECT date, time, cpu_temp,
+                                                 disk_space
+                                          FROM status
+                                          WHERE seq > ? AND seq <= ?
+                                          ORDER BY seq''',
+                                       (after, cursor)).fetchall()
+            # occurrences from now on are all acknowledge() will keep
+            self.db.execute('''UPDATE errors SET new_count = 0,
+                                                 new_first = NULL
+                               WHERE seq <= ?''', (cursor,))
+
+        return cursor, errors, statuses
+
+    def acknowledge(self, cursor: int, name: str = None,
+                    payload: bytes = None) -> None:
+        '''
+        Deletes the events read up to a cursor, errors that happened again
+        since are kept with the count and first time of those occurrences
+        @param cursor cursor returned by read()
+        @param name name of the file reporting the events, added to the
+            sample store (see SampleStore) in the same transaction. None to
+            only delete the events
+        @param payload contents of the file
+        '''
+        with self.lock, self.db:
+            if name is not None:
+                add_sample(self.db, name, payload)
+            self.db.execute('DELETE FROM errors WHERE seq <= ?', (cursor,))
+            self.db.execute('''UPDATE errors SET count = new_count,
+                                                 first = new_first
+                               WHERE seq > ? AND new_count > 0''',
+                            (cursor,))
+            self.db.execute('DELETE FROM status WHERE seq <= ?', (cursor,))
+
+    def close(self) -> None:
+        '''
+        Closes the database
+        '''
+        self.db.close()
@@ -0,0 +1,127 @@
+'''
+
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+##########
+
+import time
+import threading
+
+##########
+
+'''
+Health of a sensor, as a circuit breaker
+CLOSED: the sensor works, it is measured every period
+OPEN: the sensor failed FAILURE_THRESHOLD times in a row, it is left alone
+    until its backoff expires so that a missing or broken sensor costs
+    nothing
+HALF_OPEN: the backoff expired, the next measurement is a probe. If it
+    succeeds the breaker closes, otherwise it opens again with twice the
+    backoff, up to MAX_BACKOFF
+Usage:
+    breaker = CircuitBreaker(base_backoff=600)
+    if breaker.allow():
+        try:
+            measure()
+            breaker.success()
+        except Exception:
+            breaker.failure()
+'''
+
+##########
+
+# constants declarations
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+FAILURE_THRESHOLD = 3  # failures in a row opening the breaker
+MAX_BACKOFF = 6 * 3600  # seconds, longest wait between two probes
+
+##########
+
+
+class CircuitBreaker:
+    '''
+    Circuit breaker with exponential backoff between probes
+    '''
+
+    def __init__(self,
+                 base_backoff: float,
+                 threshold: int = FAILURE_THRESHOLD,
+                 max_backoff: float = MAX_BACKOFF) -> None:
+        '''
+        @param base_backoff seconds the breaker stays open the first time,
+            i.e the sensor's period
+        @param threshold failures in a row opening the breaker
+        @param max_backoff longest the breaker stays open
+        '''
+        self.base_backoff = base_backoff
+        self.threshold = threshold
+        self.max_backoff = max_backoff
+        self.state = CLOSED
+        self.failures = 0  # failures in a row
+        self.backoff = 0  # seconds the breaker stays open this time
+        self.retry_at = 0  # monotonic time the breaker half-opens
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        '''
+        @return True if the sensor should be measured now, an open breaker
+            whose backoff expired half-opens and lets a probe through
+        '''
+        with self.lock:
+            if self.state == OPEN and time.monotonic() >= self.retry_at:
+                self.state = HALF_OPEN
+            return self.state != OPEN
+
+    def success(self) -> bool:
+        '''
+        Records a successful measurement, closing the breaker
+        @return True if the sensor had been failing
+        '''
+        with self.lock:
+            recovered = self.failures > 0
+            self.state = CLOSED
+            self.failures = 0
+            self.backoff = 0
+            return recovered
+
+    def failure(self) -> bool:
+        '''
+        Records a failed measurement, opening the breaker after threshold
+        failures in a row or after a failed probe
+        @return True if the breaker opened
+        '''
+        with self.lock:
+            self.failures += 1
+            if self.state == CLOSED and self.failures < self.threshold:
+                return False
+
+            # open, doubling the backoff after every failed probe
+            if self.state == HALF_OPEN:
+                self.backoff = min(2 * self.backoff, self.max_backoff)
+            else:
+                self.backoff = min(self.base_backoff, self.max_backoff)
+            opened = self.state == CLOSED
+            self.state = OPEN
+            self.retry_at = time.monotonic() + self.backoff
+            return opened
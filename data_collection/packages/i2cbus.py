@@ -0,0 +1,215 @@
+'''
+
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+##########
+
+import time
+import threading
+from contextlib import contextmanager
+
+##########
+
+'''
+Arbitration of an I2C bus shared by several sensors read from different
+threads
+The adafruit drivers lock the bus with try_lock()/unlock() around each
+transaction, spinning on try_lock() until it succeeds. Blinka's lock is a
+plain flag, so threads can both get it and interleave their transfers, and
+spinning gives the bus to whoever happens to be scheduled.
+Each device is handed a DeviceBus instead of the busio.I2C object. Its
+try_lock() queues the thread on the BusArbiter, which grants the bus in
+order of arrival (a ticket lock), so a device never waits for more than the
+transactions queued before it. A device may also hold the bus for a session
+(i.e a whole reading of several registers): the driver's transactions within
+it go through back to back without queueing again, and no other device
+slips in between them.
+The arbiter keeps, for every device, how many times it was granted the bus,
+how long it held it, how long it waited for it and how many transfers and
+bytes went through
+'''
+
+##########
+
+
+class BusArbiter:
+    '''
+    Grants an I2C bus to one device at a time, first come first served
+    Usage:
+        arbiter = BusArbiter(busio.I2C())
+        bme280 = adafruit_bme280.Adafruit_BME280_I2C(arbiter.device('bme280'))
+    '''
+
+    def __init__(self, bus) -> None:
+        '''
+        @param bus busio.I2C object all the transfers go through
+        '''
+        self.bus = bus
+        self.cond = threading.Condition()
+        self.next_ticket = 0  # ticket the next thread to queue gets
+        self.serving = 0  # ticket allowed on the bus
+        self.owner = None  # thread holding the bus
+        self.depth = 0  # nested acquisitions by the owner
+        self.holder = None  # device holding the bus
+        self.granted_at = 0
+        self.usage = {}  # device: usage counters, see usage_report()
+
+    def device(self, name: str) -> 'DeviceBus':
+        '''
+        @param name name the device's usage is reported under
+        @return bus object to hand to the device's driver
+        '''
+        with self.cond:
+            self.usage.setdefault(name, self._counters())
+        return DeviceBus(self, name)
+
+    @staticmethod
+    def _counters() -> dict:
+        return {'grants': 0, 'bus_time': 0.0, 'wait_time': 0.0,
+                'transfers': 0, 'bytes': 0}
+
+    def acquire(self, name: str) -> None:
+        '''
+        Waits for the bus, behind the threads already waiting
+        The thread holding the bus may acquire it again
+        @param name device asking for the bus
+        '''
+        me = threading.current_thread()
+        with self.cond:
+            if self.owner is me:
+                self.depth += 1
+                return
+
+            queued_at = time.monotonic()
+            ticket = self.next_ticket
+            self.next_ticket += 1
+            while self.serving != ticket:
+                self.cond.wait()
+
+            self.owner = me
+            self.depth = 1
+            self.holder = name
+            self.granted_at = time.monotonic()
+            usage = self.usage[name]
+            usage['grants'] += 1
+            usage['wait_time'] += self.granted_at - queued_at
+
+    def release(self) -> None:
+        '''
+        Gives the bus to the next thread in line once the owner released it
+        as many times as it acquired it
+        '''
+        with self.cond:
+            if self.owner is not threading.current_thread():
+                raise RuntimeError('I2C bus released by a thread not ' +
+                                   'holding it')
+
+            self.depth -= 1
+            if self.depth > 0:
+                return
+
+            self.usage[self.holder]['bus_time'] += \
+                time.monotonic() - self.granted_at
+            self.owner = None
+            self.holder = None
+            self.serving += 1
+            self.cond.notify_all()
+
+    def count(self, name: str, n_bytes: int) -> None:
+        '''
+        Accounts a transfer, called with the bus held
+        @param name device that made the transfer
+        @param n_bytes bytes written and read
+        '''
+        usage = self.usage[name]
+        usage['transfers'] += 1
+        usage['bytes'] += n_bytes
+
+    def usage_report(self, reset: bool = False) -> dict:
+        '''
+        @param reset start counting again from zero
+        @return {device: {'grants', 'bus_time', 'wait_time', 'transfers',
+            'bytes'}}, times in seconds
+        '''
+        with self.cond:
+            report = {name: dict(usage) for name, usage in self.usage.items()}
+            if reset:
+                for name in self.usage:
+                    self.usage[name] = self._counters()
+
+        return report
+
+
+class DeviceBus:
+    '''
+    A device's view of a shared I2C bus, stands in for busio.I2C with the
+    device's driver
+    try_lock() waits for the device's turn instead of failing, drivers spin
+    on it anyway
+    '''
+
+    def __init__(self, arbiter: BusArbiter, name: str) -> None:
+        self.arbiter = arbiter
+        self.name = name
+
+    def try_lock(self) -> bool:
+        self.arbiter.acquire(self.name)
+        return True
+
+    def unlock(self) -> None:
+        self.arbiter.release()
+
+    @contextmanager
+    def session(self):
+        '''
+        Holds the bus for several transactions, i.e all the registers of a
+        reading
+        Usage:
+            with i2c.session():
+                temperature = sensor.temperature
+                humidity = sensor.relative_humidity
+        '''
+        self.arbiter.acquire(self.name)
+        try:
+            yield self
+        finally:
+            self.arbiter.release()
+
+    def scan(self) -> list:
+        with self.session():
+            return self.arbiter.bus.scan()
+
+    def writeto(self, address: int, buffer, **kwargs) -> None:
+        self.arbiter.count(self.name, len(buffer))
+        self.arbiter.bus.writeto(address, buffer, **kwargs)
+
+    def readfrom_into(self, address: int, buffer, **kwargs) -> None:
+        self.arbiter.count(self.name, len(buffer))
+        self.arbiter.bus.readfrom_into(address, buffer, **kwargs)
+
+    def writeto_then_readfrom(self, address: int, buffer_out, buffer_in,
+                              **kwargs) -> None:
+        self.arbiter.count(self.name, len(buffer_out) + len(buffer_in))
+        self.arbiter.bus.writeto_then_readfrom(address, buffer_out, buffer_in,
+                                               **kwargs)
+
+    def __getattr__(self, attr: str):
+        # anything else (i.e frequency) is the bus'
+        return getattr(self.arbiter.bus, attr)
@@ -0,0 +1,234 @@
+'''
+
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+##########
+
+import os
+import json
+import queue
+import atexit
+import datetime
+import threading
+from collections import deque
+
+##########
+
+'''
+Asynchronous structured logger
+log() only timestamps the entry, keeps it in a ring of recent entries and
+queues it: a background thread writes the queued entries in batches, so the
+caller never waits on the file
+An entry is a message plus optional key/value fields, written on one line:
+    [2022-01-01 10:00:00] Sensor failed sensor=particulate_matter0 tries=3
+Log files are named after the month (time based rotation). A file growing
+past MAX_BYTES is renamed <file>.1 (the previous <file>.1 becoming <file>.2
+and so on, BACKUPS are kept) and a new one is started
+The ring keeps the last RING_SIZE entries in memory and can be searched by
+field for debugging, i.e logger.recent(10, sensor='particulate_matter0')
+'''
+
+##########
+
+# constants declarations
+
+MAX_BYTES = 4 * 1024 * 1024  # size of a log file before it is rotated
+BACKUPS = 3  # rotated files kept
+RING_SIZE = 500  # entries kept in memory
+BATCH_WAIT = 0.5  # seconds the writer waits for more entries
+
+##########
+
+
+class Logger:
+    '''
+    Logger writing in a background thread
+    Usage:
+        logger = Logger('/home/pi/logs', '{year}_{month}_logs.txt')
+        logger.log('Sending files', files=3)
+    '''
+
+    def __init__(self,
+                 folder: str,
+                 name_format: str,
+                 max_bytes: int = MAX_BYTES,
+                 backups: int = BACKUPS,
+                 ring_size: int = RING_SIZE) -> None:
+        '''
+        @param folder folder of the log files
+        @param name_format name of the log files, formatted with the year and
+            month of the entries (i.e '{year}_{month}.txt')
+        @param max_bytes size of a log file before it is rotated
+        @param backups number of rotated files kept
+        @param ring_size number of entries kept in memory
+        '''
+        self.folder = folder
+        self.name_format = name_format
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.ring = deque(maxlen=ring_size)
+        self.queue = queue.SimpleQueue()
+        # sink of the batches, see set_writer()
+        self.writer = None
+        self.sizes = {}  # path: size of the log file
+
+        self.thread = threading.Thread(target=self._run, name='logger',
+                                       daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def set_writer(self, writer) -> None:
+        '''
+        Hands the batches to a write-behind buffer (see
+        packages/writebehind.py) instead of writing them at once
+        @param writer object with append(path, text) and flush()
+        '''
+        self.writer = writer
+
+    def log(self, msg: str, **fields) -> None:
+        '''
+        Logs a message, never blocks on the file
+        @param msg message
+        @param fields key/value pairs describing the message (i.e
+            station='station1', latency=0.02)
+        '''
+        entry = (datetime.datetime.now(), msg, fields)
+        self.ring.append(entry)
+        self.queue.put(entry)
+
+    def recent(self, n: int = None, **match) -> list:
+        '''
+        Searches the entries kept in memory
+        @param n maximum number of entries, the most recent
+        @param match fields the entries must have, with these values
+        @return list of {'time', 'msg', <fields>} dictionaries, oldest first
+        '''
+        entries = [{'time': now.strftime('%Y-%m-%d %H:%M:%S'),
+                    'msg': msg, **fields}
+                   for now, msg, fields in list(self.ring)
+                   if all(fields.get(key, None) == value
+                          for key, value in match.items())]
+
+        return entries if n is None else entries[-n:]
+
+    def flush(self) -> None:
+        '''
+        Waits for the entries logged so far to be written, through the
+        write-behind buffer if there is one
+        '''
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait(5)  # don't hang at exit if the writer is stuck
+        if self.writer is not None:
+            try:
+                self.writer.flush()
+            except OSError:  # kept by the buffer, retried on its next flush
+                pass
+
+    def _run(self) -> None:
+        '''
+        Body of the writer thread, writes the entries in batches
+        '''
+        while True:
+            batch = [self.queue.get()]
+
+            # gather what else arrives meanwhile
+            try:
+                while True:
+                    batch.append(self.queue.get(timeout=BATCH_WAIT)
+                                 if len(batch) == 1
+                                 else self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            entries = [item for item in batch
+                       if not isinstance(item, threading.Event)]
+            # the thread must survive a failed batch, its entries are still
+            # in the ring
+            try:
+                self._write(entries)
+            except Exception:
+                pass
+
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+
+    def _write(self, entries: list) -> None:
+        '''
+        Writes a batch of entries, one append per log file
+        '''
+        lines = {}
+        for now, msg, fields in entries:
+            path = os.path.join(self.folder, self.name_format.format(
+                year=now.year, month=now.month))
+            lines.setdefault(path, []).append(format_entry(now, msg, fields))
+
+        for path, path_lines in lines.items():
+            text = ''.join(path_lines)
+            if path not in self.sizes:
+                self.sizes[path] = os.path.getsize(path) \
+                    if os.path.isfile(path) else 0
+            if self.sizes[path] + len(text) > self.max_bytes and \
+                    self.sizes[path] > 0:
+                self._rotate(path)
+
+            if self.writer is not None:
+                self.writer.append(path, text)
+            else:
+                with open(path, 'a', encoding='utf-8') as out_f:
+                    out_f.write(text)
+            self.sizes[path] += len(text)
+
+    def _rotate(self, path: str) -> None:
+        '''
+        Renames a full log file to <path>.1, shifting older ones
+        '''
+        # what is buffered belongs to the file being rotated
+        if self.writer is not None:
+            self.writer.flush()
+
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.isfile(f'{path}.{n}'):
+                os.replace(f'{path}.{n}', f'{path}.{n + 1}')
+        if self.backups > 0:
+            os.replace(path, f'{path}.1')
+        else:
+            os.remove(path)
+        self.sizes[path] = 0
+
+
+def format_entry(now: datetime.datetime, msg: str, fields: dict) -> str:
+    '''
+    @param now time of the entry
+    @param msg message
+    @param fields key/value pairs
+    @return line of the log file
+    '''
+    line = now.strftime('[%Y-%m-%d %H:%M:%S] ') + str(msg)
+    for key, value in fields.items():
+        if isinstance(value, float):
+            value = f'{value:.3f}'
+        elif isinstance(value, str) and (value == '' or
+                                         any(c in value for c in ' ="\n')):
+            value = json.dumps(value)
+        line += f' {key}={value}'
+
+    return line + '\n'
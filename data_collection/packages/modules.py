@@ -22,7 +22,10 @@ You should have received a copy of the GNU General Public License along with
 ##########
 
 import os
-import datetime
+import socket
+import threading
+from packages.logger import Logger
+from packages.writebehind import WriteBehind
 
 ##########
 
@@ -35,10 +38,27 @@ This module contains common functions used by data_collection and setup
 
 # constants declarations
 
-HOME = '/home/pi/'
-PATH = '/home/pi/boot/'
+# the station's files, ACCESS_HOME moves them elsewhere (i.e to run the
+# station's scripts off the Pi, see benchmarks/bench_loop.py)
+HOME = os.environ.get('ACCESS_HOME', '/home/pi/')
+PATH = os.path.join(HOME, 'boot/')
 STATE = 'state.txt'
+SENDER_SOCKET = os.path.join(HOME, 'sender.sock')
+IO_STATS = os.path.join(HOME, 'io_stats.json')  # daily writes of the logs
 
+##########
+
+# global variables
+
+# functions of a sender running in this process, called instead of sending a
+# datagram (see add_sender_listener)
+sender_listeners = []
+# writes the logs in a background thread, started by the first log()
+logger = None
+logger_lock = threading.Lock()
+# buffers the logs in RAM once buffer_logs() is called, None writes them
+# straight away
+writer = None
 
 ##########
 
@@ -51,23 +71,95 @@ def run(comm: str) -> None:
     os.system(comm)
 
 
-def log(msg: str) -> None:
+def log(msg: str, **fields) -> None:
     '''
     Log information for later debugging
-    Collects timestamp of log
+    Collects timestamp of log, the line is written by a background thread
+    (see packages/logger.py) so the caller never waits on the SD card
     @param msg String to write into log file
+    @param fields key/value pairs written after the message (i.e
+        sensor='particulate_matter0')
+    '''
+    get_logger().log(msg, **fields)
+
+
+def get_logger() -> Logger:
+    '''
+    @return the logger of this process, created on first use
+    '''
+    global logger
+    with logger_lock:
+        if logger is None:
+            logger = Logger(os.path.join(HOME, 'logs'),
+                            '{year}_{month}_logs.txt')
+            if writer is not None:
+                logger.set_writer(writer)
+
+    return logger
+
+
+def buffer_logs() -> None:
+    '''
+    Keeps the logs of this process in RAM, writing them to the SD card in
+    batches (see packages/writebehind.py). Meant for long running processes,
+    logs still waiting are lost if the process is killed
+    '''
+    global writer
+    if writer is None:
+        writer = WriteBehind(stats_path=IO_STATS)
+        get_logger().set_writer(writer)
+
+
+def flush_logs() -> None:
+    '''
+    Writes the buffered logs now, i.e before something that could kill the
+    process
+    '''
+    get_logger().flush()
+
+
+def add_sender_listener(listener) -> None:
+    '''
+    Registers a sender running in this process (i.e under supervisor.py),
+    notify_sender() then calls it directly instead of using the socket
+    @param listener function taking the name of the new file, must not block
     '''
+    sender_listeners.append(listener)
 
-    # get current time
-    now = datetime.datetime.now()
-    year = now.year
-    month = now.month
 
-    # append log
-    with open(os.path.join(HOME, 'logs', f'{year}_{month}_logs.txt'),
-              'a') as out_f:
-        out_f.write(now.strftime('[%Y-%m-%d %H:%M:%S] '))
-        out_f.write(msg + '\n')
+def remove_sender_listener(listener) -> None:
+    '''
+    Unregisters a sender added with add_sender_listener(), i.e when it stops
+    @param listener function given to add_sender_listener()
+    '''
+    if listener in sender_listeners:
+        sender_listeners.remove(listener)
+
+
+def notify_sender(f_name: str = '') -> bool:
+    '''
+    Lets the sender daemon know a new file is waiting to be uploaded
+    The notification is a single datagram on a local unix socket so the caller
+    never blocks on the upload, or a direct call if the sender runs in this
+    process. If the daemon is not running, the file simply waits in the
+    sample store until the daemon's next scan
+    @param f_name name of the file that was just saved
+    @return True if the daemon was notified
+    '''
+    if sender_listeners:
+        for listener in sender_listeners:
+            listener(f_name)
+        return True
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.setblocking(False)
+            sock.sendto(f_name.encode(), SENDER_SOCKET)
+    except OSError:
+        log(f'Sender daemon not reachable, {f_name} left for next scan')
+        return False
+
+    return True
 
 
 def write_state(num: int) -> None:
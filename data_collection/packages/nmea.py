@@ -0,0 +1,205 @@
+'''
+
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+##########
+
+from functools import reduce
+from operator import xor
+
+##########
+
+'''
+Minimal NMEA 0183 parser for the only sentences the stations use: GGA
+(position), RMC (date) and GSA (dilution of precision)
+Sentences are rejected as cheaply as possible: first by talker id and
+sentence type, which only looks at 5 characters, then by checksum, and only
+then split into fields. Values are returned in the form of the gpsfix
+dictionary built by the GPS beseechers, no objects are constructed
+pynmea2 remains the reference, see benchmarks/bench_nmea.py
+'''
+
+##########
+
+# constants declarations
+
+# GP: GPS only receivers, GN: receivers combining several constellations
+TALKERS = ('GP', 'GN')
+
+##########
+
+
+def valid_checksum(line: str, star: int) -> bool:
+    '''
+    Checks the checksum of a sentence, the xor of all characters between '$'
+    and '*' written as 2 hexadecimal digits after the '*'
+    @param line sentence, starting with '$'
+    @param star index of the '*' in line
+    @return True if the checksum matches
+    '''
+    try:
+        expected = int(line[star + 1:star + 3], 16)
+    except ValueError:
+        return False
+
+    return reduce(xor, line[1:star].encode(), 0) == expected
+
+
+def to_time(hhmmss: str) -> str:
+    '''
+    Converts an nmea time to iso format, dropping fractions of a second
+    @param hhmmss time field, i.e 165012.00
+    @return time in the form hh:mm:ss, None if the field is empty
+    '''
+    if len(hhmmss) < 6:
+        return None
+
+    return f'{hhmmss[0:2]}:{hhmmss[2:4]}:{hhmmss[4:6]}'
+
+
+def to_date(ddmmyy: str) -> str:
+    '''
+    Converts an nmea date to iso format
+    @param ddmmyy date field, i.e 210722
+    @return date in the form yyyy-mm-dd, None if the field is empty
+    '''
+    if len(ddmmyy) != 6:
+        return None
+
+    return f'20{ddmmyy[4:6]}-{ddmmyy[2:4]}-{ddmmyy[0:2]}'
+
+
+def to_degrees(value: str, direction: str) -> float:
+    '''
+    Converts an nmea coordinate to signed decimal degrees
+    @param value coordinate in the form (d)ddmm.mmmm
+    @param direction one of N, S, E, W
+    @return decimal degrees, negative south and west, None if empty
+    '''
+    if not value:
+        return None
+
+    # the minutes always take the 2 digits before the decimal point
+    split = value.index('.') - 2 if '.' in value else len(value) - 2
+    degrees = float(value[:split]) + float(value[split:]) / 60
+
+    return -degrees if direction in ('S', 'W') else degrees
+
+
+def to_float(value: str) -> float:
+    '''
+    @param value numeric field
+    @return field as a float, None if empty
+    '''
+    return float(value) if value else None
+
+
+def parse_gga(fields: list) -> dict:
+    '''
+    Reads the position from a GGA sentence
+    @param fields comma separated fields after the sentence type
+    @return dictionary with the gpsfix keys the sentence fills, None if the
+        receiver has no fix
+    '''
+    # fix quality, 0 means no fix
+    if fields[5] in ('', '0'):
+        return None
+
+    return {
+        'time': to_time(fields[0]),
+        'latitude': to_degrees(fields[1], fields[2]),
+        'lat_dir': fields[2],
+        'longitude': to_degrees(fields[3], fields[4]),
+        'lon_dir': fields[4],
+        'altitude': to_float(fields[8]),
+        'alt_unit': fields[9],
+        'num_sats': int(fields[6]),
+    }
+
+
+def parse_rmc(fields: list) -> dict:
+    '''
+    Reads the date and time from an RMC sentence
+    @param fields comma separated fields after the sentence type
+    @return dictionary with the date, time and 'valid', False if the
+        receiver has no fix and its clock may not be set. None if the
+        sentence has no date
+    '''
+    date = to_date(fields[8])
+    if date is None:
+        return None
+
+    return {'date': date,
+            'time': to_time(fields[0]),
+            'valid': fields[1] == 'A'}
+
+
+def parse_gsa(fields: list) -> dict:
+    '''
+    Reads the dilution of precision from a GSA sentence
+    @param fields comma separated fields after the sentence type
+    @return dictionary with the gpsfix keys the sentence fills
+    '''
+    # the receiver may append a system id after the vdop
+    return {
+        'PDOP': to_float(fields[14]),
+        'HDOP': to_float(fields[15]),
+        'VDOP': to_float(fields[16]),
+    }
+
+
+# parsers by sentence type
+PARSERS = {
+    'GGA': parse_gga,
+    'RMC': parse_rmc,
+    'GSA': parse_gsa,
+}
+
+
+def parse(line: str) -> tuple:
+    '''
+    Parses a sentence if it is one the stations use
+    @param line sentence as read from the receiver, trailing whitespace is
+        ignored
+    @return (sentence_type, values) where values is the dictionary returned
+        by the type's parser, None if the sentence is of no use, corrupted or
+        holds no data
+    '''
+    if line[:1] != '$' or line[1:3] not in TALKERS:
+        return None
+
+    sentence_type = line[3:6]
+    parser = PARSERS.get(sentence_type, None)
+    if parser is None:
+        return None
+
+    star = line.rfind('*')
+    if star < 0 or not valid_checksum(line, star):
+        return None
+
+    try:
+        values = parser(line[7:star].split(','))
+    except (IndexError, ValueError):  # truncated or garbled fields
+        return None
+
+    if values is None:
+        return None
+
+    return sentence_type, values
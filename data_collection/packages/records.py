@@ -0,0 +1,363 @@
+'''
+
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+##########
+
+import json
+import struct
+import hashlib
+
+##########
+
+'''
+Compact binary encoding of the samples collected by data_collection
+A sample is split in two:
+    a schema, a json object describing the layout of the sample (sensor
+        categories, keys, value types and the values that never change such
+        as 'type' and 'sensor'). It is sent once, whenever the layout changes
+    a record, a fixed-layout binary string holding only the measurements
+
+Record layout (little endian, no padding):
+    4 bytes     schema id, first 4 bytes of the sha256 of the schema
+    N bytes     presence bitmap, bit i set if group i (a sensor) reported
+    per group   null bitmap (bit j set if field j is None), the fields packed
+                with the struct codes in the schema, then the group's boolean
+                flags (i.e 'diagnostics') packed into a single integer
+
+The receiver's modules/records.py decodes records back into the exact
+dictionary data_collection built
+'''
+
+##########
+
+# constants declarations
+
+VERSION = 1
+GPS = 'date_time_position'
+FLAGS = 'diagnostics'  # boolean maps packed as bits
+# keys with values that don't change for a given sensor, kept in the schema
+CONSTANTS = ('type', 'sensor')
+# nextpm diagnostics are packed with the bits of the sensor's status byte
+NEXTPM_BITS = {
+    'Degraded':  2,
+    'Notready':  4,
+    'Eccess_RH': 8,
+    'T_RH_off':  16,
+    'Fan_error': 32,
+    'Mem_error': 64,
+    'Las_error': 128,
+}
+INT32 = (-2**31, 2**31 - 1)
+
+##########
+
+
+def value_code(value) -> str:
+    '''
+    Picks the struct code used to store a value
+    @param value value found in a sample
+    @return struct format code
+    '''
+    if isinstance(value, bool):
+        return '?'
+    if isinstance(value, int):
+        return 'i' if INT32[0] <= value <= INT32[1] else 'q'
+    if isinstance(value, str):
+        return f'{len(value.encode())}s'
+
+    # floats, and None as the most likely type it will take
+    return 'd'
+
+
+def value_fits(value, code: str) -> bool:
+    '''
+    Checks that a value can be stored with a struct code without changing it
+    @param value value found in a sample
+    @param code struct format code from the schema
+    @return True if the value can be stored, None always can
+    '''
+    if value is None:
+        return True
+    if code == '?':
+        return isinstance(value, bool)
+    if code in ('i', 'q'):
+        return isinstance(value, int) and not isinstance(value, bool) and \
+            (code == 'q' or INT32[0] <= value <= INT32[1])
+    if code == 'd':
+        return isinstance(value, float)
+
+    # strings, shorter ones are padded
+    return isinstance(value, str) and len(value.encode()) <= int(code[:-1])
+
+
+def flag_code(bits: list) -> str:
+    '''
+    Picks the smallest integer able to hold a group's flags
+    @param bits list of [name, bit] pairs
+    @return struct format code
+    '''
+    top = max([bit for _, bit in bits], default=0)
+    if top < 2**8:
+        return 'B'
+    if top < 2**16:
+        return 'H'
+
+    return 'I'
+
+
+def group_format(group: dict) -> str:
+    '''
+    Builds the struct format of a group in a record
+    @param group group from the schema
+    @return struct format without byte order
+    '''
+    fmt = f'{(len(group["fields"]) + 7) // 8}s'
+    fmt += ''.join(code for _, code in group['fields'])
+    if group['flags'] is not None:
+        fmt += flag_code(group['flags'])
+
+    return fmt
+
+
+def record_struct(schema: dict) -> struct.Struct:
+    '''
+    Builds the struct of a whole record
+    @param schema schema of the record
+    @return compiled struct
+    '''
+    fmt = f'<4s{(len(schema["groups"]) + 7) // 8}s'
+    fmt += ''.join(group_format(group) for group in schema['groups'])
+
+    return struct.Struct(fmt)
+
+
+def make_group(category: str, slot: int, reading: dict) -> dict:
+    '''
+    Describes the layout of a single sensor's reading
+    @param category sensor category (i.e particulate_matter)
+    @param slot index of the sensor in its category, None for the gps
+    @param reading dictionary returned by the sensor
+    @return group for the schema
+    '''
+    group = {
+        'category': category,
+        'slot': slot,
+        'keys': list(reading),
+        'constants': {},
+        'fields': [],
+        'flags': None,
+    }
+
+    for key, value in reading.items():
+        if key in CONSTANTS and slot is not None:
+            group['constants'][key] = value
+        elif key == FLAGS and isinstance(value, dict):
+            bits = NEXTPM_BITS if reading.get('type') == 'nextpm' else {}
+            group['flags'] = [[flag, bits.get(flag, 1 << i)]
+                              for i, flag in enumerate(value)]
+        else:
+            group['fields'].append([key, value_code(value)])
+
+    return group
+
+
+def build_schema(data: dict) -> dict:
+    '''
+    Describes the layout of a sample
+    @param data sample as built by data_collection
+    @return schema
+    '''
+    schema = {'version': VERSION, 'order': list(data), 'slots': {},
+              'groups': []}
+
+    for category, readings in data.items():
+        # the gps reports a single dictionary
+        if category == GPS:
+            schema['groups'].append(make_group(category, None, readings))
+            continue
+
+        schema['slots'][category] = len(readings)
+        for slot, reading in enumerate(readings):
+            if reading is not None:
+                schema['groups'].append(make_group(category, slot, reading))
+
+    return schema
+
+
+def schema_id(schema: dict) -> bytes:
+    '''
+    Identifies a schema by the hash of its contents
+    @param schema schema to identify
+    @return 4 byte id
+    '''
+    text = json.dumps(schema, sort_keys=True).encode()
+    return hashlib.sha256(text).digest()[:4]
+
+
+def get_reading(data: dict, group: dict):
+    '''
+    Finds the reading a group describes in a sample
+    @param data sample as built by data_collection
+    @param group group from the schema
+    @return the sensor's dictionary, None if it didn't report
+    '''
+    readings = data.get(group['category'], None)
+    if group['slot'] is None or readings is None:
+        return readings
+
+    return readings[group['slot']]
+
+
+def group_fits(group: dict, reading: dict) -> bool:
+    '''
+    Checks that a sensor's reading matches its group in a schema
+    @param group group from the schema
+    @param reading dictionary returned by the sensor
+    @return True if the reading can be encoded with the group
+    '''
+    # same keys, in the same order
+    if list(reading) != group['keys']:
+        return False
+
+    for key, value in group['constants'].items():
+        if reading[key] != value:
+            return False
+
+    for key, code in group['fields']:
+        if not value_fits(reading[key], code):
+            return False
+
+    if group['flags'] is not None:
+        flags = reading[FLAGS]
+        if not isinstance(flags, dict) or \
+                list(flags) != [flag for flag, _ in group['flags']]:
+            return False
+
+    return True
+
+
+def fits(schema: dict, data: dict) -> bool:
+    '''
+    Checks that a sample can be encoded with a schema
+    Sensors missing from the sample are fine, sensors missing from the schema
+    are not
+    @param schema schema to check against
+    @param data sample as built by data_collection
+    @return True if the sample can be encoded
+    '''
+    if schema['order'] != list(data):
+        return False
+
+    for category, slots in schema['slots'].items():
+        if len(data[category]) != slots:
+            return False
+
+    # every reading must have a group
+    described = set((group['category'], group['slot'])
+                    for group in schema['groups'])
+    for category, readings in data.items():
+        if category == GPS:
+            continue
+        for slot, reading in enumerate(readings):
+            if reading is not None and (category, slot) not in described:
+                return False
+
+    for group in schema['groups']:
+        reading = get_reading(data, group)
+        if reading is not None and not group_fits(group, reading):
+            return False
+
+    return True
+
+
+def pack_group(group: dict, reading: dict) -> list:
+    '''
+    Turns a sensor's reading into the values of its group in a record
+    @param group group from the schema
+    @param reading dictionary returned by the sensor, None if it didn't report
+    @return list of values in struct order
+    '''
+    nulls = 0
+    values = []
+
+    for i, (key, code) in enumerate(group['fields']):
+        value = None if reading is None else reading[key]
+        if value is None:
+            nulls |= 1 << i
+            value = {'?': False, 'i': 0, 'q': 0, 'd': 0.0}.get(code, b'')
+        elif code.endswith('s'):
+            value = value.encode()
+        values.append(value)
+
+    values.insert(0, nulls.to_bytes((len(group['fields']) + 7) // 8,
+                                    'little'))
+
+    if group['flags'] is not None:
+        flags = {} if reading is None else reading[FLAGS]
+        values.append(sum(bit for flag, bit in group['flags']
+                          if flags.get(flag, False)))
+
+    return values
+
+
+def encode(schema: dict, data: dict) -> bytes:
+    '''
+    Encodes a sample into a record
+    Precondition: fits(schema, data)
+    @param schema schema of the record
+    @param data sample as built by data_collection
+    @return record
+    '''
+    present = 0
+    values = []
+
+    for i, group in enumerate(schema['groups']):
+        reading = get_reading(data, group)
+        if reading is not None:
+            present |= 1 << i
+        values += pack_group(group, reading)
+
+    present = present.to_bytes((len(schema['groups']) + 7) // 8, 'little')
+
+    return record_struct(schema).pack(schema_id(schema), present, *values)
+
+
+class RecordEncoder:
+    '''
+    Encodes samples, building a new schema only when the layout of the
+    samples changes (i.e a sensor reporting for the first time)
+    '''
+
+    def __init__(self) -> None:
+        self.schema = None
+
+    def encode(self, data: dict) -> tuple:
+        '''
+        Encodes a sample
+        @param data sample as built by data_collection
+        @return (schema, record) where schema is None if the record uses the
+            same schema as the previous one
+        '''
+        new_schema = None
+        if self.schema is None or not fits(self.schema, data):
+            new_schema = self.schema = build_schema(data)
+
+        return new_schema, encode(self.schema, data)
@@ -0,0 +1,195 @@
+'''
+
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+##########
+
+import math
+import time
+import threading
+
+##########
+
+'''
+Runs jobs periodically, each in its own thread and at its own period
+All jobs are aligned on the same origin, so that a job with period P runs at
+origin + k * P. The origin is the monotonic time of the Unix epoch, so slots
+fall on round wall clock times (i.e :00, :10, :20 for a 600 s period) on
+every station, while sleeping on the monotonic clock never drifts. A job may
+also ask to start some time before each of its
+slots (i.e a sensor that needs to warm up) so that it is done by the time
+the slot comes. A job running late skips the slots it missed instead of
+running several times in a row
+DeadlineWorker bounds the time a job may block on a device
+'''
+
+##########
+
+# constants declarations
+
+# the origin is only moved when the wall clock stepped by more than this,
+# i.e when ntp first sets it after boot
+ALIGN_TOLERANCE = 0.5
+
+##########
+
+
+class Scheduler:
+    '''
+    Periodic scheduler on the monotonic clock
+    Usage:
+        scheduler = Scheduler()
+        scheduler.add(job, period=10)
+        scheduler.start()
+    '''
+
+    def __init__(self) -> None:
+        self.origin = None  # monotonic time the scheduler was started at
+        self.jobs = []
+        self.stopping = threading.Event()
+
+    def add(self, job, period: float, lead: float = 0,
+            name: str = None) -> None:
+        '''
+        Adds a job, must be called before start()
+        @param job function taking no arguments
+        @param period seconds between runs
+        @param lead seconds before each slot the job starts
+        @param name name of the job's thread
+        '''
+        self.jobs.append((job, period, lead, name))
+
+    def align(self) -> bool:
+        '''
+        Sets the origin to the monotonic time of the Unix epoch according to
+        the wall clock. Should be called now and then to follow the wall
+        clock if it gets corrected
+        @return True if the origin moved
+        '''
+        origin = time.monotonic() - time.time()
+        if self.origin is not None and \
+                abs(origin - self.origin) <= ALIGN_TOLERANCE:
+            return False
+
+        self.origin = origin
+        return True
+
+    def wall_time(self, when: float) -> float:
+        '''
+        Converts a monotonic time to the wall clock
+        @param when monotonic time, i.e a slot
+        @return seconds since the Unix epoch, slots give whole multiples of
+            their period
+        '''
+        return when - self.origin
+
+    def start(self) -> None:
+        '''
+        Sets the origin and starts one thread per job
+        The first run of each job is its first slot from now
+        '''
+        self.align()
+
+        for job, period, lead, name in self.jobs:
+            threading.Thread(target=self._run, args=(job, period, lead),
+                             name=name, daemon=True).start()
+
+    def stop(self) -> None:
+        '''
+        Stops scheduling jobs, jobs already running are not interrupted
+        '''
+        self.stopping.set()
+
+    def next_slot(self, period: float, lead: float = 0) -> float:
+        '''
+        Computes when a job should next run
+        @param period seconds between runs
+        @param lead seconds before each slot the job starts
+        @return monotonic time of the next run, always in the future
+        '''
+        slots = math.floor((time.monotonic() + lead - self.origin) / period)
+
+        return self.origin + (slots + 1) * period - lead
+
+    def wait_until(self, when: float) -> bool:
+        '''
+        Sleeps until a monotonic time
+        @param when time to wake up at
+        @return False if the scheduler was stopped while waiting
+        '''
+        return not self.stopping.wait(max(0, when - time.monotonic()))
+
+    def _run(self, job, period: float, lead: float) -> None:
+        '''
+        Body of a job's thread
+        '''
+        while self.wait_until(self.next_slot(period, lead)):
+            job()
+
+
+class DeadlineWorker:
+    '''
+    Runs a function in a daemon thread, waiting for it at most a given time
+    Threads can't be killed: a call that misses its deadline is abandoned and
+    left to finish in the background, and the worker refuses new calls until
+    it does so hung devices don't pile up threads
+    '''
+
+    def __init__(self, name: str = None) -> None:
+        self.name = name
+        self.thread = None  # thread of the last call
+
+    def busy(self) -> bool:
+        '''
+        @return True if the last call is still running
+        '''
+        return self.thread is not None and self.thread.is_alive()
+
+    def run(self, func, timeout: float):
+        '''
+        Calls a function, giving up after timeout seconds
+        @param func function taking no arguments
+        @param timeout seconds to wait for func
+        @return what func returns
+        @raise TimeoutError if func did not return in time or the previous
+            call is still running. Exceptions raised by func are raised again
+        '''
+        if self.busy():
+            raise TimeoutError('previous call still running')
+
+        outcome = {}
+
+        def target():
+            try:
+                outcome['result'] = func()
+            except Exception as e:
+                outcome['error'] = e
+
+        self.thread = threading.Thread(target=target, name=self.name,
+                                       daemon=True)
+        self.thread.start()
+        self.thread.join(timeout)
+
+        if self.thread.is_alive():
+            raise TimeoutError(f'no answer after {timeout} s')
+        if 'error' in outcome:
+            raise outcome['error']
+
+        return outcome['result']
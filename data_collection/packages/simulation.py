@@ -0,0 +1,1192 @@
+'''
+
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+##########
+
+import os
+import time
+import types
+import random
+import struct
+import datetime
+import functools
+import threading
+import ACCESS_station_lib as access
+
+##########
+
+'''
+Simulated hardware, to run the station's scripts on any Linux machine
+install() registers stand-ins for the hardware drivers with
+ACCESS_station_lib.driver(), so sensors.py builds the beseechers declared in
+sensors.json as usual, on top of simulated devices:
+NextPM: answers the binary protocol on any serial port (/dev/ttyAMA0...),
+    checking the checksum of the commands and adding one to its replies.
+    Its fan takes SPINUP seconds to be ready once switched on
+BME280, MS8607, SCD30: register and command level devices on a simulated
+    I2C bus, reached through small drivers standing in for the adafruit
+    ones. Transfers take the time they take on a 100 kHz bus and the
+    devices take their datasheet conversion times. Measurements use simple
+    linear encodings rather than the factory calibrations
+GPS: replays a recorded NMEA stream (benchmarks/sample.nmea) at the
+    receiver's baud rate, from its first fix, through pigpio's bit-banged
+    serial or a serial port (/dev/ttySOFT0), with the current time
+CPU temperature: gpiozero's CPUTemperature
+All sensors measure the same slowly drifting weather
+Faults are injected at random, fault_rate being the probability of a fault
+per command or transfer: NextPM replies lost or corrupted and the sensor
+unplugged for UNPLUG_TIME seconds, I2C transfers not acknowledged or the
+bus held for HANG_TIME seconds, corrupted NMEA sentences
+With a speedup, the station's periods, warm ups, time outs and the devices'
+slow processes (fan spin up, faults) are that many times shorter. Bus and
+serial transfers, conversion times and background sampling keep their real
+speed, they are what the benchmarks measure
+Usage, before importing sensors:
+    import packages.simulation as simulation
+    sim = simulation.install(speedup=60, fault_rate=0.01)
+'''
+
+##########
+
+# constants declarations
+
+NMEA_REPLAY = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'benchmarks', 'sample.nmea')
+I2C_FREQUENCY = 100000  # Hz
+MIN_TIMEOUT = 1  # seconds, sensors' time outs are not shortened below this
+# seconds of simulated time, divided by the speedup
+SPINUP = 15  # NextPM fan
+UNPLUG_TIME = 60
+HANG_TIME = 30
+DRIFT = 3600  # weather changes by about its spread every this many seconds
+
+# I2C addresses
+BME280_ADDRESS = 0x77
+MS8607_PT_ADDRESS = 0x76
+MS8607_RH_ADDRESS = 0x40
+SCD30_ADDRESS = 0x61
+
+# average weather and its spread, {quantity: (mean, spread)}
+WEATHER = {
+    'temperature': (32.0, 4.0),  # C
+    'humidity': (50.0, 12.0),  # %
+    'pressure': (1008.0, 4.0),  # hPa
+    'co2': (430.0, 40.0),  # ppm
+    'pm': (25.0, 10.0),  # PM2.5 ug/m3
+}
+
+##########
+
+
+class Simulation:
+    '''
+    Shared state of the simulated devices: speedup, weather, fault injection
+    and the devices on each port and bus address
+    '''
+
+    def __init__(self, speedup: float = 1, fault_rate: float = 0,
+                 seed: int = None, nmea_path: str = NMEA_REPLAY) -> None:
+        '''
+        @param speedup how many times faster than real time the station runs
+        @param fault_rate probability of a fault per command or transfer
+        @param seed seed of the random faults and weather, None for a random
+            one
+        @param nmea_path recorded NMEA stream the GPS replays
+        '''
+        self.speedup = speedup
+        self.fault_rate = fault_rate
+        self.nmea_path = nmea_path
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()  # protects rng, weather and faults
+
+        self.weather = {quantity: mean
+                        for quantity, (mean, spread) in WEATHER.items()}
+        self.weather_at = time.monotonic()
+        # faults injected so far, {device: {fault: count}}
+        self.faults = {}
+
+        self.serial_devices = {}  # port: device
+        self.i2c_devices = {}  # address: device
+        self.i2c_bus = None  # busio.I2C shared through board.I2C()
+
+        for device in (BME280Device(self), MS8607PTDevice(self),
+                       MS8607RHDevice(self), SCD30Device(self)):
+            self.i2c_devices[device.ADDRESS] = device
+
+    def scaled(self, seconds: float) -> float:
+        '''
+        @param seconds duration in simulated time
+        @return real duration
+        '''
+        return seconds / self.speedup
+
+    def fault(self, device: str, kinds: tuple) -> str:
+        '''
+        Draws whether a command or transfer fails, and how
+        @param device name of the device, for the count of faults
+        @param kinds faults the device may have
+        @return the fault, None if there is none
+        '''
+        with self.lock:
+            if self.rng.random() >= self.fault_rate:
+                return None
+            kind = self.rng.choice(kinds)
+            counts = self.faults.setdefault(device, {})
+            counts[kind] = counts.get(kind, 0) + 1
+
+        return kind
+
+    def ambient(self) -> dict:
+        '''
+        @return the current weather, {quantity: value}, drifting at random
+            around WEATHER
+        '''
+        with self.lock:
+            now = time.monotonic()
+            elapsed = (now - self.weather_at) * self.speedup
+            self.weather_at = now
+
+            # mean reverting random walk, moves by about the spread in DRIFT
+            pull = min(1.0, elapsed / DRIFT)
+            for quantity, (mean, spread) in WEATHER.items():
+                value = self.weather[quantity]
+                value += (mean - value) * pull + \
+                    self.rng.gauss(0, spread * pull ** 0.5)
+                self.weather[quantity] = value
+
+            weather = dict(self.weather)
+
+        weather['humidity'] = min(100.0, max(0.0, weather['humidity']))
+        weather['pm'] = max(0.0, weather['pm'])
+        return weather
+
+    def serial_device(self, port: str):
+        '''
+        @param port serial port (i.e /dev/ttyAMA0)
+        @return the device on the port, a GPS on software serial ports and a
+            NextPM on the others
+        '''
+        with self.lock:
+            if port not in self.serial_devices:
+                self.serial_devices[port] = \
+                    NMEAReplay(self, port) if 'SOFT' in port \
+                    else NextPMDevice(self, port)
+            return self.serial_devices[port]
+
+    def drivers(self) -> dict:
+        '''
+        @return the simulated drivers, {module name: module}
+        '''
+        def module(name, **attrs):
+            simulated = types.ModuleType(name)
+            vars(simulated).update(attrs)
+            return simulated
+
+        return {
+            'serial': module('serial',
+                             Serial=functools.partial(SerialPort, self),
+                             SerialException=SerialException),
+            'pigpio': module('pigpio', INPUT=0,
+                             pi=functools.partial(PigpioPi, self)),
+            'busio': module('busio', I2C=functools.partial(I2CBus, self)),
+            'board': module('board', SCL=3, SDA=2, I2C=self.board_i2c),
+            'adafruit_bme280.advanced': module(
+                'adafruit_bme280.advanced',
+                Adafruit_BME280_I2C=BME280Driver),
+            'adafruit_ms8607': module('adafruit_ms8607', MS8607=MS8607Driver),
+            'adafruit_scd30': module('adafruit_scd30', SCD30=SCD30Driver),
+            'gpiozero': module(
+                'gpiozero',
+                CPUTemperature=functools.partial(CPUTemperature, self)),
+        }
+
+    def board_i2c(self):
+        '''
+        board.I2C(), the same bus on every call
+        '''
+        with self.lock:
+            if self.i2c_bus is None:
+                self.i2c_bus = I2CBus(self)
+            return self.i2c_bus
+
+
+def install(speedup: float = 1, fault_rate: float = 0, seed: int = None,
+            nmea_path: str = NMEA_REPLAY) -> Simulation:
+    '''
+    Replaces the hardware drivers with simulated ones and shortens the
+    beseechers' periods, warm ups and time outs by speedup. Must be called
+    before the sensors are initialized
+    @param speedup how many times faster than real time the station runs
+    @param fault_rate probability of a fault per command or transfer
+    @param seed seed of the random faults and weather
+    @param nmea_path recorded NMEA stream the GPS replays
+    @return the simulation
+    '''
+    sim = Simulation(speedup, fault_rate, seed, nmea_path)
+    access.SIMULATED.update(sim.drivers())
+    accelerate(speedup)
+
+    return sim
+
+
+def accelerate(speedup: float) -> None:
+    '''
+    Divides the beseechers' periods, warm ups and time outs by speedup
+    Time outs are not shortened below MIN_TIMEOUT since transfers keep their
+    real speed
+    @param speedup how many times faster than real time the station runs
+    '''
+    classes = {beseecher for beseecher, _ in access.BESEECHERS.values()
+               if issubclass(beseecher, access.Beseecher)}
+    classes.add(access.ErrorBeseecher)
+
+    for beseecher in classes:
+        for constant in ('PERIOD', 'WARMUP', 'ACQUISITION_TIME',
+                         'MIN_OFF_TIME', 'WINDOW'):
+            # only classes defining or inheriting the constant
+            if hasattr(beseecher, constant):
+                setattr(beseecher, constant,
+                        getattr(beseecher, constant) / speedup)
+        beseecher.TIMEOUT = max(MIN_TIMEOUT, beseecher.TIMEOUT / speedup)
+
+
+def crc8(data: bytes, init: int) -> int:
+    '''
+    CRC-8 of the Sensirion and TE sensors, polynomial x^8 + x^5 + x^4 + 1
+    @param data bytes to check
+    @param init initial value, 0xFF for the SCD30, 0x00 for the MS8607
+    @return the crc
+    '''
+    crc = init
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x31) & 0xFF if crc & 0x80 else crc << 1
+
+    return crc
+
+
+##########
+
+# serial devices
+
+
+class SerialException(OSError):
+    '''
+    serial.SerialException
+    '''
+
+
+class SerialPort:
+    '''
+    serial.Serial on a simulated port. Bytes take their transfer time at
+    the port's baud rate
+    '''
+
+    def __init__(self, sim: Simulation, port: str, baudrate: int = 9600,
+                 timeout: float = None, **kwargs) -> None:
+        '''
+        @param sim simulation
+        @param port serial port
+        @param baudrate bits per second
+        @param timeout seconds read() waits, None to wait forever
+        @param kwargs parity, stop bits and byte size, ignored
+        '''
+        self.device = sim.serial_device(port)
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.rx = bytearray()  # bytes received, not read yet
+        self.pending = None  # (monotonic time it arrives, reply)
+        self.is_open = False
+        self.device.check()
+        self.is_open = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.is_open = False
+
+    def _transfer_time(self, n_bytes: int) -> float:
+        # a start bit, 8 data bits and a stop bit per byte
+        return n_bytes * 10 / self.baudrate
+
+    def _check(self) -> None:
+        if not self.is_open:
+            raise SerialException('Attempting to use a port that is not open')
+        self.device.check()
+
+    def reset_input_buffer(self) -> None:
+        self._check()
+        self.rx.clear()
+        self.pending = None
+
+    def write(self, data: bytes) -> int:
+        self._check()
+        time.sleep(self._transfer_time(len(data)))
+        reply = self.device.exchange(bytes(data))
+        if reply is not None:
+            self.pending = (time.monotonic() + self.device.LATENCY +
+                            self._transfer_time(len(reply)), reply)
+        return len(data)
+
+    def read(self, size: int = 1) -> bytes:
+        '''
+        Reads up to size bytes, waiting at most timeout seconds for them
+        '''
+        self._check()
+        deadline = time.monotonic() + \
+            (self.timeout if self.timeout is not None else 3600)
+
+        while len(self.rx) < size:
+            remaining = deadline - time.monotonic()
+            if self.pending is None or self.pending[0] - time.monotonic() > \
+                    remaining:
+                # nothing arrives in time, wait out the timeout
+                time.sleep(max(0, remaining))
+                break
+            arrival, reply = self.pending
+            time.sleep(max(0, arrival - time.monotonic()))
+            self._check()  # the device may have been unplugged meanwhile
+            self.rx += reply
+            self.pending = None
+
+        data = bytes(self.rx[:size])
+        del self.rx[:size]
+        return data
+
+    def readline(self) -> bytes:
+        '''
+        Reads a line, GPS ports only
+        '''
+        self._check()
+        line = self.device.readline()
+        time.sleep(self._transfer_time(len(line)))
+        return line
+
+
+class NextPMDevice:
+    '''
+    NextPM particulate matter sensor, speaks the binary protocol of the
+    NextPM User Guide v.3.4
+    '''
+
+    LATENCY = 0.005  # seconds before the sensor answers a command
+    FAULTS = ('drop', 'corrupt', 'unplug')
+    FIRMWARE = b'\x00\x23'
+
+    SLEEP_BIT = 1
+    NOTREADY_BIT = 4
+
+    def __init__(self, sim: Simulation, port: str) -> None:
+        self.sim = sim
+        self.port = port
+        self.on = True  # the sensor starts powered
+        self.ready_at = time.monotonic() + sim.scaled(SPINUP)
+        self.unplugged_until = 0
+
+    def check(self) -> None:
+        '''
+        @raise SerialException if the sensor is unplugged
+        '''
+        if time.monotonic() < self.unplugged_until:
+            raise SerialException(f'could not open port {self.port}: ' +
+                                  '[Errno 2] No such file or directory')
+
+    def state(self) -> int:
+        '''
+        @return the state byte of the replies
+        '''
+        if not self.on:
+            return self.SLEEP_BIT
+        if time.monotonic() < self.ready_at:
+            return self.NOTREADY_BIT
+        return 0
+
+    def exchange(self, cmd: bytes) -> bytes:
+        '''
+        Handles a command
+        @param cmd command written to the port
+        @return the sensor's reply, None if it doesn't answer
+        '''
+        # commands with a wrong address or checksum are ignored
+        if len(cmd) != 3 or cmd[0] != 0x81 or sum(cmd) % 256 != 0:
+            return None
+
+        fault = self.sim.fault('nextpm', self.FAULTS)
+        if fault == 'drop':
+            return None
+        if fault == 'unplug':
+            self.unplugged_until = time.monotonic() + \
+                self.sim.scaled(UNPLUG_TIME)
+            return None
+
+        code = cmd[1]
+        if code == 0x15:  # toggle power
+            self.on = not self.on
+            if self.on:
+                self.ready_at = time.monotonic() + self.sim.scaled(SPINUP)
+            data = b''
+        elif code == 0x16:  # status
+            data = b''
+        elif code == 0x17:
+            data = self.FIRMWARE
+        elif not self.on:
+            # a sleeping sensor answers measurements with its status
+            code = 0x16
+            data = b''
+        elif code == 0x14:
+            data = self.temperature_humidity()
+        elif code in (0x11, 0x12, 0x13):
+            data = self.particulate_matter(code)
+        else:
+            return None
+
+        reply = bytes((0x81, code, self.state())) + data
+        reply += bytes(((256 - sum(reply) % 256) % 256,))
+        if fault == 'corrupt':
+            reply = reply[:-1] + bytes((reply[-1] ^ 0xFF,))
+
+        return reply
+
+    def temperature_humidity(self) -> bytes:
+        '''
+        @return temperature and humidity inside the sensor, as the sensor
+            encodes them
+        '''
+        weather = self.sim.ambient()
+        # the sensor is a few degrees warmer than the air
+        t_raw = round((weather['temperature'] + 3 + 4.2488) / 0.9754 * 100)
+        rh_raw = round((weather['humidity'] - 5 + 4.7270) / 1.1768 * 100)
+
+        return struct.pack('>HH', max(0, t_raw), max(0, rh_raw))
+
+    def particulate_matter(self, code: int) -> bytes:
+        '''
+        @param code measurement command, shorter averages are noisier
+        @return particle counts (#/L) and masses (0.1 ug/m3) of PM1, PM2.5
+            and PM10
+        '''
+        pm25 = self.sim.ambient()['pm']
+        noise = {0x11: 0.15, 0x12: 0.05, 0x13: 0.02}[code]
+        with self.sim.lock:
+            pm25 *= 1 + self.sim.rng.gauss(0, noise)
+        pm25 = max(0.0, pm25)
+        masses = (0.6 * pm25, pm25, 1.6 * pm25)
+        counts = (mass * 60 for mass in masses)
+
+        return struct.pack('>6H', *(min(0xFFFF, round(value)) for value in
+                                    (*counts, *(10 * m for m in masses))))
+
+
+class NMEAReplay:
+    '''
+    GPS receiver replaying a recorded NMEA stream, in a loop, from its first
+    fix. Times and dates are replaced by the current ones
+    '''
+
+    LATENCY = 0
+    FAULTS = ('corrupt',)
+
+    def __init__(self, sim: Simulation, port: str = None) -> None:
+        self.sim = sim
+        with open(sim.nmea_path, 'r', encoding='ascii') as in_f:
+            lines = [line.strip() for line in in_f if line.startswith('$')]
+
+        # start at the first sentence with a valid fix, the receiver has
+        # been on for a while
+        start = next((n for n, line in enumerate(lines)
+                      if line[3:6] == 'RMC' and line.split(',')[2] == 'A'),
+                     0)
+        self.lines = lines[start:] + lines[:start]
+        self.next_line = 0
+        self.buffer = b''  # rest of a sentence being sent
+
+    def check(self) -> None:
+        return None
+
+    def exchange(self, data: bytes) -> bytes:
+        return None  # the receiver isn't configured
+
+    def readline(self) -> bytes:
+        '''
+        @return the next sentence, with its line ending
+        '''
+        line = self.lines[self.next_line]
+        self.next_line = (self.next_line + 1) % len(self.lines)
+
+        line = restamp(line, datetime.datetime.utcnow())
+        if self.sim.fault('gps', self.FAULTS) == 'corrupt':
+            with self.sim.lock:
+                n = self.sim.rng.randrange(1, len(line))
+            line = line[:n] + '#' + line[n + 1:]
+
+        return (line + '\r\n').encode('ascii')
+
+    def take(self, n_bytes: int) -> bytes:
+        '''
+        @param n_bytes number of bytes
+        @return the next bytes of the stream
+        '''
+        while len(self.buffer) < n_bytes:
+            self.buffer += self.readline()
+        data, self.buffer = self.buffer[:n_bytes], self.buffer[n_bytes:]
+        return data
+
+
+def restamp(line: str, now: datetime.datetime) -> str:
+    '''
+    Replaces the time of a GGA or RMC sentence, and the date of a RMC one
+    @param line NMEA sentence
+    @param now new time, UTC
+    @return the sentence with its checksum updated
+    '''
+    star = line.rfind('*')
+    if star < 0 or line[3:6] not in ('GGA', 'RMC'):
+        return line
+
+    fields = line[1:star].split(',')
+
+    fields[1] = now.strftime('%H%M%S.00')
+    if fields[0][2:] == 'RMC':
+        fields[9] = now.strftime('%d%m%y')
+
+    body = ','.join(fields)
+    checksum = 0
+    for char in body.encode('ascii'):
+        checksum ^= char
+
+    return f'${body}*{checksum:02X}'
+
+
+class PigpioPi:
+    '''
+    pigpio.pi(), only the bit-banged serial the GPS is read with
+    Bytes of the NMEA stream arrive at the baud rate
+    '''
+
+    BUFFER = 8192  # bytes pigpio keeps between reads
+
+    def __init__(self, sim: Simulation) -> None:
+        self.sim = sim
+        self.connected = True
+        self.readers = {}  # pin: [replay, bytes per second, last read]
+
+    def set_mode(self, pin: int, mode: int) -> None:
+        return None
+
+    def bb_serial_read_open(self, pin: int, baudrate: int,
+                            bytesize: int = 8) -> int:
+        self.readers[pin] = [NMEAReplay(self.sim), baudrate / 10,
+                             time.monotonic()]
+        return 0
+
+    def bb_serial_read(self, pin: int) -> tuple:
+        '''
+        @return (count, bytearray) of the bytes received since the last read
+        '''
+        replay, rate, last_read = self.readers[pin]
+        now = time.monotonic()
+        n_bytes = int((now - last_read) * rate)
+        if n_bytes > self.BUFFER:  # pigpio's buffer overflowed
+            n_bytes = self.BUFFER
+            self.readers[pin][2] = now
+        else:  # bytes still arriving are left for the next read
+            self.readers[pin][2] = last_read + n_bytes / rate
+
+        data = bytearray(replay.take(n_bytes))
+        return len(data), data
+
+    def bb_serial_read_close(self, pin: int) -> int:
+        self.readers.pop(pin, None)
+        return 0
+
+    def stop(self) -> None:
+        self.connected = False
+
+
+class CPUTemperature:
+    '''
+    gpiozero.CPUTemperature
+    '''
+
+    def __init__(self, sim: Simulation) -> None:
+        with sim.lock:
+            self.temperature = 48.0 + sim.rng.gauss(0, 2)
+
+
+##########
+
+# I2C bus and devices
+
+
+class I2CBus:
+    '''
+    busio.I2C on the simulated bus. Transfers take their time at the bus
+    frequency, 9 bits per byte plus the address
+    '''
+
+    FAULTS = ('nack', 'stretch')
+
+    def __init__(self, sim: Simulation, scl: int = None, sda: int = None,
+                 frequency: int = I2C_FREQUENCY) -> None:
+        self.sim = sim
+        self.frequency = frequency
+        self.lock = threading.Lock()
+
+    def try_lock(self) -> bool:
+        return self.lock.acquire(blocking=False)
+
+    def unlock(self) -> None:
+        self.lock.release()
+
+    def scan(self) -> list:
+        return sorted(self.sim.i2c_devices)
+
+    def _device(self, address: int, n_bytes: int):
+        '''
+        Starts a transfer
+        @param address address of the device
+        @param n_bytes bytes transferred
+        @return the device
+        @raise OSError if no device answers
+        '''
+        time.sleep((n_bytes + 1) * 9 / self.frequency)
+
+        device = self.sim.i2c_devices.get(address, None)
+        if device is None:
+            raise OSError(121, 'Remote I/O error')
+
+        fault = self.sim.fault(device.NAME, self.FAULTS)
+        if fault == 'nack':
+            raise OSError(121, 'Remote I/O error')
+        if fault == 'stretch':  # the device holds the clock low
+            time.sleep(self.sim.scaled(HANG_TIME))
+
+        return device
+
+    def writeto(self, address: int, buffer, *, start: int = 0,
+                end: int = None) -> None:
+        data = bytes(buffer[start:end])
+        device = self._device(address, len(data))
+        if data:  # empty writes only probe the device
+            device.write(data)
+
+    def readfrom_into(self, address: int, buffer, *, start: int = 0,
+                      end: int = None) -> None:
+        end = len(buffer) if end is None else end
+        buffer[start:end] = \
+            self._device(address, end - start).read(end - start)
+
+    def writeto_then_readfrom(self, address: int, buffer_out, buffer_in, *,
+                              out_start: int = 0, out_end: int = None,
+                              in_start: int = 0, in_end: int = None) -> None:
+        self.writeto(address, buffer_out, start=out_start, end=out_end)
+        self.readfrom_into(address, buffer_in, start=in_start, end=in_end)
+
+
+class BME280Device:
+    '''
+    BME280 registers. Measurements are 20 bits for the pressure (Pa * 8) and
+    the temperature ((C + 40) * 4096), 16 bits for the humidity (% * 512)
+    '''
+
+    NAME = 'bme280'
+    ADDRESS = BME280_ADDRESS
+    CHIP_ID = 0x60
+    # oversampling of each overscan setting
+    OVERSAMPLING = {0: 0, 1: 1, 2: 2, 3: 4, 4: 8, 5: 16}
+
+    def __init__(self, sim: Simulation) -> None:
+        self.sim = sim
+        self.registers = bytearray(256)
+        self.registers[0xD0] = self.CHIP_ID
+        self.pointer = 0
+        self.ready_at = None  # end of the forced conversion running
+
+    def conversion_time(self) -> float:
+        '''
+        @return seconds a measurement takes with the current oversampling,
+            the datasheet's maximum
+        '''
+        ctrl_meas = self.registers[0xF4]
+        osrs_t = self.OVERSAMPLING.get(ctrl_meas >> 5, 16)
+        osrs_p = self.OVERSAMPLING.get((ctrl_meas >> 2) & 0x07, 16)
+        osrs_h = self.OVERSAMPLING.get(self.registers[0xF2] & 0x07, 16)
+
+        return (1.25 + 2.3 * osrs_t + (2.3 * osrs_p + 0.575) * (osrs_p > 0) +
+                (2.3 * osrs_h + 0.575) * (osrs_h > 0)) / 1000
+
+    def write(self, data: bytes) -> None:
+        self.pointer = data[0]
+        # register, value pairs
+        for register, value in zip(data[::2], data[1::2]):
+            self.registers[register] = value
+            if register == 0xE0 and value == 0xB6:  # soft reset
+                self.registers[0xF2] = self.registers[0xF4] = 0
+            if register == 0xF4 and value & 0x03 == 0x01:  # forced mode
+                self.ready_at = time.monotonic() + self.conversion_time()
+
+    def read(self, n_bytes: int) -> bytes:
+        self._update()
+        data = bytes(self.registers[self.pointer:self.pointer + n_bytes])
+        self.pointer += n_bytes
+        return data
+
+    def _update(self) -> None:
+        '''
+        Ends the forced conversion if its time has come, or measures
+        continuously in normal mode
+        '''
+        now = time.monotonic()
+        normal = self.registers[0xF4] & 0x03 == 0x03
+        if self.ready_at is not None and now >= self.ready_at:
+            self.ready_at = None
+            self.registers[0xF4] &= 0xFC  # back to sleep
+            self._latch()
+        elif normal:
+            self._latch()
+
+        # status: measuring
+        self.registers[0xF3] = 0x08 if self.ready_at is not None else 0x00
+
+    def _latch(self) -> None:
+        '''
+        Writes the current weather to the data registers
+        '''
+        weather = self.sim.ambient()
+        pressure = round(weather['pressure'] * 100 * 8)
+        temperature = round((weather['temperature'] + 40) * 4096)
+        humidity = round(weather['humidity'] * 512)
+
+        data = bytearray()
+        for value in (pressure, temperature):
+            data += bytes(((value >> 12) & 0xFF, (value >> 4) & 0xFF,
+                           (value & 0x0F) << 4))
+        data += struct.pack('>H', humidity)
+        self.registers[0xF7:0xFF] = data
+
+
+class MS8607PTDevice:
+    '''
+    Pressure and temperature part of the MS8607. Conversions are 24 bits
+    for the pressure (hPa * 10000) and the temperature ((C + 40) * 100000)
+    '''
+
+    NAME = 'ms8607'
+    ADDRESS = MS8607_PT_ADDRESS
+    # conversion time of each oversampling, in seconds
+    CONVERSION_TIME = (0.00056, 0.0011, 0.00217, 0.00413, 0.00822, 0.01644)
+
+    def __init__(self, sim: Simulation) -> None:
+        self.sim = sim
+        self.command = None
+        self.conversion = None  # (quantity, ready at)
+        self.result = 0
+        self.prom = [0x4000 + n for n in range(7)]
+
+    def write(self, data: bytes) -> None:
+        command = data[0]
+        self.command = command
+        if 0x40 <= command <= 0x5A:
+            quantity = 'pressure' if command < 0x50 else 'temperature'
+            osr = (command & 0x0F) // 2
+            self.conversion = (quantity, time.monotonic() +
+                               self.CONVERSION_TIME[osr])
+            self.result = 0
+        elif command == 0x1E:  # reset
+            self.conversion = None
+
+    def read(self, n_bytes: int) -> bytes:
+        if self.command is not None and 0xA0 <= self.command <= 0xAE:
+            word = self.prom[(self.command - 0xA0) // 2]
+            return struct.pack('>H', word)[:n_bytes]
+
+        # reading the ADC before the end of the conversion gives 0
+        if self.conversion is not None:
+            quantity, ready_at = self.conversion
+            self.conversion = None
+            if time.monotonic() >= ready_at:
+                weather = self.sim.ambient()
+                self.result = round(weather['pressure'] * 10000) \
+                    if quantity == 'pressure' \
+                    else round((weather['temperature'] + 40) * 100000)
+        result, self.result = self.result, 0
+
+        return result.to_bytes(3, 'big')[:n_bytes]
+
+
+class MS8607RHDevice:
+    '''
+    Humidity part of the MS8607, answers with 16 bits and a crc
+    '''
+
+    NAME = 'ms8607'
+    ADDRESS = MS8607_RH_ADDRESS
+    CONVERSION_TIME = 0.016  # 12 bits resolution
+
+    def __init__(self, sim: Simulation) -> None:
+        self.sim = sim
+        self.ready_at = None
+
+    def write(self, data: bytes) -> None:
+        if data[0] == 0xF5:  # measure, no hold master
+            self.ready_at = time.monotonic() + self.CONVERSION_TIME
+        elif data[0] == 0xFE:  # reset
+            self.ready_at = None
+
+    def read(self, n_bytes: int) -> bytes:
+        # the sensor doesn't acknowledge reads while converting
+        if self.ready_at is None or time.monotonic() < self.ready_at:
+            raise OSError(121, 'Remote I/O error')
+        self.ready_at = None
+
+        humidity = self.sim.ambient()['humidity']
+        raw = round((humidity + 6) * 65536 / 125) & 0xFFFC
+        data = struct.pack('>H', raw)
+        return (data + bytes((crc8(data, 0x00),)))[:n_bytes]
+
+
+class SCD30Device:
+    '''
+    SCD30 CO2 sensor, 16 bit commands and words followed by their crc
+    Measures every measurement interval once started
+    '''
+
+    NAME = 'scd30'
+    ADDRESS = SCD30_ADDRESS
+
+    def __init__(self, sim: Simulation) -> None:
+        self.sim = sim
+        self.interval = 2
+        self.started_at = None  # monotonic time measurements started
+        self.last_read = 0  # number of the last measurement read
+        self.reply = b''
+
+    def _measurements(self) -> int:
+        '''
+        @return number of measurements taken since started
+        '''
+        if self.started_at is None:
+            return 0
+        return int((time.monotonic() - self.started_at) // self.interval)
+
+    def write(self, data: bytes) -> None:
+        command = int.from_bytes(data[:2], 'big')
+        argument = None
+        if len(data) >= 5:
+            if crc8(data[2:4], 0xFF) != data[4]:
+                raise OSError(121, 'Remote I/O error')
+            argument = int.from_bytes(data[2:4], 'big')
+
+        if command == 0x0010:  # start continuous measurement
+            self.started_at = time.monotonic()
+            self.last_read = 0
+        elif command == 0x0104:  # stop
+            self.started_at = None
+        elif command == 0x4600:  # measurement interval
+            if argument is not None:
+                self.interval = argument
+                if self.started_at is not None:
+                    self.started_at = time.monotonic()
+                    self.last_read = 0
+            self.reply = words(self.interval)
+        elif command == 0x0202:  # data ready
+            self.reply = words(int(self._measurements() > self.last_read))
+        elif command == 0x0300:  # read measurement
+            self.last_read = self._measurements()
+            weather = self.sim.ambient()
+            with self.sim.lock:
+                co2 = weather['co2'] + self.sim.rng.gauss(0, 5)
+            values = struct.pack('>fff', co2, weather['temperature'],
+                                 weather['humidity'])
+            self.reply = words(*struct.unpack('>6H', values))
+        elif command == 0xD304:  # soft reset
+            self.started_at = None
+        elif command == 0xD100:  # firmware version
+            self.reply = words(0x0342)
+
+    def read(self, n_bytes: int) -> bytes:
+        reply, self.reply = self.reply, b''
+        return reply[:n_bytes].ljust(n_bytes, b'\xff')
+
+
+def words(*values: int) -> bytes:
+    '''
+    @param values 16 bit words
+    @return the words, each followed by its Sensirion crc
+    '''
+    data = b''
+    for value in values:
+        word = struct.pack('>H', value)
+        data += word + bytes((crc8(word, 0xFF),))
+    return data
+
+
+##########
+
+# drivers standing in for the adafruit ones
+
+
+class I2CDevice:
+    '''
+    adafruit_bus_device.i2c_device.I2CDevice, a device on a bus, locking the
+    bus for each transaction
+    '''
+
+    def __init__(self, i2c, address: int) -> None:
+        self.i2c = i2c
+        self.address = address
+        # make sure the device is there
+        with self:
+            try:
+                self.i2c.writeto(address, b'')
+            except OSError:
+                raise ValueError(f'No I2C device at address: 0x{address:x}')
+
+    def __enter__(self):
+        while not self.i2c.try_lock():
+            time.sleep(0)
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.i2c.unlock()
+
+    def write(self, data: bytes) -> None:
+        with self:
+            self.i2c.writeto(self.address, data)
+
+    def read(self, n_bytes: int) -> bytes:
+        buffer = bytearray(n_bytes)
+        with self:
+            self.i2c.readfrom_into(self.address, buffer)
+        return bytes(buffer)
+
+    def write_then_read(self, data: bytes, n_bytes: int) -> bytes:
+        buffer = bytearray(n_bytes)
+        with self:
+            self.i2c.writeto_then_readfrom(self.address, data, buffer)
+        return bytes(buffer)
+
+
+class BME280Driver:
+    '''
+    adafruit_bme280.advanced.Adafruit_BME280_I2C
+    In forced mode every property starts a conversion and waits for it
+    '''
+
+    def __init__(self, i2c, address: int = BME280_ADDRESS) -> None:
+        self.device = I2CDevice(i2c, address)
+        chip_id = self.device.write_then_read(b'\xD0', 1)[0]
+        if chip_id != BME280Device.CHIP_ID:
+            raise RuntimeError(f'Failed to find BME280! Chip ID 0x{chip_id:x}')
+        self.device.write(b'\xE0\xB6')  # soft reset
+        time.sleep(0.004)
+
+        self._mode = 0x00
+        self._overscan = {'humidity': 0x01, 'temperature': 0x01,
+                          'pressure': 0x01}
+
+    def _ctrl_meas(self) -> int:
+        return (self._overscan['temperature'] << 5) | \
+            (self._overscan['pressure'] << 2) | self._mode
+
+    def _write_config(self) -> None:
+        # humidity settings only apply after a write to ctrl_meas
+        self.device.write(bytes((0xF2, self._overscan['humidity'],
+                                 0xF4, self._ctrl_meas())))
+
+    @property
+    def mode(self) -> int:
+        return self._mode
+
+    @mode.setter
+    def mode(self, value: int) -> None:
+        self._mode = value
+        self._write_config()
+
+    @property
+    def overscan_humidity(self) -> int:
+        return self._overscan['humidity']
+
+    @overscan_humidity.setter
+    def overscan_humidity(self, value: int) -> None:
+        self._overscan['humidity'] = value
+        self._write_config()
+
+    @property
+    def overscan_temperature(self) -> int:
+        return self._overscan['temperature']
+
+    @overscan_temperature.setter
+    def overscan_temperature(self, value: int) -> None:
+        self._overscan['temperature'] = value
+        self._write_config()
+
+    @property
+    def overscan_pressure(self) -> int:
+        return self._overscan['pressure']
+
+    @overscan_pressure.setter
+    def overscan_pressure(self, value: int) -> None:
+        self._overscan['pressure'] = value
+        self._write_config()
+
+    def _read(self) -> tuple:
+        '''
+        @return raw (pressure, temperature, humidity), converted first in
+            forced mode
+        '''
+        if self._mode == 0x01:
+            self.device.write(bytes((0xF4, self._ctrl_meas())))
+            while self.device.write_then_read(b'\xF3', 1)[0] & 0x08:
+                time.sleep(0.002)
+
+        data = self.device.write_then_read(b'\xF7', 8)
+        pressure = (data[0] << 12) | (data[1] << 4) | (data[2] >> 4)
+        temperature = (data[3] << 12) | (data[4] << 4) | (data[5] >> 4)
+        humidity = (data[6] << 8) | data[7]
+        return pressure, temperature, humidity
+
+    @property
+    def temperature(self) -> float:
+        return self._read()[1] / 4096 - 40
+
+    @property
+    def humidity(self) -> float:
+        return self._read()[2] / 512
+
+    @property
+    def pressure(self) -> float:
+        return self._read()[0] / 8 / 100  # hPa
+
+
+class MS8607Driver:
+    '''
+    adafruit_ms8607.MS8607
+    '''
+
+    def __init__(self, i2c) -> None:
+        self.pt = I2CDevice(i2c, MS8607_PT_ADDRESS)
+        self.rh = I2CDevice(i2c, MS8607_RH_ADDRESS)
+
+        self.pt.write(b'\x1E')
+        self.rh.write(b'\xFE')
+        time.sleep(0.015)
+        # calibration coefficients
+        self.prom = [int.from_bytes(self.pt.write_then_read(
+            bytes((0xA0 + 2 * n,)), 2), 'big') for n in range(7)]
+
+    def _convert(self, command: int) -> int:
+        '''
+        @param command conversion command, oversampling 4096
+        @return the 24 bit result
+        '''
+        self.pt.write(bytes((command,)))
+        time.sleep(MS8607PTDevice.CONVERSION_TIME[4] + 0.001)
+        return int.from_bytes(self.pt.write_then_read(b'\x00', 3), 'big')
+
+    @property
+    def pressure_and_temperature(self) -> tuple:
+        pressure = self._convert(0x48) / 10000
+        temperature = self._convert(0x58) / 100000 - 40
+        return pressure, temperature
+
+    @property
+    def pressure(self) -> float:
+        return self.pressure_and_temperature[0]  # hPa
+
+    @property
+    def temperature(self) -> float:
+        return self.pressure_and_temperature[1]
+
+    @property
+    def relative_humidity(self) -> float:
+        self.rh.write(b'\xF5')
+        time.sleep(MS8607RHDevice.CONVERSION_TIME + 0.001)
+        data = self.rh.read(3)
+        if crc8(data[:2], 0x00) != data[2]:
+            raise RuntimeError('CRC mismatch')
+        raw = int.from_bytes(data[:2], 'big') & 0xFFFC
+        return -6 + 125 * raw / 65536
+
+
+class SCD30Driver:
+    '''
+    adafruit_scd30.SCD30
+    '''
+
+    def __init__(self, i2c, ambient_pressure: int = 0,
+                 address: int = SCD30_ADDRESS) -> None:
+        self.device = I2CDevice(i2c, address)
+        self._send(0xD304)  # soft reset
+        time.sleep(0.03)
+        self.measurement_interval = 2
+        self._send(0x0010, ambient_pressure)
+        self._co2 = None
+
+    def _send(self, command: int, argument: int = None) -> None:
+        data = struct.pack('>H', command)
+        if argument is not None:
+            data += words(argument)
+        self.device.write(data)
+
+    def _read_words(self, command: int, n_words: int) -> list:
+        '''
+        @return the words answering a command, their crc checked
+        '''
+        self._send(command)
+        time.sleep(0.003)  # the sensor needs 3 ms before a read
+        data = self.device.read(3 * n_words)
+        values = []
+        for n in range(n_words):
+            word = data[3 * n:3 * n + 2]
+            if crc8(word, 0xFF) != data[3 * n + 2]:
+                raise RuntimeError('CRC check failed while reading data')
+            values.append(int.from_bytes(word, 'big'))
+        return values
+
+    @property
+    def measurement_interval(self) -> int:
+        return self._read_words(0x4600, 1)[0]
+
+    @measurement_interval.setter
+    def measurement_interval(self, value: int) -> None:
+        if value < 2 or value > 1800:
+            raise AttributeError('measurement_interval must be from 2-1800' +
+                                 ' seconds')
+        self._send(0x4600, int(value))
+
+    @property
+    def data_available(self) -> bool:
+        return self._read_words(0x0202, 1)[0] == 1
+
+    @property
+    def CO2(self) -> float:
+        if self.data_available:
+            values = self._read_words(0x0300, 6)
+            self._co2 = struct.unpack('>f', struct.pack('>HH',
+                                                        *values[:2]))[0]
+        return self._co2
@@ -0,0 +1,282 @@
+'''
+
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+##########
+
+import math
+from array import array
+
+##########
+
+'''
+Streaming statistics of sensor samples
+Samples are never stored: each metric keeps its count, mean and variance
+(Welford's algorithm), min and max, and a few quantiles estimated with the
+P-square algorithm (Jain & Chlamtac, 1985), 5 markers per quantile. The
+state of a metric lives in fixed-size arrays allocated once, so summarizing
+a window costs the same whatever the sampling rate
+'''
+
+##########
+
+# constants declarations
+
+QUANTILES = (0.1, 0.5, 0.9)
+MARKERS = 5  # markers of the P-square algorithm
+# offsets of the marker arrays in a quantile's block
+HEIGHTS = 0
+POSITIONS = MARKERS
+DESIRED = 2 * MARKERS
+INCREMENTS = 3 * MARKERS
+BLOCK = 4 * MARKERS
+
+##########
+
+
+class StreamingStats:
+    '''
+    Count, mean, standard deviation, min, max and quantiles of a stream of
+    samples of a single metric
+    '''
+
+    def __init__(self, quantiles: tuple = QUANTILES) -> None:
+        '''
+        @param quantiles quantiles to estimate, between 0 and 1
+        '''
+        self.quantiles = tuple(quantiles)
+        # count, mean, sum of squared differences from the mean, min, max
+        self.moments = array('d', [0.0] * 5)
+        # one block of heights, positions, desired positions and increments
+        # per quantile
+        self.markers = array('d', [0.0] * BLOCK * len(self.quantiles))
+        self.reset()
+
+    def reset(self) -> None:
+        '''
+        Forgets all samples, starting a new window
+        '''
+        self.moments[0] = 0.0
+        self.moments[1] = 0.0
+        self.moments[2] = 0.0
+        self.moments[3] = math.inf
+        self.moments[4] = -math.inf
+
+        for j, p in enumerate(self.quantiles):
+            base = j * BLOCK
+            for i, (desired, increment) in enumerate(
+                    ((0, 0), (2 * p, p / 2), (4 * p, p),
+                     (2 + 2 * p, (1 + p) / 2), (4, 1))):
+                self.markers[base + POSITIONS + i] = i
+                self.markers[base + DESIRED + i] = desired
+                self.markers[base + INCREMENTS + i] = increment
+
+    @property
+    def count(self) -> int:
+        return int(self.moments[0])
+
+    def update(self, x: float) -> None:
+        '''
+        Adds a sample
+        @param x value of the sample
+        '''
+        m = self.moments
+        m[0] += 1
+        delta = x - m[1]
+        m[1] += delta / m[0]
+        m[2] += delta * (x - m[1])
+        if x < m[3]:
+            m[3] = x
+        if x > m[4]:
+            m[4] = x
+
+        n = int(m[0])
+        for j in range(len(self.quantiles)):
+            base = j * BLOCK
+            if n <= MARKERS:
+                self._insert(base, n, x)
+            else:
+                self._update_markers(base, x)
+
+    def _insert(self, base: int, n: int, x: float) -> None:
+        '''
+        Keeps the first samples sorted in the marker heights, they are the
+        initial markers
+        '''
+        q = self.markers
+        i = base + HEIGHTS + n - 1
+        while i > base + HEIGHTS and q[i - 1] > x:
+            q[i] = q[i - 1]
+            i -= 1
+        q[i] = x
+
+    def _update_markers(self, base: int, x: float) -> None:
+        '''
+        P-square update of a quantile's markers
+        '''
+        q = self.markers
+        h = base + HEIGHTS
+        pos = base + POSITIONS
+        des = base + DESIRED
+        inc = base + INCREMENTS
+
+        # find the cell x falls in, extending the extremes if needed
+        if x < q[h]:
+            q[h] = x
+            k = 0
+        elif x >= q[h + 4]:
+            q[h + 4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[h + k + 1]:
+                k += 1
+
+        for i in range(k + 1, MARKERS):
+            q[pos + i] += 1
+        for i in range(MARKERS):
+            q[des + i] += q[inc + i]
+
+        # move the middle markers towards their desired positions
+        for i in range(1, MARKERS - 1):
+            d = q[des + i] - q[pos + i]
+            if (d >= 1 and q[pos + i + 1] - q[pos + i] > 1) or \
+                    (d <= -1 and q[pos + i - 1] - q[pos + i] < -1):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(h, pos, i, d)
+                if not q[h + i - 1] < height < q[h + i + 1]:
+                    height = q[h + i] + d * (q[h + i + d] - q[h + i]) / \
+                        (q[pos + i + d] - q[pos + i])
+                q[h + i] = height
+                q[pos + i] += d
+
+    def _parabolic(self, h: int, pos: int, i: int, d: int) -> float:
+        '''
+        Piecewise-parabolic prediction of a marker's height
+        '''
+        q = self.markers
+        return q[h + i] + d / (q[pos + i + 1] - q[pos + i - 1]) * (
+            (q[pos + i] - q[pos + i - 1] + d) * (q[h + i + 1] - q[h + i]) /
+            (q[pos + i + 1] - q[pos + i]) +
+            (q[pos + i + 1] - q[pos + i] - d) * (q[h + i] - q[h + i - 1]) /
+            (q[pos + i] - q[pos + i - 1]))
+
+    def quantile(self, j: int) -> float:
+        '''
+        @param j index of the quantile in self.quantiles
+        @return estimate of the quantile, None without samples
+        '''
+        n = self.count
+        if n == 0:
+            return None
+
+        base = j * BLOCK + HEIGHTS
+        if n > MARKERS:
+            return self.markers[base + 2]
+
+        # few samples, they are all kept sorted: interpolate between them
+        rank = self.quantiles[j] * (n - 1)
+        low = int(rank)
+        high = min(low + 1, n - 1)
+        return self.markers[base + low] + (rank - low) * \
+            (self.markers[base + high] - self.markers[base + low])
+
+    def summary(self) -> dict:
+        '''
+        @return dictionary with mean, std (sample standard deviation), min,
+            max and one p<percent> key per quantile (i.e p50), None if there
+            are no samples
+        '''
+        n = self.count
+        if n == 0:
+            return None
+
+        summary = {
+            'mean': self.moments[1],
+            'std': math.sqrt(self.moments[2] / (n - 1)) if n > 1 else 0.0,
+            'min': self.moments[3],
+            'max': self.moments[4],
+        }
+        for j, p in enumerate(self.quantiles):
+            summary[f'p{round(p * 100)}'] = self.quantile(j)
+
+        return summary
+
+
+class StatsWindow:
+    '''
+    Streaming statistics of several metrics sampled together, i.e the
+    temperature, humidity and pressure of an air sensor
+    '''
+
+    def __init__(self, metrics: tuple, quantiles: tuple = QUANTILES) -> None:
+        '''
+        @param metrics names of the metrics
+        @param quantiles quantiles to estimate for every metric
+        '''
+        self.stats = {metric: StreamingStats(quantiles) for metric in metrics}
+        self.samples = 0
+
+    def update(self, values: dict) -> None:
+        '''
+        Adds a sample of every metric, missing and None values are skipped
+        @param values {metric: value}
+        '''
+        self.samples += 1
+        for metric, stats in self.stats.items():
+            value = values.get(metric, None)
+            if value is not None:
+                stats.update(value)
+
+    def reset(self) -> None:
+        '''
+        Starts a new window
+        '''
+        self.samples = 0
+        for stats in self.stats.values():
+            stats.reset()
+
+    def summary(self) -> dict:
+        '''
+        Flat summary of the window, ready to be saved with a sensor's
+        measurements. The mean is reported under the metric's name, the other
+        statistics as <metric>_<statistic> (i.e temperature_p90)
+        @return dictionary of statistics, plus 'samples', the number of
+            samples in the window. None if there are no samples
+        '''
+        if self.samples == 0:
+            return None
+
+        summary = {}
+        for metric, stats in self.stats.items():
+            metric_summary = stats.summary()
+            if metric_summary is None:
+                metric_summary = {key: None for key in
+                                  ('mean', 'std', 'min', 'max',
+                                   *(f'p{round(p * 100)}'
+                                     for p in stats.quantiles))}
+
+            summary[metric] = metric_summary.pop('mean')
+            for key, value in metric_summary.items():
+                summary[f'{metric}_{key}'] = value
+
+        summary['samples'] = self.samples
+
+        return summary
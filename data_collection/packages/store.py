@@ -0,0 +1,202 @@
+'''
+
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+##########
+
+import os
+import time
+import sqlite3
+import threading
+from packages.modules import HOME
+
+##########
+
+'''
+On-station sample store
+Every file the station produces (data samples and diagnostics) is kept as a
+row of a single SQLite database in WAL mode, marked as sent once the server
+accepts it. This replaces the data_logs/ and sent_files/ folders: saving,
+uploading and pruning a sample are each a single indexed statement instead
+of a file, a fork to move it and a handful of directory operations
+'''
+
+##########
+
+# constants declarations
+
+STORE_PATH = os.path.join(HOME, 'samples.db')
+RETENTION_DAYS = 90  # sent samples older than this are deleted
+TIMEOUT = 30  # seconds to wait for another process holding the database
+
+##########
+
+
+class SampleStore:
+    '''
+    Append-only store of the files waiting to be sent and of those already
+    sent. Files are identified by their name and kept in insertion order
+    Several processes (data collection, diagnostics, sender) may open the
+    same store at once
+    '''
+
+    def __init__(self,
+                 path: str = STORE_PATH,
+                 retention_days: float = RETENTION_DAYS) -> None:
+        '''
+        Opens the store, creating it if needed
+        @param path location of the database file
+        @param retention_days how long sent samples are kept
+        '''
+        self.path = path
+        self.retention = retention_days * 86400
+        self.lock = threading.Lock()
+
+        self.db = sqlite3.connect(path, timeout=TIMEOUT,
+                                  check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        # WAL stays consistent with NORMAL, only the last commits may be lost
+        # on power loss
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        with self.db:
+            create_samples(self.db)
+
+    def add(self, name: str, payload: bytes) -> None:
+        '''
+        Adds a file waiting to be sent
+        Adding a name that is already stored replaces its payload and marks
+        it as unsent again
+        @param name file name, as the server will receive it
+        @param payload contents of the file
+        '''
+        with self.lock, self.db:
+            add_sample(self.db, name, payload)
+
+    def pending(self, after: int = 0, limit: int = -1) -> list:
+        '''
+        Cursor over the files waiting to be sent, oldest first
+        @param after only return files stored after the one with this id,
+            pass the last id of the previous page to read the next one
+        @param limit maximum number of files to return, -1 for all
+        @return list of (id, name, size) tuples
+        '''
+        with self.lock:
+            return self.db.execute('''SELECT id, name, length(payload)
+                                      FROM samples
+                                      WHERE sent IS NULL AND id > ?
+                                      ORDER BY id LIMIT ?''',
+                                   (after, limit)).fetchall()
+
+    def read(self, name: str) -> bytes:
+        '''
+        Reads the contents of a stored file
+        @param name file name
+        @return contents of the file, None if it isn't stored
+        '''
+        with self.lock:
+            row = self.db.execute('SELECT payload FROM samples WHERE name = ?',
+                                  (name,)).fetchone()
+
+        return None if row is None else row[0]
+
+    def mark_sent(self, names: list) -> None:
+        '''
+        Marks files as accepted by the server
+        @param names file names
+        '''
+        now = time.time()
+        with self.lock, self.db:
+            self.db.executemany('UPDATE samples SET sent = ? WHERE name = ?',
+                                [(now, name) for name in names])
+
+    def prune(self) -> int:
+        '''
+        Applies the retention policy, deleting sent files older than the
+        retention period. Unsent files are never deleted
+        @return number of files deleted
+        '''
+        with self.lock, self.db:
+            return self.db.execute('''DELETE FROM samples
+                                      WHERE sent IS NOT NULL AND sent < ?''',
+                                   (time.time() - self.retention,)).rowcount
+
+    def import_folder(self, folder: str) -> int:
+        '''
+        Moves files left in a folder (i.e the old data_logs/) into the store
+        as unsent files, deleting them from the folder
+        @param folder path of folder to import
+        @return number of files imported
+        '''
+        if not os.path.isdir(folder):
+            return 0
+
+        imported = 0
+        for f_name in sorted(os.listdir(folder)):
+            path = os.path.join(folder, f_name)
+            if not os.path.isfile(path):
+                continue
+
+            with open(path, 'rb') as in_f:
+                self.add(f_name, in_f.read())
+            os.remove(path)
+            imported += 1
+
+        return imported
+
+    def close(self) -> None:
+        '''
+        Closes the database
+        '''
+        self.db.close()
+
+
+def create_samples(db: sqlite3.Connection) -> None:
+    '''
+    Creates the samples table and its indexes if needed, called within a
+    transaction
+    @param db connection to the station's database
+    '''
+    db.execute('''CREATE TABLE IF NOT EXISTS samples (
+                      id INTEGER PRIMARY KEY,
+                      name TEXT UNIQUE NOT NULL,
+                      payload BLOB NOT NULL,
+                      created REAL NOT NULL,
+                      sent REAL)''')
+    # unsent rows have sent = NULL, sent rows the time they were sent
+    db.execute('''CREATE INDEX IF NOT EXISTS pending
+                  ON samples (id) WHERE sent IS NULL''')
+    db.execute('''CREATE INDEX IF NOT EXISTS sent_time
+                  ON samples (sent) WHERE sent IS NOT NULL''')
+
+
+def add_sample(db: sqlite3.Connection, name: str, payload: bytes) -> None:
+    '''
+    Adds a file waiting to be sent, called within a transaction, i.e by
+    other stores of the same database adding a file along with their own
+    changes (see SampleStore.add)
+    @param db connection to the station's database
+    @param name file name, as the server will receive it
+    @param payload contents of the file
+    '''
+    db.execute('''INSERT INTO samples (name, payload, created)
+                  VALUES (?, ?, ?)
+                  ON CONFLICT (name) DO UPDATE
+                  SET payload = excluded.payload, sent = NULL''',
+               (name, payload, time.time()))
@@ -0,0 +1,317 @@
+'''
+
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+##########
+
+import os
+import json
+import time
+import atexit
+import datetime
+import threading
+
+##########
+
+'''
+Write-behind buffer for the small files the station keeps writing to the SD
+card (i.e the logs)
+Writes are kept in RAM and flushed in batches every FLUSH_INTERVAL seconds,
+or as soon as FLUSH_BYTES are waiting, and when the process exits. A batch
+costs one open, write and fsync per file instead of one per message.
+Appends go at the end of their file. Files replaced as a whole are written
+to a temporary file and renamed over the old one, so a crash leaves either
+the old or the new contents, never half of them
+Writes that fail (i.e card full or read-only) are kept and retried on the
+next flush, up to MAX_PENDING bytes per file: past that the oldest lines are
+dropped, so a card that stays unwritable doesn't fill the RAM
+Bytes and write operations reaching the card are counted per day, along with
+the bytes the whole process wrote to storage (i.e SQLite) and the bytes
+dropped, and saved now and then to a json file
+Usage:
+    writer = WriteBehind(stats_path='/home/pi/io_stats.json')
+    writer.append('/home/pi/logs/2022_1_logs.txt', 'message\\n')
+'''
+
+##########
+
+# constants declarations
+
+FLUSH_INTERVAL = 60  # seconds writes may wait in RAM
+FLUSH_BYTES = 64 * 1024  # bytes waiting that trigger a flush
+MAX_PENDING = 1024 * 1024  # bytes of failed appends kept per file
+STATS_INTERVAL = 3600  # seconds between two saves of the daily statistics
+STATS_DAYS = 30  # days of statistics kept
+
+##########
+
+
+class WriteBehind:
+    '''
+    Buffers appends and whole-file writes in RAM, flushing them in batches
+    '''
+
+    def __init__(self,
+                 interval: float = FLUSH_INTERVAL,
+                 max_bytes: int = FLUSH_BYTES,
+                 stats_path: str = None,
+                 max_pending: int = MAX_PENDING) -> None:
+        '''
+        @param interval seconds between two flushes
+        @param max_bytes bytes waiting that trigger a flush
+        @param stats_path json file the daily statistics are saved to, None
+            to only keep them in memory
+        @param max_pending bytes of failed appends kept per file, the oldest
+            are dropped past that
+        '''
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.max_pending = max_pending
+        self.stats_path = stats_path
+
+        self.lock = threading.Lock()  # protects the buffers
+        self.flush_lock = threading.Lock()  # one flush at a time
+        self.wakeup = threading.Event()
+        self.appends = {}  # path: list of strings to append
+        self.replaces = {}  # path: latest contents
+        self.buffered = 0  # bytes waiting
+
+        # {date: {'bytes', 'ops', 'flushes', 'disk_bytes', 'dropped'}},
+        # disk_bytes counts everything the process wrote to storage and
+        # dropped the bytes of failed appends given up on
+        self.stats = self._load_stats()
+        self.disk_bytes = process_write_bytes()
+        self.stats_saved = time.monotonic()
+
+        self.thread = threading.Thread(target=self._run, name='write_behind',
+                                       daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def append(self, path: str, text: str) -> None:
+        '''
+        Appends text to a file, eventually
+        @param path file to append to, created if needed
+        @param text text to append
+        '''
+        with self.lock:
+            self.appends.setdefault(path, []).append(text)
+            self.buffered += len(text)
+            full = self.buffered >= self.max_bytes
+        if full:
+            self.wakeup.set()
+
+    def replace(self, path: str, data: str) -> None:
+        '''
+        Replaces the contents of a file, eventually. Only the last contents
+        given before a flush are written
+        @param path file to replace
+        @param data new contents
+        '''
+        with self.lock:
+            previous = self.replaces.get(path, '')
+            self.replaces[path] = data
+            self.buffered += len(data) - len(previous)
+            full = self.buffered >= self.max_bytes
+        if full:
+            self.wakeup.set()
+
+    def flush(self) -> None:
+        '''
+        Writes everything waiting
+        '''
+        with self.flush_lock:
+            with self.lock:
+                appends, self.appends = self.appends, {}
+                replaces, self.replaces = self.replaces, {}
+                self.buffered = 0
+
+            n_bytes = 0
+            ops = 0
+            dropped = 0
+            failed = None
+            for path, chunks in appends.items():
+                data = ''.join(chunks).encode()
+                try:
+                    with open(path, 'ab') as out_f:
+                        out_f.write(data)
+                        out_f.flush()
+                        os.fsync(out_f.fileno())
+                except OSError as e:  # i.e card full, retried next flush
+                    dropped += self._requeue(self.appends, path, chunks)
+                    failed = e
+                    continue
+                n_bytes += len(data)
+                ops += 1
+
+            for path, text in replaces.items():
+                data = text.encode()
+                try:
+                    write_atomic(path, data)
+                except OSError as e:
+                    self._requeue(self.replaces, path, text)
+                    failed = e
+                    continue
+                n_bytes += len(data)
+                ops += 1
+
+            self._account(n_bytes, ops, dropped)
+
+        if failed is not None:
+            raise failed
+
+    def _requeue(self, buffer: dict, path: str, data) -> int:
+        '''
+        Puts back writes that failed, ahead of those made since
+        Appends waiting for a file are cut down to max_pending bytes,
+        dropping the oldest lines
+        @return bytes dropped
+        '''
+        with self.lock:
+            if buffer is not self.appends:
+                if path not in buffer:  # newer contents win
+                    buffer[path] = data
+                    self.buffered += len(data)
+                return 0
+
+            chunks = data + buffer.get(path, [])
+            size = sum(len(chunk) for chunk in chunks)
+            kept = size
+            while kept > self.max_pending and len(chunks) > 1:
+                kept -= len(chunks.pop(0))
+            if kept > self.max_pending:
+                # keep the end of the last chunk, from the start of a line
+                tail = chunks[0][-self.max_pending:]
+                chunks[0] = tail[tail.find('\n') + 1:]
+                kept = len(chunks[0])
+
+            buffer[path] = chunks
+            self.buffered += kept - (size - sum(len(chunk) for chunk in data))
+            return size - kept
+
+    def _account(self, n_bytes: int, ops: int, dropped: int = 0) -> None:
+        '''
+        Adds a flush to today's statistics, saving them now and then
+        '''
+        today = datetime.date.today().isoformat()
+        day = self.stats.setdefault(today, {'bytes': 0, 'ops': 0,
+                                            'flushes': 0, 'disk_bytes': 0,
+                                            'dropped': 0})
+        day['bytes'] += n_bytes
+        day['ops'] += ops
+        day['flushes'] += 1 if ops > 0 else 0
+        # days saved before drops were counted don't have them
+        day['dropped'] = day.get('dropped', 0) + dropped
+
+        disk_bytes = process_write_bytes()
+        day['disk_bytes'] += max(0, disk_bytes - self.disk_bytes)
+        self.disk_bytes = disk_bytes
+
+        for old_day in sorted(self.stats)[:-STATS_DAYS]:
+            del self.stats[old_day]
+
+        if time.monotonic() - self.stats_saved >= STATS_INTERVAL:
+            self._save_stats()
+
+    def _save_stats(self) -> None:
+        if self.stats_path is not None:
+            write_atomic(self.stats_path, json.dumps(self.stats).encode())
+        self.stats_saved = time.monotonic()
+
+    def today(self) -> dict:
+        '''
+        @return today's statistics: bytes and write operations of the
+            flushes, number of flushes, bytes the process wrote to storage
+            and bytes of failed appends dropped
+        '''
+        with self.flush_lock:
+            return {'dropped': 0,
+                    **self.stats.get(datetime.date.today().isoformat(),
+                                     {'bytes': 0, 'ops': 0, 'flushes': 0,
+                                      'disk_bytes': 0})}
+
+    def close(self) -> None:
+        '''
+        Writes everything waiting and the statistics, called at exit
+        '''
+        try:
+            self.flush()
+        finally:
+            with self.flush_lock:
+                self._save_stats()
+
+    def _load_stats(self) -> dict:
+        '''
+        @return the statistics saved by a previous run, if any
+        '''
+        if self.stats_path is None or not os.path.isfile(self.stats_path):
+            return {}
+        try:
+            with open(self.stats_path, 'r') as in_f:
+                return json.load(in_f)
+        except (OSError, ValueError):
+            return {}
+
+    def _run(self) -> None:
+        '''
+        Body of the flushing thread
+        '''
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except OSError:  # writes were put back, retried next time
+                pass
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    '''
+    Replaces a file's contents with a temporary file renamed over it
+    @param path file to replace
+    @param data new contents
+    '''
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as out_f:
+        out_f.write(data)
+        out_f.flush()
+        os.fsync(out_f.fileno())
+    os.replace(tmp_path, path)
+
+    # make the rename itself durable
+    dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def process_write_bytes() -> int:
+    '''
+    @return bytes this process caused to be written to storage, 0 if unknown
+    '''
+    try:
+        with open('/proc/self/io', 'r') as in_f:
+            for line in in_f:
+                if line.startswith('write_bytes:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return 0
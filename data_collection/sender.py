@@ -18,9 +18,29 @@ You should have received a copy of the GNU General Public License along with
 '''
 
 import requests as rqs
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.connection import HTTPSConnection
+from urllib3.connectionpool import HTTPSConnectionPool
 import os
+import io
+import sys
+import gzip
+import json
+import time
+import socket
 import hashlib
+import tarfile
+import threading
 import packages.modules as modules
+from packages.store import SampleStore
+
+# zstd is optional, gzip is used when it is not installed
+# pip3 install zstandard
+try:
+    import zstandard as zstd
+except ModuleNotFoundError:
+    zstd = None
 
 try:
     import station_id as station
@@ -32,53 +52,182 @@ except ModuleNotFoundError:
 
 # constants declaration
 URL = 'https://10.224.83.51:3500/upload/'
-FOLDER = '/home/pi/data_logs/'
-DEST_FOLDER = '/home/pi/sent_files/'
+FOLDER = '/home/pi/data_logs/'  # files left here are moved into the store
 VERIFY = os.path.join(modules.HOME, 'cert.pem')
+RESCAN_INTERVAL = 600  # seconds the daemon waits before rescanning the store
+POOL_SIZE = 2  # keep-alive connections kept open to the receiver
+MAX_RETRIES = 3  # attempts to (re)connect before giving up on a request
+BACKOFF_FACTOR = 1  # retries wait 0, 2, 4, ... seconds
+TIMEOUT = (10, 30)  # (connect, read) timeouts in seconds
+BUNDLE_MODE = True  # pack pending files into bundles instead of one by one
+BUNDLE_MAX_FILES = 100  # files per bundle
+BUNDLE_MAX_BYTES = 384 * 1024  # uncompressed bytes per bundle
+UPLOAD_MAX_BYTES = 120 * 1024  # keep uploads under receiver's upload limit
+DELTA_SYNC = True  # ask the server which pending files it is missing
+COMPRESSION = 'zstd'  # 'zstd', 'gzip' or None, falls back to gzip
+ZSTD_DICT = os.path.join(modules.HOME, 'zstd.dict')  # optional, must match
+# the receiver's dictionary
+TAR_OVERHEAD = 1024  # tar header and padding added to each member
+MANIFEST = 'manifest.json'  # bundle member holding the member checksums
 
 ##########
 
 
-def get_dest_path(f_name: str) -> str:
+class CountingHTTPSConnection(HTTPSConnection):
+    '''
+    HTTPS connection counting its handshakes, including reconnections of a
+    kept-alive connection the server dropped
+    '''
+    handshakes = 0  # TCP plus TLS handshakes made by all connections
+
+    def connect(self) -> None:
+        super().connect()
+        CountingHTTPSConnection.handshakes += 1
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
     '''
-    Data files sent all contain date info
-    Precondition: the file name is station<n>_YYYY-MM-DDT<...>Z.json
-    Will use the date to construct the dest path and make sure it exists
-    @param filename
-    @return dest folder string in the form {DEST_FOLDER}/YYYY-MM
+    HTTPS pool opening CountingHTTPSConnection connections
     '''
+    ConnectionCls = CountingHTTPSConnection
+
+
+def make_session(pool_size: int = POOL_SIZE,
+                 retries: int = MAX_RETRIES,
+                 backoff: float = BACKOFF_FACTOR) -> rqs.Session:
+    '''
+    Creates the https session used for the whole auth-plus-upload flow
+    Connections are kept alive and pooled, so a backlog of files pays for a
+    single TCP and TLS handshake instead of one per file
+    Only connection errors are retried: a POST that reached the server is
+    never repeated, as the server may have already stored the file
+    @param pool_size number of connections kept open to the receiver
+    @param retries number of reconnection attempts per request
+    @param backoff backoff factor between reconnection attempts
+    @return session ready to talk to the receiver
+    '''
+    new_session = rqs.Session()
+    new_session.verify = VERIFY
+
+    retry = Retry(total=retries, connect=retries, read=0, status=0,
+                  backoff_factor=backoff)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                          max_retries=retry)
+    # https pools count their handshakes, see count_connections()
+    poolmanager = adapter.poolmanager
+    poolmanager.pool_classes_by_scheme = {
+        **poolmanager.pool_classes_by_scheme,
+        'https': CountingHTTPSConnectionPool}
+    new_session.mount('https://', adapter)
+
+    return new_session
+
+
+def count_connections() -> int:
+    '''
+    Counts how many connections the session has opened to the receiver so far
+    Used to tell whether a request paid for a new handshake or reused a
+    kept-alive connection. The count is kept by the connections themselves,
+    looking the pool up would create one with different TLS settings
+    @return number of TCP plus TLS handshakes made so far
+    '''
+    return CountingHTTPSConnection.handshakes
+
+
+##########
+
+def get_encoding() -> str:
+    '''
+    Picks the content encoding used for uploads
+    zstd needs the zstandard package, gzip is always available
+    @return 'zstd', 'gzip' or None for uncompressed uploads
+    '''
+    if COMPRESSION == 'zstd' and zstd is None:
+        return 'gzip'
+
+    return COMPRESSION
+
+
+def load_zstd_dict():
+    '''
+    Loads the zstd dictionary trained on station files, if there is one
+    Small json files compress much better with a dictionary since most of
+    their content is the same keys repeated in every file
+    @return zstd.ZstdCompressionDict or None if there is no dictionary
+    '''
+    if zstd is None or not os.path.isfile(ZSTD_DICT):
+        return None
+
+    with open(ZSTD_DICT, 'rb') as in_f:
+        return zstd.ZstdCompressionDict(in_f.read())
+
+
+def encode_payload(data: bytes) -> bytes:
+    '''
+    Compresses data with the encoding announced in the 'encoding' header
+    @param data bytes to upload
+    @return compressed bytes (data itself if encoding is None)
+    '''
+    if encoding == 'zstd':
+        return zstd.ZstdCompressor(level=19, dict_data=zstd_dict) \
+            .compress(data)
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=9)
+
+    return data
+
+
+##########
 
-    # collect [YYYY, MM, ...]
-    date = f_name.split('/')[-1].split('_')[1].split('-')
+# https session kept alive across uploads so the daemon reuses its connection
+session = make_session()
 
-    # make dest path and see if it exists
-    dest_path = os.path.join(DEST_FOLDER, f'{date[0]}-{date[1]}')
+# files waiting to be sent
+store = SampleStore()
 
-    # check if exists
-    if not os.path.isdir(dest_path):
-        os.mkdir(dest_path)
+# compression used for uploads
+encoding = get_encoding()
+zstd_dict = load_zstd_dict() if encoding == 'zstd' else None
 
-    return dest_path
+##########
 
 
-def auth_sender(http_headers: dict) -> str:
+def auth_sender(http_headers: dict, pending: list = None) -> str:
     '''
     Send authentication message to server
     Authentication will fail if server does not respond or if response does
     not have 301
+    If pending files are given, they are sent along (one name per line) so
+    the server can tell which of them it is still missing
     @param http_headers headers to pass to server. They must contain the pi_id
+    @param pending names of the files about to be sent
     @return response from server, if it is not '301 <rand_string>' then
-        authentication failed
+        authentication failed. With pending files, the names the server is
+        missing follow on their own lines, and '200' means it has them all
     '''
 
-    # send request to server
+    # send request to server, timing it to see what the handshake costs
+    connections = count_connections()
+    start = time.monotonic()
     try:
-        response = rqs.get(URL,
-                           headers=http_headers,
-                           verify=VERIFY).text.strip()
+        if pending is None:
+            response = session.get(URL, headers=http_headers,
+                                   timeout=TIMEOUT).text.strip()
+        else:
+            summary = encode_payload('\n'.join(pending).encode())
+            response = session.post(URL, headers=http_headers,
+                                    files={'pending_files': ('pending.txt',
+                                                             summary)},
+                                    timeout=TIMEOUT).text.strip()
     except rqs.exceptions.RequestException:
         modules.log(f'{URL} can\'t be reached, stopping sender')
         return '500'
+    elapsed = time.monotonic() - start
+
+    # the auth request is the one that opens the connection, if any
+    modules.log('Authenticated', latency_s=elapsed,
+                connection='new' if count_connections() > connections
+                else 'reused')
 
     return response
 
@@ -97,106 +246,396 @@ def check_folders(*args: list) -> bool:
     return True
 
 
-def calc_hash256(f_name: str, path: str = '') -> str:
+def calc_hash256(data: bytes) -> str:
     '''
-    Calculates the hash256 checksum of a given file
-    Precondition: File exists, the method will not check
-    @param f_name name of file
-    @param path Path to file if found in a different directory
+    Calculates the hash256 checksum of the contents of a file
+    @param data contents of file
     @return computed checksum
     '''
+    return hashlib.sha256(data).hexdigest()
 
-    # open file to get checksum
-    with open(os.path.join(path, f_name), 'rb') as in_f:
-        return hashlib.sha256(in_f.read()).hexdigest()
 
-
-def send_to_server(url: str, headers: dict, files: dict) -> bool:
+def post_to_server(url: str, headers: dict, files: dict) -> str:
     '''
-    Sends a file to the server
+    Posts files to the server
     @param url Dest url to send file to
     @param headers Headers info for http request
     @param files Dict of files to send in https request
-    @return True if send was successful
+    @return response from the server, empty string if it can't be reached
     '''
 
-    # send request
+    # send request, timing the upload
+    connections = count_connections()
+    start = time.monotonic()
     try:
-        rsp = rqs.post(url,
-                       files=files,
-                       headers=headers,
-                       verify=VERIFY).text.strip()
+        rsp = session.post(url, files=files, headers=headers,
+                           timeout=TIMEOUT).text.strip()
     except rqs.exceptions.RequestException:
         modules.log(f'{url} can\'t be reached')
-        return False
+        return ''
+    elapsed = time.monotonic() - start
+
+    # report the time spent, flagging uploads that needed a new handshake
+    modules.log('Upload', route=url, latency_s=elapsed,
+                connection='new' if count_connections() > connections
+                else 'reused')
+
+    return rsp
+
+
+def send_to_server(url: str, headers: dict, files: dict) -> bool:
+    '''
+    Sends a file to the server
+    @param url Dest url to send file to
+    @param headers Headers info for http request
+    @param files Dict of files to send in https request
+    @return True if send was successful
+    '''
 
     # check if code is success
-    if rsp == '200':
-        return True
+    return post_to_server(url, headers, files) == '200'
 
-    return False
+
+def send_file(url: str, headers: dict, f_name: str) -> bool:
+    '''
+    Sends a single file from the store to the server
+    @param url Dest url to send file to
+    @param headers Headers info for http request
+    @param f_name name of file in the store
+    @return True if send was successful
+    '''
+
+    # collect and compress file
+    payload = encode_payload(store.read(f_name))
+
+    # get hash256 of the bytes actually sent
+    headers['checksum'] = calc_hash256(payload)
+
+    return send_to_server(url, headers, {'sensor_data_file': (f_name,
+                                                              payload)})
+
+
+def plan_bundles(dir_list: list, sizes: dict) -> list:
+    '''
+    Groups files into bundles small enough for the receiver to accept
+    Files keep their order, a bundle is closed once it reaches
+    BUNDLE_MAX_FILES files or BUNDLE_MAX_BYTES bytes (UPLOAD_MAX_BYTES if
+    uploads are not compressed)
+    @param dir_list sorted list of files in the store
+    @param sizes size in bytes of each file
+    @return list of bundles, each a list of file names
+    '''
+    bundles = []
+    size = 0
+    max_bytes = UPLOAD_MAX_BYTES if encoding is None else BUNDLE_MAX_BYTES
+
+    for f_name in dir_list:
+        f_size = sizes[f_name] + TAR_OVERHEAD
+
+        # start a new bundle if this file doesn't fit in the current one
+        if len(bundles) == 0 or len(bundles[-1]) >= BUNDLE_MAX_FILES or \
+                size + f_size > max_bytes:
+            bundles.append([])
+            size = 0
+
+        bundles[-1].append(f_name)
+        size += f_size
+
+    return bundles
+
+
+def make_bundle(f_names: list) -> bytes:
+    '''
+    Packs files from the store into a tar archive
+    The archive also holds MANIFEST, a json object mapping each member to its
+    sha256 checksum so the server can verify every member on its own
+    @param f_names names of files in the store to pack
+    @return bytes of the archive
+    '''
+    buffer = io.BytesIO()
+    manifest = {}
+
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        for f_name in f_names:
+            data = store.read(f_name)
+            manifest[f_name] = calc_hash256(data)
+            add_member(tar, f_name, data)
+
+        # add the manifest last
+        add_member(tar, MANIFEST, json.dumps(manifest).encode())
+
+    return buffer.getvalue()
+
+
+def add_member(tar: tarfile.TarFile, name: str, data: bytes) -> None:
+    '''
+    Adds a file held in memory to a tar archive
+    @param tar archive open for writing
+    @param name name of the member
+    @param data contents of the member
+    '''
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(data))
+
+
+def send_bundle(url: str, headers: dict, f_names: list) -> list:
+    '''
+    Sends several files from the store to the server in a single request
+    The server answers with a json object mapping each member to its own
+    response code, so only the members that failed have to be sent again
+    Bundles that compress worse than expected are split in two until they
+    fit in UPLOAD_MAX_BYTES
+    @param url Dest url to send bundle to
+    @param headers Headers info for http request
+    @param f_names names of files in the store to send
+    @return list of files the server accepted
+    '''
+
+    bundle = encode_payload(make_bundle(f_names))
+
+    # too big for the receiver, send each half on its own
+    if len(bundle) > UPLOAD_MAX_BYTES and len(f_names) > 1:
+        half = len(f_names) // 2
+
+        # the first half adds one request to the count of those left
+        num_files = headers['num_files']
+        headers['num_files'] = str(int(num_files) + 1)
+        sent = send_bundle(url, headers, f_names[:half])
+        headers['num_files'] = num_files
+
+        return sent + send_bundle(url, headers, f_names[half:])
+
+    headers['checksum'] = calc_hash256(bundle)
+    bundle_name = f'station{station.station_num}_bundle.tar'
+
+    rsp = post_to_server(url, headers,
+                         {'sensor_data_bundle': (bundle_name, bundle)})
+
+    # anything other than per-member results means the whole bundle failed
+    try:
+        results = json.loads(rsp)
+    except ValueError:
+        return []
+    if not isinstance(results, dict):
+        return []
+
+    return [f_name for f_name in f_names if results.get(f_name) == '200']
 
 
 ##########
 
 
-def main():
-    # check if necessary directories exist and are valid
-    if not check_folders(FOLDER, DEST_FOLDER, VERIFY):
-        modules.log('Failed to find all needed folders and files')
-        return -1
+def plan_delta(dir_list: list) -> list:
+    '''
+    Groups pending files into the lists sent for delta sync, one name per
+    line, each list small enough for the receiver to accept
+    (UPLOAD_MAX_BYTES before compression)
+    @param dir_list sorted list of files in the store
+    @return list of lists of file names
+    '''
+    batches = []
+    size = 0
 
-    # construct headers for https request
-    headers = {'pi_id': station.secret, 'pi_num': station.station_num}
+    for f_name in dir_list:
+        f_size = len(f_name.encode()) + 1  # line break
+
+        if len(batches) == 0 or size + f_size > UPLOAD_MAX_BYTES:
+            batches.append([])
+            size = 0
+
+        batches[-1].append(f_name)
+        size += f_size
+
+    return batches
+
+
+def sync_files(headers: dict, dir_list: list, sizes: dict) -> int:
+    '''
+    Authenticates and sends pending files through the upload channel the
+    server opens
+    @param headers headers of the station, pi_id and pi_num
+    @param dir_list files to send, oldest first
+    @param sizes size in bytes of each file
+    @return 0 if the station was authenticated, -1 otherwise
+    '''
+    num_files = len(dir_list)
 
     # auth pi to send data
-    # success -> response = '301 <rand_str>'
-    auth_response = auth_sender(headers)
-    if '301' not in auth_response:  # exit if failed authentication
+    # success -> response = '301 <rand_str>', followed by the files the
+    # server is missing when using delta sync
+    auth_response = auth_sender(headers, dir_list if DELTA_SYNC else None)
+    auth_lines = auth_response.split('\n')
+
+    # with delta sync, '200' means the server already has every file
+    if DELTA_SYNC and auth_response == '200':
+        missing = set()
+    elif '301' not in auth_lines[0]:  # exit if failed authentication
         return -1
+    elif DELTA_SYNC:
+        missing = set(line.strip() for line in auth_lines[1:])
 
-    # collect files to send
-    dir_list = sorted(os.listdir(FOLDER))
-    num_files = len(dir_list)
+    # files the server already has only need to be marked as sent
+    if DELTA_SYNC:
+        received = [f_name for f_name in dir_list if f_name not in missing]
+        store.mark_sent(received)
+        if len(received) > 0:
+            modules.log(f'{len(received)} files already on server')
+
+        dir_list = [f_name for f_name in dir_list if f_name in missing]
+        num_files = len(dir_list)
+        if num_files == 0:
+            return 0
 
     # collect url from the response 301 new_url
-    url = os.path.join(URL, auth_response.strip().split(' ')[1])
+    url = os.path.join(URL, auth_lines[0].strip().split(' ')[1])
+
+    # group files into the requests that will carry them
+    if BUNDLE_MODE and num_files > 1:
+        batches = plan_bundles(dir_list, sizes)
+    else:
+        batches = [[f_name] for f_name in dir_list]
+    num_requests = len(batches)
 
     # loop through all files
     modules.log('Sending files')
-    for send_file in dir_list:
-        # calculate files left to send
-        headers['num_files'] = str(num_files)
+    for batch in batches:
+        # calculate requests left to send
+        headers['num_files'] = str(num_requests)
+        num_requests -= 1
+
+        # send the batch to the server
+        if len(batch) == 1:
+            sent = batch if send_file(url, headers, batch[0]) else []
+        else:
+            sent = send_bundle(url, headers, batch)
+
+        store.mark_sent(sent)
+        for f_name in batch:
+            if f_name not in sent:
+                modules.log('File could not be sent', file=f_name)
+            else:
+                modules.log('File sent', file=f_name)
+
+    return 0
 
-        # get hash256 of file
-        headers['checksum'] = calc_hash256(send_file, FOLDER)
 
-        # collect file
-        files = {'sensor_data_file': open(os.path.join(FOLDER, send_file),
-                                          'rb')}
+def main():
+    # check if necessary files exist and are valid
+    if not check_folders(VERIFY):
+        modules.log('Failed to find all needed folders and files')
+        return -1
 
-        # send the file to the server
-        if not send_to_server(url, headers, files):
-            modules.log(f'{send_file} could not be sent')
-            files['sensor_data_file'].close()
-            num_files -= 1
-            continue
+    # pick up files saved by older versions of the collectors
+    if (imported := store.import_folder(FOLDER)) > 0:
+        modules.log(f'Moved {imported} files from {FOLDER} into the store')
 
-        # close the sent file
-        files['sensor_data_file'].close()
+    # collect files to send
+    pending = store.pending()
+    dir_list = [f_name for _, f_name, _ in pending]
+    sizes = {f_name: size for _, f_name, size in pending}
 
-        # move succesfully sent file to other directory
-        dest_path = get_dest_path(send_file)
+    # nothing to send, do not bother the server
+    if len(dir_list) == 0:
+        return 0
 
-        # move file to new location
-        os.system(f'mv {os.path.join(FOLDER, send_file)} {dest_path}')
+    # construct headers for https request
+    headers = {'pi_id': station.secret, 'pi_num': station.station_num}
+    if encoding is not None:
+        headers['encoding'] = encoding
 
-        modules.log(f'{send_file} sent')
+    # the list of pending files must fit in a request: after a long outage
+    # files are synced a list at a time, each through its own channel
+    for f_names in plan_delta(dir_list) if DELTA_SYNC else [dir_list]:
+        if sync_files(headers, f_names, sizes) != 0:
+            return -1
 
-        num_files -= 1
+    # drop old sent files
+    store.prune()
 
     return 0
 
 
+def drain(sock: socket.socket) -> None:
+    '''
+    Discards all notifications waiting in the socket
+    A single upload pass sends every pending file, so notifications that
+    arrived in the meantime do not need a pass of their own
+    @param sock socket the daemon is listening on
+    '''
+    sock.setblocking(False)
+    try:
+        while True:
+            sock.recv(1024)
+    except BlockingIOError:
+        pass
+    sock.settimeout(RESCAN_INTERVAL)
+
+
+def upload_pass() -> None:
+    '''
+    Runs main(), a failed pass must not bring the daemon down: files are kept
+    in the store and retried on the next pass
+    '''
+    try:
+        main()
+    except Exception as e:
+        modules.log(f'Sender pass failed: {e}')
+
+
+def serve(in_process: bool = False) -> None:
+    '''
+    Runs the sender as a long-lived daemon
+    Collectors notify the daemon through modules.SENDER_SOCKET whenever a new
+    file lands in the store. Every notification (or RESCAN_INTERVAL seconds
+    without one) triggers an upload pass that reuses the same https session,
+    keeping the TLS connection to the receiver warm between cycles
+    @param in_process the collectors run in this process (supervisor.py) and
+        notify the daemon directly instead of through the socket
+    '''
+
+    if in_process:
+        new_file = threading.Event()
+
+        def listener(f_name: str) -> None:
+            new_file.set()
+
+        modules.add_sender_listener(listener)
+        modules.log('Sender daemon listening in process')
+
+        # a restarted daemon registers a new listener, this one must go
+        try:
+            while True:
+                new_file.wait(RESCAN_INTERVAL)
+                new_file.clear()
+                upload_pass()
+        finally:
+            modules.remove_sender_listener(listener)
+
+    # remove socket left behind by a previous run
+    if os.path.exists(modules.SENDER_SOCKET):
+        os.remove(modules.SENDER_SOCKET)
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.bind(modules.SENDER_SOCKET)
+        sock.settimeout(RESCAN_INTERVAL)
+        modules.log('Sender daemon listening')
+
+        while True:
+            # wait for a collector to save a file, rescan anyway on timeout
+            try:
+                sock.recv(1024)
+            except socket.timeout:
+                pass
+
+            drain(sock)
+            upload_pass()
+
+
 if __name__ == "__main__":
-    main()
+    if '--daemon' in sys.argv:
+        modules.buffer_logs()
+        serve()
+    else:
+        main()
@@ -19,67 +19,180 @@ You should have received a copy of the GNU General Public License along with
 
 ##########
 
+import os
+import json
+import time
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
 import ACCESS_station_lib as access
-import busio
+import packages.modules as modules
+from packages.i2cbus import BusArbiter
 
 ##########
 
 '''
 this file should define 2 things
 sensors: list with ALL the sensors of all types
-            Any beseecher sensor connected to the station must be appended to
-            this list
+            Any beseecher sensor connected to the station must be declared
+            in sensors.json
 gps: unlike the sensors, the gps will be a unique variable with the gps
 beseecher.
 
-When initializing sensors, ALWAYS use a try-except block in case the RPi
-fails to start the sensors at boot. The error beseecher class will store any
-error information that comes up and will allow data-collection to report on
-the error.
+The sensors are declared in sensors.json, next to this file:
+    {
+        "gps": {"type": "gps", "params": {"RX_pin": 27}},
+        "sensors": [
+            {"type": "nextpm", "params": {"port": "/dev/ttyAMA0"}},
+            {"type": "bme280", "bus": "i2c"}
+        ]
+    }
+type is a key of ACCESS_station_lib.BESEECHERS, params are passed to the
+beseecher's constructor and "bus": "i2c" gives it the station's shared I2C
+bus. Sensors are listed in the order given, which sets their indices
+
+When initializing sensors, ALWAYS go through init_sensor (or a try-except
+block) in case the RPi fails to start the sensors at boot. The error
+beseecher class will store any error information that comes up and will
+allow data-collection to report on the error.
+
+All sensors are initialized at once, each in its own thread, since most of
+the boot time is spent waiting on the devices. Devices on the I2C bus each
+get their own view of it from the bus arbiter (see packages/i2cbus.py),
+which serializes their transfers and accounts each device's bus time. They
+are initialized holding the bus for the whole initialization
 '''
 
+##########
+
+# constants declarations
+
+SENSORS_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'sensors.json')
+
+##########
+
+
+class I2CBus:
+    '''
+    The station's I2C bus, only opened if a sensor uses it
+    '''
+
+    def __init__(self) -> None:
+        self.arbiter = None
+        self.lock = threading.Lock()
+        self.names = {}  # id of a sensors.json entry: name of its device
+
+    def device(self, entry: dict):
+        '''
+        Opens the bus on the first call
+        @param entry declaration of the sensor asking for the bus
+        @return the device's view of the bus, its usage is reported as
+            <type>_<n> (i.e bme280_0), under the same name if the sensor is
+            initialized again
+        '''
+        with self.lock:
+            if self.arbiter is None:
+                self.arbiter = BusArbiter(access.driver('busio').I2C())
+            if id(entry) not in self.names:
+                n = sum(name.rpartition('_')[0] == entry['type']
+                        for name in self.names.values())
+                self.names[id(entry)] = f'{entry["type"]}_{n}'
+
+        return self.arbiter.device(self.names[id(entry)])
+
+    def usage_report(self, reset: bool = False) -> dict:
+        '''
+        @return bus usage of each device, see BusArbiter.usage_report()
+        '''
+        if self.arbiter is None:
+            return {}
+        return self.arbiter.usage_report(reset)
+
+
+def init_sensor(entry: dict, i2c: I2CBus) -> tuple:
+    '''
+    Initializes a sensor, replacing it with an ErrorBeseecher if it fails
+    @param entry declaration of the sensor in sensors.json
+    @param i2c station's I2C bus
+    @return (beseecher, seconds the initialization took)
+    '''
+    start = time.monotonic()
+
+    sens_type = entry['type']
+    if sens_type not in access.BESEECHERS:
+        return access.ErrorBeseecher('unknown', sens_type,
+                                     f'Unknown sensor type {sens_type}'), 0
+    beseecher_class, sensor = access.BESEECHERS[sens_type]
+
+    try:
+        params = dict(entry.get('params', {}))
+        bus = None
+        if entry.get('bus', None) == 'i2c':
+            bus = params['i2c'] = i2c.device(entry)
+        with bus.session() if bus is not None else nullcontext():
+            beseecher = beseecher_class(**params)
+    except Exception as e:
+        beseecher = access.ErrorBeseecher(sensor, sens_type, str(e))
+        # keep the sensor's schedule, it is initialized again when probed
+        # the GPS beseechers don't derive from Beseecher and have none
+        beseecher.PERIOD = getattr(beseecher_class, 'PERIOD',
+                                   access.Beseecher.PERIOD)
+        beseecher.WARMUP = getattr(beseecher_class, 'WARMUP',
+                                   access.Beseecher.WARMUP)
+
+    return beseecher, time.monotonic() - start
+
+
+def log_init(beseecher, entry: dict, init_time: float) -> None:
+    '''
+    Logs how long a sensor took to initialize and whether it failed
+    '''
+    status = 'failed' if isinstance(beseecher, access.ErrorBeseecher) \
+        else 'initialized'
+    modules.log(f'{entry["type"]} {status} in {init_time:.2f} s')
+
+
+def reinit(slot: int):
+    '''
+    Initializes a sensor again, i.e one that failed at boot and may have been
+    plugged back in
+    @param slot position of the sensor in sensors
+    @return the new beseecher, an ErrorBeseecher if it failed again
+    '''
+    entry = config['sensors'][slot]
+    beseecher, init_time = init_sensor(entry, i2c)
+    log_init(beseecher, entry, init_time)
+
+    beseecher.index = sensors[slot].index
+    sensors[slot] = beseecher
+
+    return beseecher
+
+
+with open(SENSORS_CONFIG, 'r', encoding='utf-8') as in_f:
+    config = json.load(in_f)
+
+i2c = I2CBus()
+
+with ThreadPoolExecutor(max_workers=len(config['sensors']) + 1) as pool:
+    gps_future = pool.submit(init_sensor, config['gps'], i2c)
+    futures = [pool.submit(init_sensor, entry, i2c)
+               for entry in config['sensors']]
+
 # try building gps, GPS sensor is critical point of failure for system
-try:
-    gps = access.GPSbeseecherGPIO()  # only 1 GPS
-except Exception:
+gps, init_time = gps_future.result()
+log_init(gps, config['gps'], init_time)
+if isinstance(gps, access.ErrorBeseecher):
     gps = access.ErrorBeseecher('gps', 'gps', 'Error initializing GPS at boot')
 
 # list to keep all sensors
 sensors = []
 
-# initialize pm sensors
-ports = ['/dev/ttyAMA0', '/dev/ttyAMA1']
-
-for i in range(2):
-    try:
-        sensors.append(access.NEXTPMbeseecher(port=ports[i]))
-    except Exception as e:
-        sensors.append(access.ErrorBeseecher('particulate_matter',
-                                             'nextpm',
-                                             str(e)))
-
-# the air sensors need an I2C object
-i2c = busio.I2C()
-
-# initialize air sensors
-# bme
-try:
-    sensors.append(access.BME280beseecher(i2c=i2c))
-except Exception as e:
-    error_msg = str(e)
-    sensors.append(access.ErrorBeseecher('air_sensor', 'bme280', error_msg))
-# ms8607
-try:
-    sensors.append(access.MS8607beseecher(i2c=i2c))
-except Exception as e:
-    error_msg = str(e)
-    sensors.append(access.ErrorBeseecher('air_sensor', 'ms8607', error_msg))
-# scd30
-try:
-    sensors.append(access.SCD30beseecher(i2c=i2c))
-except Exception as e:
-    error_msg = str(e)
-    sensors.append(access.ErrorBeseecher('co2_sensor', 'scd30', error_msg))
+for entry, future in zip(config['sensors'], futures):
+    beseecher, init_time = future.result()
+    log_init(beseecher, entry, init_time)
+    sensors.append(beseecher)
 
 '''
 set up indeces for all sensors
@@ -0,0 +1,234 @@
+'''
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+'''
+
+##########
+
+import os
+import sys
+import time
+import signal
+import threading
+import importlib
+import traceback
+import tracemalloc
+import packages.modules as modules
+
+##########
+
+'''
+Runs data collection, diagnostics and the sender as threads of a single
+python process instead of three interpreters, so the interpreter and the
+modules they have in common are only loaded once
+The collectors hand new files to the sender in memory (see
+modules.add_sender_listener) instead of through its socket
+A task raising an exception is logged and restarted after RESTART_DELAY
+seconds, doubled after every failure in a row up to MAX_RESTART_DELAY. The
+other tasks keep running meanwhile
+Every MEMORY_REPORT_INTERVAL seconds the process' resident memory is logged
+along with what loading each task added to it. With TRACE_MEMORY the memory
+currently allocated by each task's own files is logged too, at the cost of
+slowing the whole process down
+Logs are buffered in RAM and written in batches (see
+packages/writebehind.py), the buffer is written out when a task fails and
+when the process is stopped
+
+usage: python3 supervisor.py
+'''
+
+##########
+
+# constants declarations
+
+RESTART_DELAY = 10  # seconds before restarting a failed task
+MAX_RESTART_DELAY = 600
+MEMORY_REPORT_INTERVAL = 3600  # seconds
+TRACE_MEMORY = False  # trace allocations with tracemalloc
+# tasks in the order they are started: the sender first so that it hears
+# about the first files. (name, module, entry point, keyword arguments)
+TASKS = (
+    ('sender', 'sender', 'serve', {'in_process': True}),
+    ('diagnostics', 'diagnostics', 'main', {}),
+    ('collection', 'data_collection', 'main', {}),
+)
+# files whose allocations are accounted to each task with TRACE_MEMORY,
+# anything else is 'shared'
+TASK_FILES = {
+    'sender': ('sender.py',),
+    'diagnostics': ('diagnostics.py',),
+    'collection': ('data_collection.py', 'sensors.py',
+                   'ACCESS_station_lib.py'),
+}
+
+##########
+
+
+class Task:
+    '''
+    A station script run in a thread, restarted when it fails
+    '''
+
+    def __init__(self, name: str, module: str, entry: str,
+                 kwargs: dict) -> None:
+        '''
+        @param name name of the task in the logs
+        @param module module of the script, imported by load()
+        @param entry function of the module running the script
+        @param kwargs keyword arguments of entry
+        '''
+        self.name = name
+        self.module_name = module
+        self.entry = entry
+        self.kwargs = kwargs
+        self.module = None
+        self.loaded = 0  # bytes of resident memory loading the module took
+        self.restarts = 0
+        self.thread = None
+
+    def load(self) -> None:
+        '''
+        Imports the task's module, measuring the memory it took
+        '''
+        before = rss()
+        self.module = importlib.import_module(self.module_name)
+        self.loaded = rss() - before
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.run, name=self.name,
+                                       daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        '''
+        Body of the task's thread, runs the script until it returns
+        '''
+        delay = RESTART_DELAY
+
+        while True:
+            started = time.monotonic()
+            try:
+                if self.module is None:  # failed to load at start up
+                    self.load()
+                getattr(self.module, self.entry)(**self.kwargs)
+                modules.log(f'Task {self.name} finished')
+                return
+            except Exception:
+                modules.log(f'Task {self.name} failed, restarting in ' +
+                            f'{delay} s:\n{traceback.format_exc()}')
+                modules.flush_logs()
+
+            # a task that ran for a while before failing starts over with
+            # the shortest delay
+            if time.monotonic() - started > MAX_RESTART_DELAY:
+                delay = RESTART_DELAY
+            time.sleep(delay)
+            delay = min(2 * delay, MAX_RESTART_DELAY)
+            self.restarts += 1
+
+
+def rss() -> int:
+    '''
+    @return resident memory of this process in bytes, 0 if unknown
+    '''
+    try:
+        with open('/proc/self/statm', 'r') as in_f:
+            return int(in_f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def traced_memory() -> dict:
+    '''
+    @return bytes currently allocated by the files of each task, and by the
+        other files under 'shared'
+    '''
+    usage = {name: 0 for name in TASK_FILES}
+    usage['shared'] = 0
+
+    for stat in tracemalloc.take_snapshot().statistics('filename'):
+        f_name = os.path.basename(stat.traceback[0].filename)
+        task = next((name for name, files in TASK_FILES.items()
+                     if f_name in files), 'shared')
+        usage[task] += stat.size
+
+    return usage
+
+
+def report_memory(tasks: list) -> None:
+    '''
+    Logs the process' resident memory, what each task added to it when it
+    was loaded and how many times it was restarted
+    '''
+    mb = 1024 * 1024
+    report = ', '.join(f'{task.name} {task.loaded / mb:.1f} MB at load ' +
+                       f'({task.restarts} restarts)' for task in tasks)
+    modules.log(f'Memory: {rss() / mb:.1f} MB resident, ' +
+                f'{threading.active_count()} threads; {report}')
+
+    if TRACE_MEMORY:
+        traced = ', '.join(f'{name} {size / mb:.1f} MB'
+                           for name, size in traced_memory().items())
+        modules.log(f'Memory allocated: {traced}')
+
+
+def report_writes() -> None:
+    '''
+    Logs what was written to the SD card today
+    '''
+    if modules.writer is None:
+        return
+
+    today = modules.writer.today()
+    modules.log(f'Writes today: logs {today["bytes"]} bytes in ' +
+                f'{today["ops"]} writes ({today["flushes"]} flushes), ' +
+                f'process {today["disk_bytes"]} bytes, ' +
+                f'{today["dropped"]} log bytes dropped')
+
+
+def main():
+    if TRACE_MEMORY:
+        tracemalloc.start()
+
+    # buffer the logs, stopping the service exits cleanly so they are
+    # written out
+    modules.buffer_logs()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    tasks = [Task(*task) for task in TASKS]
+
+    # load every task before starting any so that the memory each one adds
+    # is measured on its own, a task failing to load retries in its thread
+    for task in tasks:
+        try:
+            task.load()
+        except Exception:
+            modules.log(f'Task {task.name} failed to load:\n' +
+                        traceback.format_exc())
+
+    for task in tasks:
+        task.start()
+        modules.log(f'Task {task.name} started')
+
+    while True:
+        report_memory(tasks)
+        report_writes()
+        time.sleep(MEMORY_REPORT_INTERVAL)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+'''
+
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+##########
+
+import os
+import sys
+import tempfile
+import pytest
+
+##########
+
+'''
+The station's modules are imported as they are by its scripts, from the
+data_collection folder. The station's files (logs, samples.db) go to a
+scratch folder unless ACCESS_HOME is set (see packages/modules.py)
+Tests of data_collection itself run it on simulated hardware
+usage, from the repository: python3 -m pytest data_collection/tests
+'''
+
+##########
+
+os.environ.setdefault('ACCESS_HOME', tempfile.mkdtemp(prefix='access_tests_'))
+os.makedirs(os.path.join(os.environ['ACCESS_HOME'], 'logs'), exist_ok=True)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+##########
+
+
+@pytest.fixture(scope='session')
+def collection():
+    '''
+    data_collection running on simulated hardware (see
+    packages/simulation.py)
+    '''
+    import packages.simulation as simulation
+    simulation.install(speedup=600, seed=1)
+    import data_collection
+    return data_collection
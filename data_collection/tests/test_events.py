@@ -0,0 +1,161 @@
+'''
+
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+##########
+
+import time
+import sqlite3
+import pytest
+import packages.events as events
+from packages.store import SampleStore
+
+##########
+
+'''
+Diagnostics events: coalescing, the read cursor and acknowledging along
+with the diagnostics file
+'''
+
+##########
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'samples.db')
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    '''
+    Fake wall clock
+    @return {'now'}, move it to let time pass
+    '''
+    now = {'now': 1000.0}
+    monkeypatch.setattr(time, 'time', lambda: now['now'])
+    return now
+
+
+@pytest.fixture
+def store(path):
+    store = events.EventStore(path)
+    yield store
+    store.close()
+
+
+def test_coalesce(store):
+    store.error('gps', 'no fix')
+    store.error('gps', 'timeout')
+    store.error('particulate_matter0', 'no answer')
+
+    cursor, errors, statuses = store.read()
+
+    assert cursor == 3
+    assert [(name, message, count)
+            for name, message, count, _, _ in errors] == \
+        [('gps', 'timeout', 2), ('particulate_matter0', 'no answer', 1)]
+    assert statuses == []
+
+
+def test_cursor(store):
+    store.status('2022-01-01', '10:00:00', '45.0', '12%')
+    cursor, _, _ = store.read()
+    store.status('2022-01-01', '10:10:00', '46.0', '12%')
+
+    _, errors, statuses = store.read(cursor)
+
+    assert errors == []
+    assert statuses == [('2022-01-01', '10:10:00', '46.0', '12%')]
+
+
+def test_acknowledge_keeps_newer(store):
+    store.error('gps', 'no fix')
+    store.error('gps', 'no fix')
+    cursor, _, _ = store.read()
+    # happens again once read: a new count, kept by acknowledge
+    store.error('gps', 'timeout')
+
+    store.acknowledge(cursor)
+
+    _, errors, _ = store.read()
+    assert [(name, message, count)
+            for name, message, count, _, _ in errors] == \
+        [('gps', 'timeout', 1)]
+
+
+def test_acknowledge_with_file(store, path):
+    store.error('gps', 'no fix')
+    cursor, _, _ = store.read()
+
+    store.acknowledge(cursor, 'station1_diagnostics.json', b'{}')
+
+    assert store.read()[1] == []
+    samples = SampleStore(path)
+    assert samples.read('station1_diagnostics.json') == b'{}'
+    samples.close()
+
+
+def test_acknowledge_failed(store):
+    store.error('gps', 'no fix')
+    cursor, _, _ = store.read()
+
+    # the file can't be stored: the events stay
+    with pytest.raises(sqlite3.IntegrityError):
+        store.acknowledge(cursor, 'station1_diagnostics.json', None)
+
+    assert len(store.read()[1]) == 1
+
+
+def test_max_status(store, monkeypatch):
+    monkeypatch.setattr(events, 'MAX_STATUS', 3)
+    for minute in range(5):
+        store.status('2022-01-01', f'10:0{minute}:00', '45.0', '12%')
+
+    _, _, statuses = store.read()
+
+    assert [time for _, time, _, _ in statuses] == \
+        ['10:02:00', '10:03:00', '10:04:00']
+
+
+def test_read_not_acknowledged(store, clock):
+    store.error('gps', 'no fix')
+    store.read()
+    # the report never reached the server, nothing was acknowledged
+    clock['now'] += 600
+    store.error('gps', 'no fix')
+
+    _, errors, _ = store.read()
+
+    # every occurrence is reported again
+    assert errors == [('gps', 'no fix', 2, 1000.0, 1600.0)]
+
+
+def test_acknowledge_keeps_count_since_read(store, clock):
+    store.error('gps', 'no fix')
+    cursor, _, _ = store.read()
+    clock['now'] += 600
+    store.error('gps', 'no fix')
+    clock['now'] += 600
+    store.error('gps', 'timeout')
+
+    store.acknowledge(cursor)
+
+    # only what happened after the acknowledged read is left
+    assert store.read()[1] == [('gps', 'timeout', 2, 1600.0, 2200.0)]
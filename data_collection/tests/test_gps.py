@@ -0,0 +1,105 @@
+'''
+
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+##########
+
+import time
+import threading
+import pytest
+import ACCESS_station_lib as access
+
+##########
+
+'''
+GPS read in the background: positions older than MAX_FIX_AGE are not
+stamped on records
+'''
+
+##########
+
+GGA = {'time': '10:00:00', 'latitude': 24.52, 'lat_dir': 'N',
+       'longitude': 54.43, 'lon_dir': 'E', 'altitude': 5.0, 'alt_unit': 'M',
+       'num_sats': 8}
+GSA = {'PDOP': 1.8, 'HDOP': 1.0, 'VDOP': 1.5}
+RMC = {'date': '2022-01-01', 'time': '10:00:00', 'valid': True}
+
+##########
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    '''
+    Fake monotonic clock
+    @return {'now'}, move it to let time pass
+    '''
+    now = {'now': 1000.0}
+    monkeypatch.setattr(time, 'monotonic', lambda: now['now'])
+    return now
+
+
+@pytest.fixture
+def gps(clock):
+    '''
+    GPS without its serial port and reader, fed sentences received now
+    '''
+    gps = access.GPSbeseecherGPIO.__new__(access.GPSbeseecherGPIO)
+    gps._sentences = {}
+    gps._lock = threading.Lock()
+    gps._fixed = threading.Event()
+    gps._started = clock['now']
+    for sentence_type, values in (('GGA', GGA), ('GSA', GSA), ('RMC', RMC)):
+        gps._update(sentence_type, dict(values), clock['now'])
+    return gps
+
+
+def test_recent_fix(gps, clock):
+    clock['now'] += 5
+
+    fix = gps.fix()
+
+    assert (fix['latitude'], fix['longitude'], fix['PDOP']) == \
+        (24.52, 54.43, 1.8)
+    assert fix['fix_age'] == 5.0
+    assert (fix['date'], fix['time']) == ('2022-01-01', '10:00:05')
+
+
+def test_stale_fix(gps, clock):
+    clock['now'] += gps.MAX_FIX_AGE + 1
+
+    fix = gps.fix()
+
+    assert fix['latitude'] is None and fix['longitude'] is None
+    assert fix['PDOP'] is None
+    assert fix['fix_age'] == gps.MAX_FIX_AGE + 1
+    # the receiver's clock still dates the record
+    assert fix['date'] == '2022-01-01'
+
+
+def test_stale_fix_reported(collection, gps, clock, monkeypatch):
+    clock['now'] += 60
+    monkeypatch.setattr(collection.sens, 'gps', gps)
+    monkeypatch.setattr(collection, 'data_to_save', {})
+
+    assert collection.collect_gps_data()['latitude'] is None
+
+    _, errors, _ = collection.events.read()
+    assert [message for name, message, _, _, _ in errors
+            if name == 'gps'] == ['Could not fix GPS, last fix 60.0 s ago']
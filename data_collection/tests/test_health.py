@@ -0,0 +1,104 @@
+'''
+
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+##########
+
+import time
+import pytest
+from packages.health import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+##########
+
+'''
+Circuit breaker of the sensors: opening, probing, backing off and recovering
+'''
+
+##########
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    '''
+    Fake monotonic clock
+    @return {'now'}, move it to let time pass
+    '''
+    now = {'now': 1000.0}
+    monkeypatch.setattr(time, 'monotonic', lambda: now['now'])
+    return now
+
+
+def trip(breaker: CircuitBreaker) -> list:
+    '''
+    Fails the breaker threshold times
+    @return what each failure returned
+    '''
+    return [breaker.failure() for _ in range(breaker.threshold)]
+
+
+def test_opens_after_threshold(clock):
+    breaker = CircuitBreaker(base_backoff=600)
+
+    assert trip(breaker) == [False, False, True]
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+
+def test_success_resets_failures(clock):
+    breaker = CircuitBreaker(base_backoff=600)
+    breaker.failure()
+    breaker.failure()
+
+    assert breaker.success()
+    assert not breaker.failure()
+    assert breaker.state == CLOSED
+    # a sensor that never failed did not recover
+    assert not CircuitBreaker(base_backoff=600).success()
+
+
+def test_probe_and_backoff(clock):
+    breaker = CircuitBreaker(base_backoff=600, max_backoff=2000)
+    trip(breaker)
+
+    clock['now'] += 599
+    assert not breaker.allow()
+
+    # every failed probe doubles the backoff, up to max_backoff
+    for backoff in (600, 1200, 2000, 2000):
+        clock['now'] += backoff
+        assert breaker.allow()
+        assert breaker.state == HALF_OPEN
+        assert not breaker.failure()  # was open already
+        assert breaker.state == OPEN
+        assert breaker.backoff == min(2 * backoff, 2000)
+
+
+def test_probe_recovers(clock):
+    breaker = CircuitBreaker(base_backoff=600)
+    trip(breaker)
+    clock['now'] += 600
+    assert breaker.allow()
+
+    assert breaker.success()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+    # failing again takes threshold failures and the base backoff
+    assert trip(breaker)[-1]
+    assert breaker.backoff == 600
@@ -0,0 +1,175 @@
+'''
+
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+##########
+
+import time
+import threading
+import pytest
+from packages.scheduler import Scheduler, DeadlineWorker
+
+##########
+
+'''
+Scheduler: slots aligned on the wall clock, deadlines on blocking calls and
+sensors timing out in data_collection
+'''
+
+##########
+
+EPOCH = 1_600_000_200  # a multiple of 600 s
+
+##########
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    '''
+    Fake clocks, the monotonic one started at boot 1000 s ago
+    @return {'monotonic', 'time'}, move both to let time pass
+    '''
+    now = {'monotonic': 1000.0, 'time': EPOCH - 77.0}
+    monkeypatch.setattr(time, 'monotonic', lambda: now['monotonic'])
+    monkeypatch.setattr(time, 'time', lambda: now['time'])
+    return now
+
+
+def test_slots_on_wall_clock(clock):
+    scheduler = Scheduler()
+    scheduler.align()
+
+    slot = scheduler.next_slot(600)
+
+    assert scheduler.wall_time(slot) == EPOCH
+    assert slot == clock['monotonic'] + 77
+    # shorter periods fall on their own multiples
+    assert scheduler.wall_time(scheduler.next_slot(60)) == EPOCH - 60
+
+
+def test_slot_lead(clock):
+    scheduler = Scheduler()
+    scheduler.align()
+
+    # starts 30 s before the slot
+    assert scheduler.wall_time(scheduler.next_slot(600, lead=30)) == \
+        EPOCH - 30
+    # too late to start before this slot, wait for the next one
+    assert scheduler.wall_time(scheduler.next_slot(600, lead=90)) == \
+        EPOCH + 600 - 90
+
+
+def test_slot_in_future(clock):
+    scheduler = Scheduler()
+    scheduler.align()
+    clock['monotonic'] += 77
+    clock['time'] += 77
+
+    # on a boundary, the next slot is the following one
+    assert scheduler.wall_time(scheduler.next_slot(600)) == EPOCH + 600
+
+
+def test_align(clock):
+    scheduler = Scheduler()
+    assert scheduler.align()
+
+    # small drifts of the wall clock don't move the slots
+    clock['time'] += 0.1
+    assert not scheduler.align()
+
+    # ntp setting the clock does
+    clock['time'] += 3600.4
+    assert scheduler.align()
+    assert scheduler.wall_time(scheduler.next_slot(600)) == EPOCH + 3600
+
+
+def test_deadline_result():
+    worker = DeadlineWorker('test')
+
+    assert worker.run(lambda: 42, timeout=1) == 42
+    assert not worker.busy()
+
+
+def test_deadline_error():
+    def fail():
+        raise OSError('no answer from device')
+
+    with pytest.raises(OSError, match='no answer from device'):
+        DeadlineWorker().run(fail, timeout=1)
+
+
+def test_deadline_timeout():
+    worker = DeadlineWorker()
+    release = threading.Event()
+
+    with pytest.raises(TimeoutError):
+        worker.run(release.wait, timeout=0.05)
+    # the hung call is left running, no new call is started meanwhile
+    assert worker.busy()
+    with pytest.raises(TimeoutError, match='still running'):
+        worker.run(lambda: 1, timeout=1)
+
+    release.set()
+    worker.thread.join(1)
+    assert worker.run(lambda: 1, timeout=1) == 1
+
+
+def hang(collection, monkeypatch, slot: int) -> threading.Event:
+    '''
+    Makes a sensor hang until the returned event is set, on a fresh record
+    '''
+    for state in ('data_to_save', 'readings', 'workers', 'breakers'):
+        monkeypatch.setattr(collection, state, {})
+    sensor = collection.sens.sensors[slot]
+    release = threading.Event()
+    monkeypatch.setattr(sensor, 'measure', release.wait)
+    monkeypatch.setattr(sensor, 'TIMEOUT', 0.05)
+    return release
+
+
+def test_sensor_timeout_recorded(collection, monkeypatch):
+    release = hang(collection, monkeypatch, 0)
+    sensor = collection.sens.sensors[0]
+
+    collection.measure(0)
+    release.set()
+    collection.data_init()
+    collection.merge_readings()
+
+    assert collection.timings['particulate_matter0'] == 'timeout'
+    # the record tells the hung sensor from those that did not report
+    assert collection.data_to_save['particulate_matter'] == [
+        {'type': sensor.TYPE, 'sensor': 'particulate_matter0',
+         'diagnostics': {'timeout': True}}, None]
+
+
+def test_sensor_timeout_keeps_reading(collection, monkeypatch):
+    release = hang(collection, monkeypatch, 0)
+    reading = {'type': 'nextpm', 'sensor': 'particulate_matter0',
+               'PM1count': 120}
+    collection.readings[('particulate_matter', 0)] = reading
+
+    collection.measure(0)
+    release.set()
+    collection.data_init()
+    collection.merge_readings()
+
+    # a reading from earlier in the record is still reported
+    assert collection.data_to_save['particulate_matter'][0] == reading
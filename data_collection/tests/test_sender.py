@@ -0,0 +1,201 @@
+'''
+
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+##########
+
+import io
+import json
+import hashlib
+import tarfile
+import pytest
+import sender
+from packages.store import SampleStore
+
+##########
+
+'''
+Sender: planning, packing and splitting bundles
+'''
+
+##########
+
+
+def test_plan_bundles_by_count(monkeypatch):
+    monkeypatch.setattr(sender, 'BUNDLE_MAX_FILES', 2)
+    names = [f'f{i}.json' for i in range(5)]
+
+    bundles = sender.plan_bundles(names, {name: 10 for name in names})
+
+    assert bundles == [['f0.json', 'f1.json'], ['f2.json', 'f3.json'],
+                       ['f4.json']]
+
+
+def test_plan_bundles_by_size(monkeypatch):
+    monkeypatch.setattr(sender, 'encoding', 'gzip')
+    monkeypatch.setattr(sender, 'BUNDLE_MAX_BYTES',
+                        3 * (100 + sender.TAR_OVERHEAD))
+    names = [f'f{i}.json' for i in range(4)]
+    sizes = {'f0.json': 100, 'f1.json': 100, 'f2.json': 100, 'f3.json': 101}
+
+    bundles = sender.plan_bundles(names, sizes)
+
+    assert bundles == [['f0.json', 'f1.json', 'f2.json'], ['f3.json']]
+    # a file too big for any bundle still gets one of its own
+    assert sender.plan_bundles(['big'], {'big': 10**6}) == [['big']]
+
+
+def test_make_bundle_manifest():
+    files = {'station0_bundle_a.json': b'{"a": 1}',
+             'station0_bundle_b.json': b'{"b": 2}'}
+    for name, data in files.items():
+        sender.store.add(name, data)
+
+    with tarfile.open(fileobj=io.BytesIO(sender.make_bundle(list(files))),
+                      mode='r') as tar:
+        members = {info.name: tar.extractfile(info).read() for info in tar}
+
+    manifest = json.loads(members.pop(sender.MANIFEST))
+    assert members == files
+    assert manifest == {name: hashlib.sha256(data).hexdigest()
+                        for name, data in files.items()}
+
+
+def test_send_bundle_splits(monkeypatch):
+    names = [f'station0_split_{i}.json' for i in range(4)]
+    for name in names:
+        sender.store.add(name, b'{}')
+    # uncompressed, any tar archive (10 KB records) is too big to share
+    monkeypatch.setattr(sender, 'encoding', None)
+    monkeypatch.setattr(sender, 'UPLOAD_MAX_BYTES', 5000)
+
+    requests = []
+
+    def post(url, headers, files):
+        bundle = files['sensor_data_bundle'][1]
+        assert headers['checksum'] == hashlib.sha256(bundle).hexdigest()
+        requests.append(headers['num_files'])
+        with tarfile.open(fileobj=io.BytesIO(bundle), mode='r') as tar:
+            return json.dumps({info.name: '200' for info in tar})
+
+    monkeypatch.setattr(sender, 'post_to_server', post)
+    headers = {'num_files': '1'}
+
+    assert sender.send_bundle('url', headers, names) == names
+    # every half announces the requests left after it
+    assert requests == ['3', '2', '2', '1']
+    assert headers['num_files'] == '1'
+
+
+def test_send_bundle_partial(monkeypatch):
+    names = ['station0_partial_a.json', 'station0_partial_b.json']
+    for name in names:
+        sender.store.add(name, b'{}')
+
+    monkeypatch.setattr(sender, 'post_to_server', lambda url, headers, files:
+                        json.dumps({names[0]: '200', names[1]: '500'}))
+    assert sender.send_bundle('url', {'num_files': '1'}, names) == names[:1]
+
+    # anything but per-member results fails the whole bundle
+    monkeypatch.setattr(sender, 'post_to_server',
+                        lambda url, headers, files: '500')
+    assert sender.send_bundle('url', {'num_files': '1'}, names) == []
+
+
+@pytest.fixture
+def delta(tmp_path, monkeypatch):
+    '''
+    Sender with two pending files and a fake server, the server's answer to
+    the authentication is set in the returned dictionary
+    @return {'answer', 'uploads', 'pending'}
+    '''
+    monkeypatch.setattr(sender, 'store', SampleStore(str(tmp_path / 'db')))
+    monkeypatch.setattr(sender, 'FOLDER', str(tmp_path / 'data_logs'))
+    monkeypatch.setattr(sender, 'check_folders', lambda *args: True)
+    monkeypatch.setattr(sender, 'DELTA_SYNC', True)
+    monkeypatch.setattr(sender, 'BUNDLE_MODE', False)
+    sender.store.add('a.json', b'{}')
+    sender.store.add('b.json', b'{}')
+
+    server = {'answer': '', 'uploads': [], 'pending': None}
+
+    def auth_sender(headers, pending=None):
+        server['pending'] = pending
+        return server['answer']
+
+    def send_file(url, headers, f_name):
+        server['uploads'].append(f_name)
+        return True
+
+    monkeypatch.setattr(sender, 'auth_sender', auth_sender)
+    monkeypatch.setattr(sender, 'send_file', send_file)
+    return server
+
+
+def test_delta_sync_sends_missing(delta):
+    delta['answer'] = '301 abc\nb.json'
+
+    assert sender.main() == 0
+    assert delta['pending'] == ['a.json', 'b.json']
+    assert delta['uploads'] == ['b.json']
+    assert sender.store.pending() == []
+
+
+def test_delta_sync_nothing_missing(delta):
+    delta['answer'] = '200'
+
+    assert sender.main() == 0
+    assert delta['uploads'] == []
+    assert sender.store.pending() == []
+
+
+def test_delta_sync_refused(delta):
+    delta['answer'] = '400'
+
+    assert sender.main() == -1
+    assert len(sender.store.pending()) == 2
+
+
+def test_delta_sync_long_outage(delta, monkeypatch):
+    # days of files waiting, their names alone exceed the receiver's
+    # MAX_CONTENT_LENGTH
+    max_content_length = 128 * 1024
+    names = [f'station1_2022-01-01T{i:06d}Z.json' for i in range(6000)]
+    for name in names:
+        sender.store.add(name, b'{}')
+    assert len('\n'.join(names)) > max_content_length
+
+    lists = []
+
+    def auth_sender(headers, pending=None):
+        lists.append(pending)
+        # the server has the first and last files
+        return '\n'.join(['301 abc', *pending[1:-1]])
+
+    monkeypatch.setattr(sender, 'auth_sender', auth_sender)
+    assert sender.main() == 0
+
+    assert len(lists) > 1
+    assert all(len('\n'.join(pending).encode()) <= sender.UPLOAD_MAX_BYTES
+               for pending in lists)
+    assert [name for pending in lists for name in pending] == \
+        ['a.json', 'b.json', *names]
+    assert len(delta['uploads']) == len(names) + 2 - 2 * len(lists)
+    assert sender.store.pending() == []
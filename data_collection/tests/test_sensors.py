@@ -0,0 +1,57 @@
+'''
+
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+##########
+
+from packages.i2cbus import BusArbiter
+
+##########
+
+'''
+Sensors: names the I2C devices' bus usage is reported under
+'''
+
+##########
+
+
+def test_device_names(collection):
+    i2c = collection.sens.I2CBus()
+    i2c.arbiter = BusArbiter(None)  # no transfers, only names
+    entries = [{'type': 'bme280'}, {'type': 'bme280'}, {'type': 'scd30'},
+               {'type': 'bme'}]
+
+    names = [i2c.device(entry).name for entry in entries]
+
+    # a type that is a prefix of another counts its own devices
+    assert names == ['bme280_0', 'bme280_1', 'scd30_0', 'bme_0']
+    # initialized again under the same name
+    assert i2c.device(entries[1]).name == 'bme280_1'
+    assert set(i2c.usage_report()) == set(names)
+
+
+def test_station_devices(collection):
+    on_bus = [sensor.TYPE for sensor in collection.sens.sensors
+              if sensor.i2c is not None]
+
+    assert on_bus
+    assert sorted(collection.sens.i2c.usage_report()) == \
+        sorted(f'{sens_type}_{on_bus[:n].count(sens_type)}'
+               for n, sens_type in enumerate(on_bus))
@@ -0,0 +1,132 @@
+'''
+
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+##########
+
+import random
+import statistics
+import pytest
+from packages.stats import StreamingStats, StatsWindow
+
+##########
+
+'''
+Streaming statistics: Welford moments and P-square quantiles
+'''
+
+##########
+
+
+def exact_quantile(values: list, p: float) -> float:
+    '''
+    @return quantile of values, interpolating between the sorted values
+    '''
+    values = sorted(values)
+    rank = p * (len(values) - 1)
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (rank - low) * (values[high] - values[low])
+
+
+def test_empty():
+    stats = StreamingStats()
+
+    assert stats.summary() is None
+    assert stats.quantile(0) is None
+
+
+def test_moments():
+    rng = random.Random(1)
+    values = [rng.gauss(25, 3) for _ in range(1000)]
+    stats = StreamingStats()
+    for value in values:
+        stats.update(value)
+
+    summary = stats.summary()
+    assert summary['mean'] == pytest.approx(statistics.mean(values))
+    assert summary['std'] == pytest.approx(statistics.stdev(values))
+    assert summary['min'] == min(values)
+    assert summary['max'] == max(values)
+
+
+@pytest.mark.parametrize('distribution', ['gauss', 'uniform', 'expovariate'])
+def test_quantiles(distribution):
+    # estimates can stray further on unlucky streams, the seed keeps the
+    # stream fixed
+    rng = random.Random(1)
+    draw = {'gauss': lambda: rng.gauss(0, 1),
+            'uniform': lambda: rng.uniform(0, 100),
+            'expovariate': lambda: rng.expovariate(1)}[distribution]
+    values = [draw() for _ in range(5000)]
+    stats = StreamingStats()
+    for value in values:
+        stats.update(value)
+
+    spread = exact_quantile(values, 0.9) - exact_quantile(values, 0.1)
+    summary = stats.summary()
+    for p in (0.1, 0.5, 0.9):
+        assert abs(summary[f'p{round(p * 100)}'] -
+                   exact_quantile(values, p)) < 0.05 * spread
+
+
+def test_few_samples():
+    stats = StreamingStats()
+    for value in (3.0, 1.0, 2.0):
+        stats.update(value)
+
+    # all samples are kept, quantiles are exact
+    summary = stats.summary()
+    assert (summary['p10'], summary['p50'], summary['p90']) == \
+        pytest.approx((1.2, 2.0, 2.8))
+
+    stats.update(7.0)
+    assert stats.summary()['p50'] == pytest.approx(2.5)
+
+
+def test_reset():
+    stats = StreamingStats()
+    for value in range(100):
+        stats.update(value)
+    stats.reset()
+    stats.update(5.0)
+
+    assert stats.summary() == {'mean': 5.0, 'std': 0.0, 'min': 5.0,
+                               'max': 5.0, 'p10': 5.0, 'p50': 5.0, 'p90': 5.0}
+
+
+def test_window():
+    window = StatsWindow(('temperature', 'humidity'), quantiles=(0.5,))
+    assert window.summary() is None
+
+    window.update({'temperature': 20.0, 'humidity': None})
+    window.update({'temperature': 22.0})
+
+    assert window.summary() == {
+        'temperature': 21.0, 'temperature_std': pytest.approx(2 ** 0.5),
+        'temperature_min': 20.0, 'temperature_max': 22.0,
+        'temperature_p50': 21.0,
+        'humidity': None, 'humidity_std': None, 'humidity_min': None,
+        'humidity_max': None, 'humidity_p50': None,
+        'samples': 2,
+    }
+
+    window.reset()
+    assert window.summary() is None
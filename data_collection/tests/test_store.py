@@ -0,0 +1,105 @@
+'''
+
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+##########
+
+import time
+import pytest
+from packages.store import SampleStore
+
+##########
+
+'''
+Sample store: adding, paging, marking as sent, pruning and importing files
+'''
+
+##########
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SampleStore(str(tmp_path / 'samples.db'), retention_days=1)
+    yield store
+    store.close()
+
+
+def names(pending: list) -> list:
+    return [name for _, name, _ in pending]
+
+
+def test_add_and_read(store):
+    store.add('a.json', b'{"a": 1}')
+
+    assert store.read('a.json') == b'{"a": 1}'
+    assert store.read('b.json') is None
+    assert [size for _, _, size in store.pending()] == [8]
+
+
+def test_replace_marks_unsent(store):
+    store.add('a.json', b'old')
+    store.add('b.json', b'{}')
+    store.mark_sent(['a.json', 'b.json'])
+    assert store.pending() == []
+
+    store.add('a.json', b'new')
+
+    assert names(store.pending()) == ['a.json']
+    assert store.read('a.json') == b'new'
+
+
+def test_pending_pages(store):
+    for i in range(5):
+        store.add(f'f{i}.json', b'{}')
+
+    first = store.pending(limit=2)
+    second = store.pending(after=first[-1][0], limit=2)
+    last = store.pending(after=second[-1][0])
+
+    assert names(first + second + last) == [f'f{i}.json' for i in range(5)]
+    assert names(last) == ['f4.json']
+
+
+def test_prune_keeps_unsent_and_recent(store):
+    for name in ('old.json', 'recent.json', 'unsent.json'):
+        store.add(name, b'{}')
+    store.mark_sent(['old.json', 'recent.json'])
+    with store.db:
+        store.db.execute('UPDATE samples SET sent = ? WHERE name = ?',
+                         (time.time() - 2 * 86400, 'old.json'))
+
+    assert store.prune() == 1
+    assert store.read('old.json') is None
+    assert store.read('recent.json') == b'{}'
+    assert names(store.pending()) == ['unsent.json']
+
+
+def test_import_folder(store, tmp_path):
+    folder = tmp_path / 'data_logs'
+    folder.mkdir()
+    (folder / 'b.json').write_bytes(b'b')
+    (folder / 'a.json').write_bytes(b'a')
+    (folder / 'nested').mkdir()
+
+    assert store.import_folder(str(folder)) == 2
+    assert names(store.pending()) == ['a.json', 'b.json']
+    assert store.read('b.json') == b'b'
+    assert sorted(p.name for p in folder.iterdir()) == ['nested']
+    assert store.import_folder(str(tmp_path / 'missing')) == 0
@@ -0,0 +1,123 @@
+'''
+
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+##########
+
+import atexit
+import pytest
+from packages.writebehind import WriteBehind
+
+##########
+
+'''
+Write-behind buffer: batching, replacing, and keeping failed writes up to
+max_pending bytes
+'''
+
+##########
+
+
+@pytest.fixture
+def writer():
+    '''
+    Buffer that only flushes when told to
+    '''
+    writer = WriteBehind(interval=3600, max_bytes=2**30, max_pending=20)
+    yield writer
+    # nothing left to write at exit
+    atexit.unregister(writer.close)
+    writer.appends.clear()
+    writer.replaces.clear()
+
+
+def test_append(writer, tmp_path):
+    path = str(tmp_path / 'log.txt')
+    writer.append(path, 'one\n')
+    writer.append(path, 'two\n')
+    assert not (tmp_path / 'log.txt').exists()
+
+    writer.flush()
+
+    assert (tmp_path / 'log.txt').read_text() == 'one\ntwo\n'
+    assert writer.buffered == 0
+    today = writer.today()
+    assert (today['bytes'], today['ops'], today['flushes']) == (8, 1, 1)
+
+
+def test_replace(writer, tmp_path):
+    path = str(tmp_path / 'time.txt')
+    writer.replace(path, 'first')
+    writer.replace(path, 'second')
+    assert writer.buffered == len('second')
+
+    writer.flush()
+
+    assert (tmp_path / 'time.txt').read_text() == 'second'
+    assert not (tmp_path / 'time.txt.tmp').exists()
+
+
+def test_failed_writes_kept(writer, tmp_path):
+    folder = tmp_path / 'logs'
+    log = str(folder / 'log.txt')
+    replaced = str(folder / 'time.txt')
+    writer.append(log, 'old\n')
+    writer.replace(replaced, 'old')
+
+    with pytest.raises(OSError):
+        writer.flush()
+    assert writer.buffered == len('old\n') + len('old')
+
+    # written after what failed, newer contents win
+    writer.append(log, 'new\n')
+    writer.replace(replaced, 'new')
+    folder.mkdir()
+    writer.flush()
+
+    assert (folder / 'log.txt').read_text() == 'old\nnew\n'
+    assert (folder / 'time.txt').read_text() == 'new'
+    assert writer.today()['dropped'] == 0
+
+
+def test_max_pending(writer, tmp_path):
+    log = str(tmp_path / 'logs' / 'log.txt')
+    for i in range(5):
+        writer.append(log, f'line {i}\n')
+
+    with pytest.raises(OSError):
+        writer.flush()
+
+    # the oldest lines are dropped
+    assert writer.appends[log] == ['line 3\n', 'line 4\n']
+    assert writer.buffered == 14
+    assert writer.today()['dropped'] == 21
+
+
+def test_max_pending_long_chunk(writer, tmp_path):
+    log = str(tmp_path / 'logs' / 'log.txt')
+    writer.append(log, 'a long first line\nsecond\nthird\n')
+
+    with pytest.raises(OSError):
+        writer.flush()
+
+    # cut at the start of a line
+    assert writer.appends[log] == ['second\nthird\n']
+    assert writer.buffered == 13
+    assert writer.today()['dropped'] == 18
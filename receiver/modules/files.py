@@ -19,10 +19,22 @@ You should have received a copy of the GNU General Public License along with
 '''
 
 import os
+import io
+import gzip
+import shutil
 import hashlib
+import tarfile
 from werkzeug.datastructures import FileStorage
 from werkzeug.utils import secure_filename
 import json
+import modules.records as records
+
+# zstd is optional, stations fall back to gzip when it is not installed
+# pip3 install zstandard
+try:
+    import zstandard as zstd
+except ModuleNotFoundError:
+    zstd = None
 
 '''
 This module contains methods centered around file manipulations including
@@ -36,19 +48,37 @@ checksum verifying, checking file extensions, and so on
 STORAGE_FOLDER = './received_files/'
 DIAGNOSTICS = './diagnostics/'
 # only accept txt and sha256 files
-ALLOWED_EXTENSIONS = ('txt', 'json', 'csv')
+ALLOWED_EXTENSIONS = ('txt', 'json', 'csv', 'rec')
+# binary records, decoded with the schema the station sent beforehand
+RECORD_EXTENSION = '.rec'
+# schemas are stored per station in this subfolder of STORAGE_FOLDER
+SCHEMAS = 'schemas'
+# bundles of files sent in a single request
+BUNDLE_EXTENSIONS = ('tar',)
+# bundle member holding the checksums of all other members
+MANIFEST = 'manifest.json'
+# content encodings stations may compress uploads with, and the suffix used
+# when storing them compressed
+ENCODINGS = {'gzip': '.gz', 'zstd': '.zst'} if zstd is not None \
+    else {'gzip': '.gz'}
+# store compressed uploads as received instead of decompressing them
+STORE_COMPRESSED = False
+# dictionary trained on station files, must match the stations' one
+ZSTD_DICT = './zstd.dict'
 
 ##########
 
 
-def allowed_file(filename: str) -> bool:
+def allowed_file(filename: str,
+                 extensions: tuple = ALLOWED_EXTENSIONS) -> bool:
     '''
     check file extension for validity
     @param filename name of file to check
+    @param extensions extensions to accept
     @return True if allowed file
     '''
     return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+           filename.rsplit('.', 1)[1].lower() in extensions
 
 
 def verify_checksum(file_data: FileStorage, chksm: str) -> True:
@@ -66,6 +96,43 @@ def verify_checksum(file_data: FileStorage, chksm: str) -> True:
     return hashlib.sha256(file_stream.read()).hexdigest() == chksm
 
 
+def decoded_stream(file_data: FileStorage, encoding: str = None):
+    '''
+    Wraps the stream of a file so that reading it decompresses on the fly
+    @param file_data file sent by the station
+    @param encoding content encoding announced by the station, None if the
+        file was sent uncompressed
+    @return readable binary stream positioned at the start of the data
+    '''
+
+    # rewind the raw stream
+    file_stream = file_data.stream
+    file_stream.seek(0)
+
+    if encoding == 'gzip':
+        return gzip.GzipFile(fileobj=file_stream, mode='rb')
+
+    # the decompressors must not close the request's stream, it is read
+    # again after saving to parse the file
+    if encoding == 'zstd':
+        return zstd.ZstdDecompressor(dict_data=load_zstd_dict()) \
+            .stream_reader(file_stream, closefd=False)
+
+    return file_stream
+
+
+def load_zstd_dict():
+    '''
+    Loads the zstd dictionary shared with the stations, if there is one
+    @return zstd.ZstdCompressionDict or None if there is no dictionary
+    '''
+    if not os.path.isfile(ZSTD_DICT):
+        return None
+
+    with open(ZSTD_DICT, 'rb') as in_f:
+        return zstd.ZstdCompressionDict(in_f.read())
+
+
 def get_date(fname: str, reverse: bool = False) -> str:
     '''
     Collects the date from the file's name
@@ -98,17 +165,23 @@ def get_station_num(fname: str) -> str:
 def verify_save_file(data_file: FileStorage,
                      checksum: str,
                      storage_name: str,
-                     store_chkm: bool = False) -> bool:
+                     store_chkm: bool = False,
+                     encoding: str = None) -> bool:
     '''
     Saves a file to a specified directory
     Computes the checksum of saved file to that in parameters
     Deletes file if they don't match
+    Compressed files are decompressed while saving unless STORE_COMPRESSED
+    is set, in which case they are kept as received with the encoding's
+    suffix added to their name
     Precondition: storage_dir is a valid directory, this function will not
         check
     @param data_file File to save
-    @param checksum to compare with checksum computed
+    @param checksum to compare with checksum computed over the bytes sent
     @param storage_name directory to store file
-    @param store_chkm ask to save the checksum as its own file
+    @param store_chkm ask to save the checksum as its own file. The saved
+        checksum is the one of the stored file
+    @param encoding content encoding of data_file, None if uncompressed
     @return dictionary with the data from saved file
     @return True if file is saved and verified with passed checksum
         False otherwise
@@ -124,8 +197,17 @@ def verify_save_file(data_file: FileStorage,
     storage_name = os.path.join(storage_name,
                                 secure_filename(data_file.filename))
 
-    # save file
-    data_file.save(storage_name)
+    # save file as received
+    if encoding is None or STORE_COMPRESSED:
+        if encoding is not None:
+            storage_name += ENCODINGS[encoding]
+        # save() copies from the current position, the checksum read it all
+        data_file.stream.seek(0)
+        data_file.save(storage_name)
+
+    # decompress into the file, hashing what gets stored
+    else:
+        checksum = save_decoded(data_file, storage_name, encoding)
 
     # check to save checksum
     if store_chkm:
@@ -134,17 +216,42 @@ def verify_save_file(data_file: FileStorage,
     return True
 
 
+def save_decoded(data_file: FileStorage,
+                 storage_name: str,
+                 encoding: str) -> str:
+    '''
+    Decompresses a file into storage one chunk at a time
+    @param data_file compressed file sent by the station
+    @param storage_name full path of file to write
+    @param encoding content encoding of data_file
+    @return sha256 checksum of the decompressed file
+    '''
+    hash256 = hashlib.sha256()
+
+    with decoded_stream(data_file, encoding) as in_f, \
+            open(storage_name, 'wb') as out_f:
+        while chunk := in_f.read(shutil.COPY_BUFSIZE):
+            hash256.update(chunk)
+            out_f.write(chunk)
+
+    return hash256.hexdigest()
+
+
 def save_checksum(checksum: str, storage_name: str) -> None:
     '''
     Saves a checksum file in the appropriate format
-    Precondition storage_name has only a single '.' to specify file type
+    Precondition storage_name has only a single '.' to specify file type,
+        plus the compression suffix if stored compressed
     @param checksum value of checksum
     @param storage_name full path (relative or absolute) of file who's
         checksum belongs to. Method will use this to construct its own name
     '''
 
-    # create name of checksum
-    checksum_full_f_name = '.'.join(storage_name.split('.')[:-1]) + '.sha256'
+    # create name of checksum, dropping the compression suffix if any
+    checksum_full_f_name, extension = os.path.splitext(storage_name)
+    if extension in ENCODINGS.values():
+        checksum_full_f_name = os.path.splitext(checksum_full_f_name)[0]
+    checksum_full_f_name += '.sha256'
 
     # get just name of data file
     data_file_name = storage_name.split('/')[-1]
@@ -171,18 +278,164 @@ def make_storage_path(*args: str) -> str:
     return full_path
 
 
-def stream_to_json(data: FileStorage) -> dict:
+def stream_to_json(data: FileStorage, encoding: str = None) -> dict:
     '''
     Takes the bytes from a file storage and returns a json dictionary of the
     file
     Precondition: the file passed through follows the json format
     @param data FileStorage object to read and extract data from
+    @param encoding content encoding of data, None if uncompressed
+    @return dictionary containing the data
+    '''
+
+    # read the json data from the (decompressed) bytestream
+    return json.load(decoded_stream(data, encoding))
+
+
+def is_schema(fname: str) -> bool:
+    '''
+    Checks if a file sent by a station is a record schema
+    Schemas are named station<n>_schema_<id>.json
+    @param fname file name
+    @return True if the file is a schema
+    '''
+    return '_schema_' in fname
+
+
+def open_stored(path: str):
+    '''
+    Opens a stored file for reading, whether it was stored compressed or not
+    @param path path of the stored file, without compression suffix
+    @return readable binary stream of the decompressed contents
+    @raise FileNotFoundError if the file is not stored
+    '''
+    # closing the returned stream closes the stored file as well
+    if os.path.isfile(path + ENCODINGS['gzip']):
+        return gzip.open(path + ENCODINGS['gzip'], 'rb')
+    if 'zstd' in ENCODINGS and os.path.isfile(path + ENCODINGS['zstd']):
+        return zstd.ZstdDecompressor(dict_data=load_zstd_dict()) \
+            .stream_reader(open(path + ENCODINGS['zstd'], 'rb'))
+
+    return open(path, 'rb')
+
+
+def stream_to_record(data: FileStorage,
+                     station_num: str,
+                     encoding: str = None) -> dict:
+    '''
+    Decodes a binary record into the same dictionary a json sample holds
+    Precondition: the schema of the record was already received and stored
+    @param data FileStorage object holding the record
+    @param station_num string in the form station<n>
+    @param encoding content encoding of data, None if uncompressed
     @return dictionary containing the data
+    @raise FileNotFoundError if the schema has not been received
+    '''
+    record = decoded_stream(data, encoding).read()
+
+    # find the schema the record was encoded with
+    schema_name = f'{station_num}_schema_{records.record_schema_id(record)}'
+    with open_stored(stored_file_path(station_num,
+                                      schema_name + '.json')) as in_f:
+        schema = json.load(in_f)
+
+    return records.decode(schema, record)
+
+
+def unpack_bundle(bundle: FileStorage, encoding: str = None) -> list:
+    '''
+    Reads all members of a bundle sent by a station
+    A bundle is a tar archive holding data files plus a MANIFEST member, a
+    json object mapping each data file to its sha256 checksum
+    Members are only read into memory, nothing is extracted to disk
+    Precondition: the bundle's own checksum was already verified
+    @param bundle FileStorage object holding the tar archive
+    @param encoding content encoding of the whole archive, None if
+        uncompressed. Members are returned decompressed
+    @return list of (name, FileStorage, checksum) tuples in archive order.
+        name is the member name as sent by the station and checksum is None
+        if the member is missing from the manifest
+    '''
+
+    # read the archive from the start, decompressing as a stream
+    bundle_stream = decoded_stream(bundle, encoding)
+
+    members = {}
+    with tarfile.open(fileobj=bundle_stream, mode='r|') as tar:
+        for info in tar:
+            # skip directories, links and the like
+            if not info.isfile():
+                continue
+            members[info.name] = tar.extractfile(info).read()
+
+    manifest = json.loads(members.pop(MANIFEST, b'{}'))
+
+    return [(name,
+             FileStorage(stream=io.BytesIO(data),
+                         filename=secure_filename(name)),
+             manifest.get(name, None))
+            for name, data in members.items()]
+
+
+def stored_file_path(station_num: str, fname: str) -> str:
+    '''
+    Builds the path a file sent by a station is stored at
+    Diagnostics are stored per station, data files per station and month
+    @param station_num string in the form station<n>
+    @param fname name of the file as sent by the station
+    @return path of the stored file, without compression suffix
     '''
+    fname = secure_filename(fname)
+
+    if 'diagnostics' in fname:
+        return os.path.join(DIAGNOSTICS, station_num, fname)
+    if is_schema(fname):
+        return os.path.join(STORAGE_FOLDER, station_num, SCHEMAS, fname)
+
+    return os.path.join(STORAGE_FOLDER, station_num, get_date(fname), fname)
 
-    # read the bytes from the file
-    my_file = data.stream
-    my_file.seek(0)
 
-    # read the json data from the bytestream
-    return json.load(my_file)
+def is_stored(station_num: str, fname: str) -> bool:
+    '''
+    Checks if a file sent by a station has already been received
+    Data files are only kept once they have been uploaded to mongo, so a
+    stored file never needs to be ingested again
+    @param station_num string in the form station<n>
+    @param fname name of the file as sent by the station
+    @return True if the file is stored, compressed or not
+    '''
+    try:
+        path = stored_file_path(station_num, fname)
+    except IndexError:  # name without a date, can't have been stored
+        return False
+
+    return any(os.path.isfile(path + suffix)
+               for suffix in ('', *ENCODINGS.values()))
+
+
+def missing_files(station_num: str, names: list) -> list:
+    '''
+    Filters a station's list of pending files down to those not received yet
+    @param station_num string in the form station<n>
+    @param names names of the files the station is about to send
+    @return names of the files the server is missing, in the same order
+    '''
+    return [name for name in names
+            if name != '' and not is_stored(station_num, name)]
+
+
+def discard_file(storage_name: str, fname: str) -> None:
+    '''
+    Removes a stored file and its checksum, used when a file was saved but
+    could not be processed so that the station sends it again
+    @param storage_name directory the file is stored in
+    @param fname name of the file as sent by the station
+    '''
+    path = os.path.join(storage_name, secure_filename(fname))
+    for suffix in ('', *ENCODINGS.values()):
+        if os.path.isfile(path + suffix):
+            os.remove(path + suffix)
+
+    checksum_path = os.path.splitext(path)[0] + '.sha256'
+    if os.path.isfile(checksum_path):
+        os.remove(checksum_path)
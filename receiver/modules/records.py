@@ -0,0 +1,160 @@
+'''
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+import json
+import struct
+import hashlib
+
+'''
+This module decodes the binary records sent by the stations back into the
+dictionaries Mongo.upload_to_mongodb expects
+A record only holds measurements, the layout is described by a schema the
+station sends beforehand. The layout is documented in the station's
+packages/records.py, both modules must be kept in sync
+'''
+
+##########
+
+# constants definitions
+
+GPS = 'date_time_position'
+FLAGS = 'diagnostics'
+ID_LEN = 4
+
+##########
+
+
+def schema_id(schema: dict) -> str:
+    '''
+    Identifies a schema by the hash of its contents
+    @param schema schema to identify
+    @return id as an hexadecimal string, as found in schema file names
+    '''
+    text = json.dumps(schema, sort_keys=True).encode()
+    return hashlib.sha256(text).digest()[:ID_LEN].hex()
+
+
+def record_schema_id(record: bytes) -> str:
+    '''
+    Reads the id of the schema a record was encoded with
+    @param record record sent by a station
+    @return id as an hexadecimal string
+    '''
+    return record[:ID_LEN].hex()
+
+
+def flag_code(bits: list) -> str:
+    '''
+    Picks the integer holding a group's flags
+    @param bits list of [name, bit] pairs
+    @return struct format code
+    '''
+    top = max([bit for _, bit in bits], default=0)
+    if top < 2**8:
+        return 'B'
+    if top < 2**16:
+        return 'H'
+
+    return 'I'
+
+
+def group_format(group: dict) -> str:
+    '''
+    Builds the struct format of a group in a record
+    @param group group from the schema
+    @return struct format without byte order
+    '''
+    fmt = f'{(len(group["fields"]) + 7) // 8}s'
+    fmt += ''.join(code for _, code in group['fields'])
+    if group['flags'] is not None:
+        fmt += flag_code(group['flags'])
+
+    return fmt
+
+
+def record_struct(schema: dict) -> struct.Struct:
+    '''
+    Builds the struct of a whole record
+    @param schema schema of the record
+    @return compiled struct
+    '''
+    fmt = f'<{ID_LEN}s{(len(schema["groups"]) + 7) // 8}s'
+    fmt += ''.join(group_format(group) for group in schema['groups'])
+
+    return struct.Struct(fmt)
+
+
+def unpack_group(group: dict, values) -> dict:
+    '''
+    Rebuilds a sensor's reading from the values of its group
+    @param group group from the schema
+    @param values iterator over the unpacked record, positioned at the group
+    @return dictionary as returned by the sensor
+    '''
+    nulls = int.from_bytes(next(values), 'little')
+    reading = dict(group['constants'])
+
+    for i, (key, code) in enumerate(group['fields']):
+        value = next(values)
+        if nulls >> i & 1:
+            value = None
+        elif code.endswith('s'):
+            value = value.rstrip(b'\0').decode()
+        reading[key] = value
+
+    if group['flags'] is not None:
+        packed = next(values)
+        reading[FLAGS] = {flag: packed & bit != 0
+                          for flag, bit in group['flags']}
+
+    # restore the order of the keys
+    return {key: reading[key] for key in group['keys']}
+
+
+def decode(schema: dict, record: bytes) -> dict:
+    '''
+    Decodes a record
+    @param schema schema the record was encoded with
+    @param record record sent by a station
+    @return sample, in the same form data_collection saves as json
+    '''
+    if record_schema_id(record) != schema_id(schema):
+        raise ValueError('Record does not match schema')
+
+    values = iter(record_struct(schema).unpack(record))
+    next(values)  # schema id
+    present = int.from_bytes(next(values), 'little')
+
+    # sensors that did not report stay None
+    data = {category: None if category == GPS
+            else [None] * schema['slots'][category]
+            for category in schema['order']}
+
+    for i, group in enumerate(schema['groups']):
+        reading = unpack_group(group, values)
+        if not present >> i & 1:
+            continue
+
+        if group['slot'] is None:
+            data[group['category']] = reading
+        else:
+            data[group['category']][group['slot']] = reading
+
+    return data
@@ -20,8 +20,10 @@ You should have received a copy of the GNU General Public License along with
 '''
 
 import os
-import datetime
-from flask import Flask, request
+import json
+import time
+import tarfile
+from flask import Flask, request, g, jsonify, abort
 from werkzeug.datastructures import FileStorage
 from random import choice
 from string import ascii_letters
@@ -29,6 +31,7 @@ from pymongo.errors import ConnectionFailure
 # for safety and consistency, we should change to Flask-PyMongo
 import modules.files as files
 import modules.mongo as mongo
+from modules.logger import Logger
 import secret
 
 '''
@@ -59,29 +62,29 @@ URL_LEN = 20
 MONGO_ADDR = '10.224.83.51'
 MONGO_PORT = 27017
 DATABASE = 'stations'
+# log files, one per month
+LOG_FOLDER = 'logs'
+LOG_NAME = '{year}_{month}.txt'
+# addresses allowed to read the recent logs at /debug/logs
+DEBUG_ADDRESSES = ('127.0.0.1', '::1')
 
 ##########
 
 # global variable definitions
 urls = mongodb = None
+logger = Logger(LOG_FOLDER, LOG_NAME)
 
 
-def log(msg: str) -> None:
+def log(msg: str, **fields) -> None:
     '''
     Write any logging information into the appropriate log file
-    Log files are separated by month
+    Log files are separated by month. The line is written by a background
+    thread (see modules/logger.py), requests never wait on the file
     @param msg message to write
+    @param fields key/value pairs written after the message (i.e
+        station='station3')
     '''
-
-    # get current time
-    now = datetime.datetime.now()
-    year = now.year
-    month = now.month
-
-    # change to db
-    with open(f'logs/{year}_{month}.txt', 'a', encoding='utf-8') as f:
-        f.write(now.strftime('[%Y-%m-%d %H:%M:%S] '))
-        f.write(f'{msg}\n')
+    logger.log(msg, **fields)
 
 
 def gen_rand_string(length: int = URL_LEN) -> str:
@@ -121,7 +124,8 @@ def init_data() -> None:
 def authenticate_request(pi_id: str,
                          headers: list = [],
                          check_files: bool = False,
-                         rqs_file: FileStorage = None) -> str:
+                         rqs_file: FileStorage = None,
+                         extensions: tuple = files.ALLOWED_EXTENSIONS) -> str:
     '''
     Checks that all the passed arguments not none and are present in the
     request
@@ -130,6 +134,7 @@ def authenticate_request(pi_id: str,
     @param check_files boolean to indicate files where passed for checking
     @param rqs_file if request passes files, also check those. These need to
         be checked for accepted data types as well
+    @param extensions file extensions accepted for rqs_file
     @return appropriate error code if error is encountered, empty string if
         everything is okay
     '''
@@ -157,7 +162,7 @@ def authenticate_request(pi_id: str,
         return '412'
 
     # check for supported file type
-    elif not files.allowed_file(rqs_file.filename):
+    elif not files.allowed_file(rqs_file.filename, extensions):
         log('Unsupported file type')
         return '415'
 
@@ -171,7 +176,8 @@ def authenticate_request(pi_id: str,
 urls = {}
 
 app = Flask(__name__)
-app.config['MAX_CONTENT_LENGTH'] = 1024 * 128  # max file size (in KB)
+app.config['MAX_CONTENT_LENGTH'] = 1024 * 128  # max file size (in KB),
+# compressed uploads count for their compressed size
 
 mongodb = mongo.Mongo(MONGO_ADDR,
                       MONGO_PORT,
@@ -188,6 +194,73 @@ log('Server running')
 ##########
 
 
+@app.before_request
+def start_timer() -> None:
+    '''
+    Times every request, see log_request()
+    '''
+    g.start = time.monotonic()
+
+
+@app.after_request
+def log_request(response):
+    '''
+    Logs every request with its route, response, time taken and station
+    Routes answer with their code at the start of the body (i.e "301
+    <rand_str>"), which is logged as code. Bundles are answered with a code
+    per file and log none
+    @param response response of the route
+    @return response unchanged
+    '''
+    latency = time.monotonic() - g.get('start', time.monotonic())
+    body = '' if response.direct_passthrough else \
+        response.get_data(as_text=True)
+    code = body.split(maxsplit=1)[0] if body.strip() else ''
+    log('Request',
+        route=request.path,
+        method=request.method,
+        status=response.status_code,
+        code=code if code.isdigit() else '',
+        latency_ms=round(latency * 1000),
+        station=station_name(request.headers.get('pi_num', None)))
+
+    return response
+
+
+def station_name(pi_num: str) -> str:
+    '''
+    @param pi_num number of the station, as in the pi_num header
+    @return station name in the form "station<n>", empty if pi_num is None
+    '''
+    return '' if pi_num is None else f'station{pi_num}'
+
+
+@app.route('/debug/logs', methods=['GET'])
+def recent_logs():
+    '''
+    Recent log entries kept in memory, only answered on the server itself
+    Query arguments filter the entries by field, n limits their number
+    i.e curl -k 'https://127.0.0.1:3500/debug/logs?station=station3&n=20'
+    @return json list of entries, oldest first
+    '''
+    if request.remote_addr not in DEBUG_ADDRESSES:
+        abort(404)
+
+    match = request.args.to_dict()
+    n = match.pop('n', None)
+    try:
+        n = int(n) if n is not None else None
+    except ValueError:
+        n = None
+
+    # query arguments are strings, compare against the fields as strings
+    entries = [entry for entry in logger.recent(n=None)
+               if all(str(entry.get(key, None)) == value
+                      for key, value in match.items())]
+
+    return jsonify(entries if n is None else entries[-n:])
+
+
 @app.route('/', methods=['GET'])
 def home() -> str:
     '''
@@ -243,32 +316,199 @@ def register() -> str:
     return '200'  # succesfully saved file
 
 
-@app.route('/upload/', methods=['GET'])
+@app.route('/upload/', methods=['GET', 'POST'])
 def authenticate() -> str:
     '''
     Main channel to receive data. This route constantly listens to all stations
     and when contacted, authenticats the station and creates a temporary
     dedicated url for that station to send data through
-    @return "301 <rand_str>" if successfully verified, "<error_code>" otherwise
+    Stations may POST the list of files they are about to send
+    (pending_files, one name per line, compressed as announced by the
+    'encoding' header). The server then answers with the names it is missing,
+    one per line after the "301 <rand_str>" line, so files that already
+    reached the server are not sent again
+    @return "301 <rand_str>" if successfully verified, followed by the missing
+        files if the station sent its pending files. "200" if the server
+        already has all pending files, "<error_code>" otherwise
     The temporary url created will have the form "/upload/<rand_str>"
     '''
     # collect headers from request
     auth = request.headers.get('pi_id', None)
+    station_num = request.headers.get('pi_num', None)
+    encoding = request.headers.get('encoding', None)
+    pending = request.files.get('pending_files', None)
 
     rsp = authenticate_request(auth)
     if rsp != '':
         return rsp
 
+    # find which of the station's pending files haven't been received yet
+    missing = None
+    if pending is not None and station_num is not None:
+        if encoding is not None and encoding not in files.ENCODINGS:
+            log('Unsupported encoding', encoding=encoding)
+            return '415'
+
+        names = files.decoded_stream(pending, encoding).read().decode()
+        missing = files.missing_files(f'station{station_num}',
+                                      names.split('\n'))
+
+        # nothing to send, no need for an upload channel
+        if len(missing) == 0:
+            log('Nothing missing', pi_id=auth,
+                station=station_name(station_num))
+            return '200'
+
     # generate random url for data transfer
     url = gen_rand_string()
-    log(f'New request from {auth}, opening /upload/{url}')
+    log('Upload channel opened', pi_id=auth,
+        station=station_name(station_num), url=f'/upload/{url}')
 
     # store mapping of id to random url
     urls[url] = auth
 
+    if missing is not None:
+        return '\n'.join([f'301 {url}', *missing])
+
     return f'301 {url}'
 
 
+def store_data_file(datafile: FileStorage,
+                    checksum: str,
+                    station_num: str,
+                    encoding: str = None) -> str:
+    '''
+    Verifies and stores a single file sent by a station
+    Data files are also uploaded to mongo, diagnostics are only stored
+    @param datafile file sent by the station
+    @param checksum sha256 checksum the station computed for datafile
+    @param station_num string in the form "station<n>"
+    @param encoding content encoding of datafile, None if uncompressed
+    @return response code for this file
+    '''
+
+    # already received, answer as if stored so mongo gets no duplicates
+    if files.is_stored(station_num, datafile.filename):
+        log('File already received', station=station_num,
+            file=datafile.filename)
+        return '200'
+
+    # create storage path for the files to store
+    if 'diagnostics' in datafile.filename:
+        storage_path = files.make_storage_path(files.DIAGNOSTICS, station_num)
+
+        # store and do not upload to mongo
+        if files.verify_save_file(datafile,
+                                  checksum,
+                                  storage_path,
+                                  store_chkm=True,
+                                  encoding=encoding):
+            return '200'
+        else:
+            return '500'
+
+    # record schemas are only stored, records are decoded with them
+    if files.is_schema(datafile.filename):
+        files.make_storage_path(files.STORAGE_FOLDER, station_num)
+        storage_path = files.make_storage_path(files.STORAGE_FOLDER,
+                                               station_num,
+                                               files.SCHEMAS)
+
+        if files.verify_save_file(datafile,
+                                  checksum,
+                                  storage_path,
+                                  store_chkm=True,
+                                  encoding=encoding):
+            return '200'
+        else:
+            return '500'
+
+    storage_path = \
+        files.make_storage_path(files.STORAGE_FOLDER,
+                                station_num,
+                                files.get_date(datafile.filename))
+
+    # make sure checksum matches the file transfered
+    if not files.verify_save_file(datafile,
+                                  checksum,
+                                  storage_path,
+                                  store_chkm=True,
+                                  encoding=encoding):
+        return '500'
+
+    # if checksum matched, upload to mongo
+    # a file is only kept once it is in mongo, otherwise the station would
+    # be told it has been received
+    try:
+        if datafile.filename.endswith(files.RECORD_EXTENSION):
+            data = files.stream_to_record(datafile, station_num, encoding)
+        else:
+            data = files.stream_to_json(datafile, encoding)
+        mongodb.upload_to_mongodb(data,
+                                  files.get_date(datafile.filename),
+                                  station_num)
+    except Exception as e:
+        log('Error uploading to mongo', station=station_num,
+            file=datafile.filename, error=str(e))
+        files.discard_file(storage_path, datafile.filename)
+        return '500'
+
+    return '200'
+
+
+def store_bundle(bundle: FileStorage,
+                 checksum: str,
+                 station_num: str,
+                 encoding: str = None) -> str:
+    '''
+    Verifies, stores and ingests every member of a bundle sent by a station
+    Each member is checked against its own checksum from the bundle manifest
+    so a single damaged member does not reject the rest
+    @param bundle tar archive sent by the station
+    @param checksum sha256 checksum of the whole archive
+    @param station_num string in the form "station<n>"
+    @param encoding content encoding of the whole archive, None if
+        uncompressed
+    @return json object mapping each member to its response code, or a
+        single error code if the bundle itself could not be read
+    '''
+
+    # the archive as a whole must arrive intact before reading it
+    if not files.verify_checksum(bundle, checksum):
+        log('Bundle checksum failed', station=station_num)
+        return '500'
+
+    try:
+        members = files.unpack_bundle(bundle, encoding)
+    except (tarfile.TarError, OSError, ValueError) as e:
+        log('Unreadable bundle', station=station_num, error=str(e))
+        return '415'
+
+    results = {}
+    for name, datafile, member_checksum in members:
+        if member_checksum is None:
+            log('File missing from bundle manifest', station=station_num,
+                file=name)
+            results[name] = '412'
+        elif not files.allowed_file(datafile.filename):
+            log('Unsupported file type', station=station_num, file=name)
+            results[name] = '415'
+        else:
+            # keep going if a member fails, the station will resend it alone
+            try:
+                results[name] = store_data_file(datafile,
+                                                member_checksum,
+                                                station_num)
+            except Exception as e:
+                log('Error storing file', station=station_num, file=name,
+                    error=str(e))
+                results[name] = '500'
+
+    log('Bundle stored', station=station_num, files=len(results))
+
+    return json.dumps(results)
+
+
 @app.route('/upload/<url>', methods=['POST'])
 def get_data(url: str) -> str:
     '''
@@ -279,6 +519,11 @@ def get_data(url: str) -> str:
     Then it will verify that url has been assigned to the station contacting
     and will only then attempt to recive the files
     Any file downloaded will have its checksum verified
+    Files may be compressed, as announced by the 'encoding' header. The
+    checksum then covers the compressed bytes
+    A request carries either a single file (sensor_data_file) or a bundle of
+    files (sensor_data_bundle). Bundles are answered with a json object
+    holding a response code per member
     Once no files are left to download, this method must pop url from the
     global variable urls
     '''
@@ -289,17 +534,29 @@ def get_data(url: str) -> str:
     station_num = request.headers.get('pi_num', None)
     # collect files
     datafile = request.files.get('sensor_data_file', None)
-    # check how many remaining files
+    bundle = request.files.get('sensor_data_bundle', None)
+    # check how many remaining requests
     # all arguments are in string form
     num_files = request.headers.get('num_files', '1')
+    # compression used by the station, if any
+    encoding = request.headers.get('encoding', None)
 
     # authenticate all information received is okay
-    rsp = authenticate_request(auth, [checksum, station_num], check_files=True,
-                               rqs_file=datafile)
+    if bundle is not None:
+        rsp = authenticate_request(auth, [checksum, station_num],
+                                   check_files=True, rqs_file=bundle,
+                                   extensions=files.BUNDLE_EXTENSIONS)
+    else:
+        rsp = authenticate_request(auth, [checksum, station_num],
+                                   check_files=True, rqs_file=datafile)
 
     if rsp != '':
         return rsp
 
+    if encoding is not None and encoding not in files.ENCODINGS:
+        log('Unsupported encoding', encoding=encoding)
+        return '415'
+
     if num_files == '1':
         # remove url - pi pair from existing urls
         urls.pop(url)
@@ -307,34 +564,7 @@ def get_data(url: str) -> str:
     # modify station_num for easier use later on the file
     station_num = f'station{station_num}'
 
-    # create storage path for the files to store
-    if 'diagnostics' in datafile.filename:
-        storage_path = files.make_storage_path(files.DIAGNOSTICS, station_num)
-
-        # store and do not upload to mongo
-        if files.verify_save_file(datafile,
-                                  checksum,
-                                  storage_path,
-                                  store_chkm=True):
-            return '200'
-        else:
-            return '500'
-
-    storage_path = \
-        files.make_storage_path(files.STORAGE_FOLDER,
-                                station_num,
-                                files.get_date(datafile.filename))
+    if bundle is not None:
+        return store_bundle(bundle, checksum, station_num, encoding)
 
-    # make sure checksum matches the file transfered
-    if not files.verify_save_file(datafile,
-                                  checksum,
-                                  storage_path,
-                                  store_chkm=True):
-        return '500'
-
-    # if checksum matched, upload to mongo
-    mongodb.upload_to_mongodb(files.stream_to_json(datafile),
-                              files.get_date(datafile.filename),
-                              station_num)
-
-    return '200'
+    return store_data_file(datafile, checksum, station_num, encoding)
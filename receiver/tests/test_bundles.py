@@ -0,0 +1,84 @@
+'''
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+import io
+import gzip
+import json
+import hashlib
+import tarfile
+from werkzeug.datastructures import FileStorage
+import modules.files as files
+
+'''
+Bundles: tar archives of several files plus a manifest of their checksums
+'''
+
+##########
+
+MEMBERS = {'station1_2022-01-01T000000Z.json': b'{"a": 1}',
+           'station1_2022-01-01T001000Z.json': b'{"b": 2}'}
+
+##########
+
+
+def make_bundle(members: dict, manifest: dict) -> bytes:
+    '''
+    @return tar archive of members, the manifest last, as stations send it
+    '''
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        for name, data in [*members.items(),
+                           (files.MANIFEST, json.dumps(manifest).encode())]:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+        # stations never send directories, they must be skipped anyway
+        folder = tarfile.TarInfo('folder')
+        folder.type = tarfile.DIRTYPE
+        tar.addfile(folder)
+
+    return buffer.getvalue()
+
+
+def test_unpack_bundle():
+    manifest = {name: hashlib.sha256(data).hexdigest()
+                for name, data in MEMBERS.items()}
+    bundle = FileStorage(stream=io.BytesIO(make_bundle(MEMBERS, manifest)))
+
+    unpacked = files.unpack_bundle(bundle)
+
+    assert [name for name, _, _ in unpacked] == list(MEMBERS)
+    for name, member, checksum in unpacked:
+        assert member.filename == name
+        assert checksum == manifest[name]
+        assert files.verify_checksum(member, checksum)
+
+
+def test_unpack_compressed_bundle():
+    sent = gzip.compress(make_bundle(MEMBERS, {}))
+    bundle = FileStorage(stream=io.BytesIO(sent))
+
+    unpacked = files.unpack_bundle(bundle, 'gzip')
+
+    # members missing from the manifest have no checksum to be checked with
+    assert [(name, checksum) for name, _, checksum in unpacked] == \
+        [(name, None) for name in MEMBERS]
+    assert [member.stream.read() for _, member, _ in unpacked] == \
+        list(MEMBERS.values())
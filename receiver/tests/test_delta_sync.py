@@ -0,0 +1,86 @@
+'''
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+import os
+import pytest
+import modules.files as files
+
+'''
+Delta sync: the receiver tells stations which of their pending files it is
+still missing
+'''
+
+##########
+
+STATION = 'station1'
+DATA = 'station1_2022-01-01T000000Z.json'
+
+##########
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    '''
+    Empty storage and diagnostics folders
+    '''
+    monkeypatch.setattr(files, 'STORAGE_FOLDER', str(tmp_path / 'received'))
+    monkeypatch.setattr(files, 'DIAGNOSTICS', str(tmp_path / 'diagnostics'))
+    return tmp_path
+
+
+def store(name: str, suffix: str = '') -> None:
+    '''
+    Stores an empty file as the receiver would
+    '''
+    path = files.stored_file_path(STATION, name) + suffix
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+
+
+def test_nothing_stored(storage):
+    names = [DATA, 'station1_2022-01-01T000000Z_diagnostics.json']
+
+    assert files.missing_files(STATION, names) == names
+
+
+@pytest.mark.parametrize('suffix', ['', *files.ENCODINGS.values()])
+def test_stored_data(storage, suffix):
+    other = 'station1_2022-02-01T000000Z.json'
+    store(DATA, suffix)
+
+    assert files.is_stored(STATION, DATA)
+    assert files.missing_files(STATION, [DATA, other]) == [other]
+    # files of other stations are separate
+    assert files.missing_files('station2', [DATA]) == [DATA]
+
+
+def test_stored_diagnostics_and_schemas(storage):
+    diagnostics = 'station1_2022-01-01T000000Z_diagnostics.json'
+    schema = 'station1_schema_0a1b2c3d.json'
+    store(diagnostics)
+    store(schema)
+
+    assert files.missing_files(STATION, [diagnostics, schema, DATA]) == [DATA]
+
+
+def test_odd_names(storage):
+    # blank lines are dropped, names without a date can't be stored yet
+    assert files.missing_files(STATION, ['', 'notes.txt', DATA]) == \
+        ['notes.txt', DATA]
@@ -0,0 +1,119 @@
+'''
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+import io
+import gzip
+import json
+import hashlib
+import pytest
+from werkzeug.datastructures import FileStorage
+import modules.files as files
+
+'''
+Upload decoding: a file is checked against the checksum of the bytes sent,
+stored decompressed, then parsed again from the same request stream, as
+receiver.store_data_file does
+'''
+
+##########
+
+FNAME = 'station1_2022-01-01T000000Z.json'
+SAMPLE = {'date_time_position': {'date': '2022-01-01'},
+          'sensors': {'particulate_matter': [{'pm2.5': 12.5}]}}
+
+##########
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    '''
+    @param data bytes to send
+    @param encoding content encoding, None to send them as they are
+    @return bytes as the station sends them
+    '''
+    if encoding == 'gzip':
+        return gzip.compress(data)
+    if encoding == 'zstd':
+        return files.zstd.ZstdCompressor().compress(data)
+
+    return data
+
+
+def upload(data: bytes, fname: str = FNAME) -> FileStorage:
+    '''
+    @return the file as flask hands it to the receiver
+    '''
+    return FileStorage(stream=io.BytesIO(data), filename=fname)
+
+
+@pytest.mark.parametrize('encoding', [None, *files.ENCODINGS])
+def test_save_then_parse(tmp_path, encoding):
+    raw = json.dumps(SAMPLE).encode()
+    sent = compress(raw, encoding)
+    datafile = upload(sent)
+
+    assert files.verify_save_file(datafile, hashlib.sha256(sent).hexdigest(),
+                                  str(tmp_path), store_chkm=True,
+                                  encoding=encoding)
+    # the request stream is still readable once the file is stored
+    assert files.stream_to_json(datafile, encoding) == SAMPLE
+
+    with files.open_stored(str(tmp_path / FNAME)) as in_f:
+        assert in_f.read() == raw
+
+    # the stored checksum is the one of the decompressed file
+    stored = (tmp_path / FNAME.replace('.json', '.sha256')).read_text()
+    assert stored.split()[0] == hashlib.sha256(raw).hexdigest()
+
+
+@pytest.mark.parametrize('encoding', list(files.ENCODINGS))
+def test_stored_compressed(tmp_path, monkeypatch, encoding):
+    monkeypatch.setattr(files, 'STORE_COMPRESSED', True)
+    raw = json.dumps(SAMPLE).encode()
+    sent = compress(raw, encoding)
+    datafile = upload(sent)
+
+    assert files.verify_save_file(datafile, hashlib.sha256(sent).hexdigest(),
+                                  str(tmp_path), store_chkm=True,
+                                  encoding=encoding)
+    stored = tmp_path / (FNAME + files.ENCODINGS[encoding])
+    assert stored.read_bytes() == sent
+    assert files.stream_to_json(datafile, encoding) == SAMPLE
+    with files.open_stored(str(tmp_path / FNAME)) as in_f:
+        assert json.load(in_f) == SAMPLE
+
+    # discarded with its checksum, whatever its suffix
+    files.discard_file(str(tmp_path), FNAME)
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize('encoding', list(files.ENCODINGS))
+def test_corrupt_upload(encoding):
+    sent = compress(json.dumps(SAMPLE).encode(), encoding)[:-8]
+
+    with pytest.raises(Exception):
+        files.stream_to_json(upload(sent), encoding)
+
+
+def test_bad_checksum_not_saved(tmp_path):
+    sent = gzip.compress(json.dumps(SAMPLE).encode())
+
+    assert not files.verify_save_file(upload(sent), 'bad', str(tmp_path),
+                                      encoding='gzip')
+    assert list(tmp_path.iterdir()) == []
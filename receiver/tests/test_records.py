@@ -0,0 +1,194 @@
+'''
+Copyright (C) 2022 Francesco Paparella, Pedro Velasquez
+
+This file is part of "ACCESS IOT Stations".
+
+"ACCESS IOT Stations" is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"ACCESS IOT Stations" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"ACCESS IOT Stations". If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+import io
+import os
+import json
+import importlib.util
+import pytest
+from werkzeug.datastructures import FileStorage
+import modules.files as files
+import modules.records as records
+
+'''
+Binary records: samples encoded by the station's packages/records.py are
+decoded by the receiver back into the dictionary the station built
+'''
+
+##########
+
+STATION_RECORDS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               '..', '..', 'data_collection', 'packages',
+                               'records.py')
+
+##########
+
+
+@pytest.fixture(scope='module')
+def station():
+    '''
+    @return the station's records module
+    '''
+    spec = importlib.util.spec_from_file_location('station_records',
+                                                  STATION_RECORDS)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def nextpm(index: int, status: int) -> dict:
+    '''
+    @param index index of the sensor in its category
+    @param status status byte of the sensor
+    @return reading of a NextPM sensor
+    '''
+    return {
+        'type': 'nextpm',
+        'sensor': f'particulate_matter{index}',
+        'PM1count': 120,
+        'PM2,5mass': 12.5,
+        'sensor_T': None,
+        'diagnostics': {
+            'Degraded': (status & 2) != 0,
+            'Notready': (status & 4) != 0,
+            'Fan_error': (status & 32) != 0,
+            'Las_error': (status & 128) != 0,
+        },
+    }
+
+
+def sample(pm1: dict = None) -> dict:
+    '''
+    @param pm1 reading of the second particulate matter sensor
+    @return sample as built by data_collection
+    '''
+    return {
+        'date_time_position': {'date': '2022-01-01', 'time': '10:00:00',
+                               'latitude': 24.52, 'longitude': None},
+        'particulate_matter': [nextpm(0, 2 | 128), pm1],
+        'air_sensor': [{'type': 'bme280', 'sensor': 'air_sensor0',
+                        'temperature': 31.2, 'pressure': 1012.5,
+                        'humidity': 40.1, 'samples': 2**40,
+                        'heater': False}],
+    }
+
+
+def round_trip(encoder, data: dict) -> tuple:
+    '''
+    Encodes a sample on the station side and decodes it on the receiver side,
+    through the json the schema is sent as
+    @return (new schema or None, decoded sample)
+    '''
+    new_schema, record = encoder.encode(data)
+    schema = json.loads(json.dumps(encoder.schema))
+
+    return new_schema, records.decode(schema, record)
+
+
+def test_round_trip(station):
+    encoder = station.RecordEncoder()
+    data = sample()
+
+    new_schema, decoded = round_trip(encoder, data)
+
+    assert new_schema is not None
+    assert decoded == data
+    # keys come back in the order the sensors returned them
+    assert list(decoded['air_sensor'][0]) == list(data['air_sensor'][0])
+
+
+def test_flags(station):
+    encoder = station.RecordEncoder()
+    data = sample()
+
+    for status in (0, 2, 4 | 32, 255):
+        data['particulate_matter'][0] = nextpm(0, status)
+        assert round_trip(encoder, data)[1] == data
+
+
+def test_schema_cache(station):
+    encoder = station.RecordEncoder()
+    first = sample()
+    round_trip(encoder, first)
+
+    # same layout, other values: no new schema
+    second = sample()
+    second['air_sensor'][0]['temperature'] = 12.0
+    second['date_time_position']['longitude'] = 54.4
+    assert round_trip(encoder, second) == (None, second)
+
+    # a sensor reporting for the first time changes the layout
+    third = sample(nextpm(1, 0))
+    new_schema, decoded = round_trip(encoder, third)
+    assert new_schema is not None
+    assert decoded == third
+
+    # a sensor of the schema missing from a record decodes as None
+    assert round_trip(encoder, first) == (None, first)
+
+
+def test_schema_id(station):
+    schema = station.build_schema(sample())
+    record = station.encode(schema, sample())
+
+    assert station.schema_id(schema).hex() == records.schema_id(schema)
+    assert records.record_schema_id(record) == records.schema_id(schema)
+
+    other = station.build_schema(sample(nextpm(1, 0)))
+    with pytest.raises(ValueError):
+        records.decode(other, record)
+
+
+def test_stream_to_record(station, tmp_path, monkeypatch):
+    monkeypatch.setattr(files, 'STORAGE_FOLDER', str(tmp_path))
+    data = sample()
+    schema, record = station.RecordEncoder().encode(data)
+    schema_name = f'station1_schema_{records.schema_id(schema)}.json'
+    path = files.stored_file_path('station1', schema_name)
+    os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as out_f:
+        json.dump(schema, out_f)
+
+    upload = FileStorage(stream=io.BytesIO(record),
+                         filename='station1_2022-01-01T100000Z' +
+                         files.RECORD_EXTENSION)
+
+    assert files.stream_to_record(upload, 'station1') == data
+
+    # records whose schema never arrived can't be decoded
+    upload.stream.seek(0)
+    with pytest.raises(FileNotFoundError):
+        files.stream_to_record(upload, 'station2')
+
+
+def test_timed_out_sensor(station):
+    encoder = station.RecordEncoder()
+    # data_collection.timeout_reading stands for a sensor that timed out
+    timed_out = {'type': 'nextpm', 'sensor': 'particulate_matter1',
+                 'diagnostics': {'timeout': True}}
+    data = sample(timed_out)
+
+    assert round_trip(encoder, data)[1] == data
+
+    # back to measuring, a new layout
+    data = sample(nextpm(1, 0))
+    new_schema, decoded = round_trip(encoder, data)
+    assert new_schema is not None
+    assert decoded == data